@@ -0,0 +1,195 @@
+"""
+Benchmark suite for the whole ETL path on synthetic data.
+Times dedup, weather interpolation, cleaning, the weather and other dimensions, the fact table
+and the save path at several sizes, stores the results per commit and compares them to a baseline.
+
+The save path is timed as COPY serialization of every star table (no database needed);
+with --postgres the tables are also loaded into the database in etl.load.POSTGRES_CONFIG.
+50M rows need roughly 16 GB of memory.
+
+Run from the src directory:
+    python -m benchmarks.bench_etl --sizes 1M,10M,50M
+    python -m benchmarks.bench_etl --sizes 1M --baseline ./Data/benchmarks/<commit>.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import generate_carriers, generate_flights, generate_stations
+from etl.bulk_load import iter_copy_chunks
+from etl.extract import extract_airports_data
+from etl.load import (POSTGRES_CONFIG, create_fact_table,
+                      create_star_schema_dimensions, create_weather_dimension,
+                      save_to_postgresql)
+from etl.transform import (clean_flights_csv_data,
+                           interpolate_all_weather_columns, remove_duplicates)
+from utils.instrumentation import run_stage, start_run
+
+RESULTS_DIR = "./Data/benchmarks"
+
+
+def parse_size(text):
+    """Row count from '1M', '500K' or '1000000'"""
+    text = text.strip().upper()
+    factor = {'K': 1_000, 'M': 1_000_000}.get(text[-1:], 1)
+    return int(float(text[:-1] if factor > 1 else text) * factor)
+
+
+def serialize_copy_chunks(star_schema):
+    """Render every star table as the CSV chunks COPY would send; returns the bytes produced"""
+    return sum(len(chunk) for df in star_schema.values() for chunk in iter_copy_chunks(df))
+
+
+def git_commit():
+    """Short commit hash of the working tree ('-dirty' if it has changes), or 'unknown'"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return f"{commit}-dirty" if dirty else commit
+
+
+def _stations_frame(airports):
+    """Stations data as extract_airports_data returns it"""
+    buffer = io.StringIO()
+    generate_stations(airports).to_csv(buffer, index=False)
+    buffer.seek(0)
+    stations = extract_airports_data(buffer, ['AIRPORT', 'DISPLAY_AIRPORT_CITY_NAME_FULL', 'AIRPORT_STATE_NAME'])
+    stations['city'] = stations['city'].str.replace(r',\s*[A-Z]{2}$', '', regex=True)
+    return stations
+
+
+def run_size(rows, seed=0, postgres=False):
+    """Run every benchmarked stage once on `rows` synthetic rows; returns the stage records"""
+    start = time.perf_counter()
+    flights = generate_flights(rows, seed=seed)
+    generate_seconds = time.perf_counter() - start
+    airports = _stations_frame(flights['ORIGIN'].cat.categories.size)
+    carriers = generate_carriers()
+
+    run = start_run()
+    with contextlib.redirect_stdout(io.StringIO()):
+        flights = run_stage('remove_duplicates', remove_duplicates, flights,
+                            subset=['FL_DATE', 'TAIL_NUM', 'CRS_DEP_TIME'])
+        flights = run_stage('interpolate_all_weather_columns', interpolate_all_weather_columns, flights)
+        flights = run_stage('clean_flights_csv_data', clean_flights_csv_data, flights)
+        run_stage('create_weather_dimension', create_weather_dimension, flights)
+        dimensions = run_stage('create_star_schema_dimensions', create_star_schema_dimensions,
+                               flights, airports, carriers)
+        fact_flights = run_stage('create_fact_table', create_fact_table, flights, dimensions)
+        star_schema = {'fact_flights': fact_flights, **dimensions}
+        run_stage('save.copy_serialize', serialize_copy_chunks, star_schema)
+        if postgres:
+            run_stage('save.save_to_postgresql', save_to_postgresql, star_schema, **POSTGRES_CONFIG)
+
+    results = {'generate': {'wall_seconds': round(generate_seconds, 4), 'rows_out': rows}}
+    for record in run['stages']:
+        rows_in = record['rows_in'] or 0
+        results[record['stage']] = {
+            'wall_seconds': record['wall_seconds'],
+            'cpu_seconds': record['cpu_seconds'],
+            'rows_in': record['rows_in'],
+            'rows_out': record['rows_out'],
+            'rows_per_sec': round(rows_in / record['wall_seconds']) if record['wall_seconds'] else None,
+            'peak_rss_mb': round(record['peak_rss_mb'], 1)
+        }
+    return results
+
+
+def compare(results, baseline, threshold=0.1):
+    """
+    Print the wall time of every (size, stage) against the baseline.
+    Returns the regressions: stages slower than the baseline by more than `threshold`.
+    """
+    regressions = []
+    print(f"\nComparison with baseline {baseline['commit']} (threshold {threshold:.0%}):")
+    for size, stages in results['results'].items():
+        base_stages = baseline['results'].get(size)
+        if base_stages is None:
+            print(f"  {size}: not in baseline")
+            continue
+        for name, result in stages.items():
+            if name not in base_stages or name == 'generate':
+                continue
+            before, after = base_stages[name]['wall_seconds'], result['wall_seconds']
+            ratio = after / before if before else float('inf')
+            flag = ''
+            if ratio > 1 + threshold:
+                flag = '  REGRESSION'
+                regressions.append((size, name, ratio))
+            print(f"  {size:>10} {name:<48} {before:9.3f}s -> {after:9.3f}s  ({ratio:.2f}x){flag}")
+    return regressions
+
+
+def _load_baseline(baseline, results_dir):
+    path = baseline if os.path.exists(baseline) else os.path.join(results_dir, f"{baseline}.json")
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default='1M,10M,50M', help="Comma-separated row counts (K/M suffixes allowed)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1, help="Runs per size; the fastest run of each stage is kept")
+    parser.add_argument('--postgres', action='store_true', help="Also time save_to_postgresql")
+    parser.add_argument('--results-dir', default=RESULTS_DIR)
+    parser.add_argument('--baseline', default=None, help="Results file or commit to compare against")
+    parser.add_argument('--threshold', type=float, default=0.1, help="Relative slowdown reported as a regression")
+    args = parser.parse_args(argv)
+    # Read the baseline first: it may be the results file of this same commit, which is overwritten below
+    baseline = _load_baseline(args.baseline, args.results_dir) if args.baseline else None
+
+    results = {
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'machine': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'cpu_count': os.cpu_count()
+        },
+        'seed': args.seed,
+        'repeat': args.repeat,
+        'results': {}
+    }
+    for size in [parse_size(text) for text in args.sizes.split(',')]:
+        print(f"Rows: {size:,}")
+        stages = run_size(size, seed=args.seed, postgres=args.postgres)
+        for _ in range(args.repeat - 1):
+            for name, result in run_size(size, seed=args.seed, postgres=args.postgres).items():
+                if result['wall_seconds'] < stages[name]['wall_seconds']:
+                    stages[name] = result
+        results['results'][str(size)] = stages
+        for name, result in stages.items():
+            print(f"  {name:<48} {result['wall_seconds']:9.3f}s")
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    path = os.path.join(args.results_dir, f"{results['commit']}.json")
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {path}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} stage(s) regressed")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
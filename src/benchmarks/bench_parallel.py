@@ -0,0 +1,84 @@
+"""
+Scaling benchmark for the process-pool transform stage.
+Runs remove_duplicates, weather interpolation and cleaning serially and with 1..N workers,
+checks that every parallel run returns exactly the serial frame and prints the timings.
+
+Run from the src directory:
+    python -m benchmarks.bench_parallel --rows 5000000 --max-workers 8
+"""
+import argparse
+import contextlib
+import io
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.bench_interpolation import make_weather_frame
+from etl.parallel import (default_workers, parallel_clean_flights,
+                          parallel_interpolate_weather,
+                          parallel_remove_duplicates)
+from etl.transform import (clean_flights_csv_data,
+                           interpolate_all_weather_columns, remove_duplicates)
+
+DUPLICATE_SUBSET = ['FL_DATE', 'TAIL_NUM', 'CRS_DEP_TIME']
+
+
+def make_flights_frame(rows, duplicate_rate=0.02, seed=0):
+    """Weather frame from bench_interpolation plus the columns used by dedup and cleaning"""
+    rng = np.random.default_rng(seed)
+    df = make_weather_frame(rows, seed=seed)
+    tails = np.array([f"N{i:04d}" for i in range(7000)], dtype=object)
+    df['TAIL_NUM'] = tails[rng.integers(0, len(tails), rows)]
+    df['CRS_DEP_TIME'] = (df['DEP_HOUR'].fillna(0) * 100 + rng.integers(0, 60, rows)).astype(int)
+    df['DEP_DELAY'] = rng.normal(5, 40, rows).round()
+    df['CANCELLED'] = (rng.random(rows) < 0.02).astype(float)
+    df['MANUFACTURER'] = rng.choice(['BOEING', 'AIRBUS', 'EMBRAER', 'Unknown'], rows, p=[0.45, 0.4, 0.14, 0.01])
+    duplicates = df.sample(frac=duplicate_rate, random_state=seed)
+    return pd.concat([df, duplicates], ignore_index=True)
+
+
+def serial_transform(df):
+    df = remove_duplicates(df, subset=DUPLICATE_SUBSET)
+    df = interpolate_all_weather_columns(df)
+    return clean_flights_csv_data(df)
+
+
+def parallel_transform(df, workers):
+    df = parallel_remove_duplicates(df, subset=DUPLICATE_SUBSET, max_workers=workers)
+    df = parallel_interpolate_weather(df, max_workers=workers)
+    return parallel_clean_flights(df, max_workers=workers)
+
+
+def _timed_quiet(func, *args):
+    """Run func without its log output; returns the result and the elapsed seconds"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = func(*args)
+        return result, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--max-workers', type=int, default=default_workers())
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    df = make_flights_frame(args.rows, seed=args.seed)
+    expected, serial = _timed_quiet(serial_transform, df)
+    print(f"Rows: {len(df):,}")
+    print(f"  serial: {serial:.2f}s")
+
+    workers = 1
+    while True:
+        actual, seconds = _timed_quiet(parallel_transform, df, workers)
+        pd.testing.assert_frame_equal(actual, expected, check_exact=True)
+        print(f"  {workers} worker(s): {seconds:.2f}s (speedup {serial / seconds:.2f}x, output identical)")
+        if workers >= args.max_workers:
+            break
+        workers = min(workers * 2, args.max_workers)
+
+
+if __name__ == "__main__":
+    main()
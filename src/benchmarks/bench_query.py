@@ -0,0 +1,125 @@
+"""
+Latency benchmark for the in-process star schema queries (etl/query.py).
+Builds the star schema from synthetic flights (or loads an Arrow export), runs a seeded mix of
+small analytical queries and prints p50/p99 latency per query kind, uncached and with the LRU cache.
+
+Run from the src directory:
+    python -m benchmarks.bench_query --rows 2000000 --queries 2000
+    python -m benchmarks.bench_query --arrow-dir ./Data/tables_arrow
+"""
+import argparse
+import contextlib
+import io
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.bench_etl import _stations_frame
+from benchmarks.synthetic import generate_carriers, generate_flights
+from etl.load import create_fact_table, create_star_schema_dimensions
+from etl.query import StarQuery
+from etl.transform import (clean_flights_csv_data,
+                           interpolate_all_weather_columns, remove_duplicates)
+
+
+def build_star_schema(rows, seed=0):
+    """Star tables of `rows` synthetic flights, built the way the pipeline builds them"""
+    flights = generate_flights(rows, seed=seed)
+    airports = _stations_frame(flights['ORIGIN'].cat.categories.size)
+    with contextlib.redirect_stdout(io.StringIO()):
+        flights = remove_duplicates(flights, subset=['FL_DATE', 'TAIL_NUM', 'CRS_DEP_TIME'])
+        flights = interpolate_all_weather_columns(flights)
+        flights = clean_flights_csv_data(flights)
+        dimensions = create_star_schema_dimensions(flights, airports, generate_carriers())
+        fact_flights = create_fact_table(flights, dimensions)
+    return {'fact_flights': fact_flights, **dimensions}
+
+
+def query_mix(engine, count, seed=0):
+    """`count` (kind, kwargs) queries: small filtered aggregates like the internal tools ask"""
+    rng = np.random.default_rng(seed)
+    dates = pd.DatetimeIndex(engine.labels['date'][:-1])
+    origins = [label for label in engine.labels['origin'] if label is not None]
+    carriers = [label for label in engine.labels['carrier'] if label is not None]
+    months = [label for label in engine.labels['month'] if label is not None]
+
+    def date_range(max_days):
+        start = int(rng.integers(0, len(dates)))
+        end = min(len(dates) - 1, start + int(rng.integers(0, max_days)))
+        return dates[start], dates[end]
+
+    queries = []
+    for _ in range(count):
+        kind = rng.choice(['origin_delay', 'carrier_weather_cancellations', 'carrier_hourly', 'delay_by_origin'])
+        if kind == 'origin_delay':
+            date_from, date_to = date_range(31)
+            kwargs = {'measures': ['flights', 'avg_delay'], 'origin': origins[int(rng.integers(0, len(origins)))],
+                      'date_from': date_from, 'date_to': date_to}
+        elif kind == 'carrier_weather_cancellations':
+            date_from, date_to = date_range(92)
+            kwargs = {'measures': ['flights', 'cancellation_rate'], 'group_by': ['carrier', 'weather_status'],
+                      'date_from': date_from, 'date_to': date_to}
+        elif kind == 'carrier_hourly':
+            kwargs = {'measures': ['flights', 'avg_delay'], 'group_by': ['hour'],
+                      'carrier': carriers[int(rng.integers(0, len(carriers)))],
+                      'month': months[int(rng.integers(0, len(months)))]}
+        else:
+            date_from, date_to = date_range(7)
+            kwargs = {'measures': ['avg_delay'], 'group_by': ['origin'], 'date_from': date_from, 'date_to': date_to}
+        queries.append((kind, kwargs))
+    return queries
+
+
+def run_queries(engine, queries):
+    """Latency in milliseconds of every query, by kind"""
+    latencies = {}
+    for kind, kwargs in queries:
+        start = time.perf_counter_ns()
+        engine.query(**kwargs)
+        latencies.setdefault(kind, []).append((time.perf_counter_ns() - start) / 1e6)
+    return latencies
+
+
+def print_latencies(title, latencies):
+    print(f"\n{title}")
+    print(f"  {'query':<32}{'count':>7}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    everything = [value for values in latencies.values() for value in values]
+    for kind, values in sorted(latencies.items()) + [('all', everything)]:
+        p50, p99 = np.percentile(values, [50, 99])
+        print(f"  {kind:<32}{len(values):>7}{p50:>10.3f}{p99:>10.3f}{max(values):>10.3f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--arrow-dir', default=None, help="Query a save_tables_arrow export instead of synthetic data")
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--distinct-queries', type=int, default=200,
+                        help="Size of the query pool the cached run draws from (repeats hit the cache)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    star_schema = None if args.arrow_dir else build_star_schema(args.rows, seed=args.seed)
+    print(f"Star schema ready in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    if args.arrow_dir:
+        engine = StarQuery.from_arrow(args.arrow_dir, cache_size=0)
+    else:
+        engine = StarQuery(star_schema, cache_size=0)
+    print(f"Query engine loaded {engine.rows:,} fact rows in {time.perf_counter() - start:.2f}s")
+
+    print_latencies("Uncached", run_queries(engine, query_mix(engine, args.queries, seed=args.seed)))
+
+    engine.cache_size = args.distinct_queries
+    pool = query_mix(engine, args.distinct_queries, seed=args.seed + 1)
+    picks = np.random.default_rng(args.seed).integers(0, len(pool), args.queries)
+    print_latencies(f"With the LRU cache ({args.distinct_queries} distinct queries)",
+                    run_queries(engine, [pool[i] for i in picks]))
+    print(f"  cache: {engine.cache_info()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+Seeded synthetic flights, Stations and Carriers data for benchmarks and end-to-end runs.
+
+The flights frame has the columns and compact dtypes of the extracted data (FLIGHTS_SCHEMA) with
+realistic shapes: about 350 airports with skewed traffic, about 7k tail numbers whose aircraft
+attributes never change, an hourly weather series per airport that flights observe (with
+missing observations, whole missing station hours and outliers), duplicate rows and rows the
+cleaning rules reject.
+
+Write a dataset that main.py can read, from the src directory:
+    python -m benchmarks.synthetic --rows 1000000 --output ./Data/synthetic
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from etl.schema import FLIGHTS_SCHEMA, apply_flights_schema, concat_frames
+
+CARRIERS = {
+    'AA': 'American Airlines Inc.', 'DL': 'Delta Air Lines Inc.', 'UA': 'United Air Lines Inc.',
+    'WN': 'Southwest Airlines Co.', 'B6': 'JetBlue Airways', 'AS': 'Alaska Airlines Inc.',
+    'NK': 'Spirit Air Lines', 'F9': 'Frontier Airlines Inc.', 'G4': 'Allegiant Air',
+    'HA': 'Hawaiian Airlines Inc.', 'MQ': 'Envoy Air', 'OO': 'SkyWest Airlines Inc.',
+    'YX': 'Republic Airline', '9E': 'Endeavor Air Inc.', 'OH': 'PSA Airlines Inc.',
+    'QX': 'Horizon Air', 'YV': 'Mesa Airlines Inc.'
+}
+
+# Manufacturer, ICAO types and share of the fleet
+AIRCRAFT_TYPES = [
+    ('BOEING', ['B737', 'B738', 'B739', 'B752', 'B763', 'B772', 'B789'], 0.42),
+    ('AIRBUS', ['A319', 'A320', 'A321', 'A20N', 'A21N', 'A332'], 0.34),
+    ('EMBRAER', ['E170', 'E75L', 'E145'], 0.15),
+    ('BOMBARDIER', ['CRJ2', 'CRJ7', 'CRJ9'], 0.08),
+    ('Unknown', ['UNKN'], 0.01)
+]
+
+STATES = ['Alabama', 'Alaska', 'Arizona', 'California', 'Colorado', 'Florida', 'Georgia', 'Hawaii',
+          'Illinois', 'Massachusetts', 'Michigan', 'Minnesota', 'Nevada', 'New York', 'North Carolina',
+          'Ohio', 'Oregon', 'Pennsylvania', 'Texas', 'Utah', 'Virginia', 'Washington']
+
+
+def airport_codes(airports=350):
+    """Distinct three-letter airport codes"""
+    spread = np.linspace(0, 26 ** 3 - 1, airports).astype(int)
+    return [chr(65 + i // 676) + chr(65 + i // 26 % 26) + chr(65 + i % 26) for i in spread]
+
+
+def _fleet(tails, rng):
+    """Tail numbers with fixed manufacturer, type, year of manufacture and carrier"""
+    names = [f"N{100 + i * 7 % 90000:05d}{'ABCDEFGHJK'[i % 10]}" for i in range(tails)]
+    shares = np.array([share for _, _, share in AIRCRAFT_TYPES])
+    maker = rng.choice(len(AIRCRAFT_TYPES), tails, p=shares / shares.sum())
+    manufacturers = np.array([AIRCRAFT_TYPES[m][0] for m in maker], dtype=object)
+    types = np.array([rng.choice(AIRCRAFT_TYPES[m][1]) for m in maker], dtype=object)
+    # A few aircraft have no registry entry at all
+    manufacturers[rng.random(tails) < 0.005] = None
+    years = rng.integers(1990, 2023, tails).astype(float)
+    years[rng.random(tails) < 0.01] = np.nan
+    return pd.DataFrame({
+        'TAIL_NUM': names,
+        'MANUFACTURER': manufacturers,
+        'ICAO TYPE': types,
+        'YEAR OF MANUFACTURE': years,
+        'OP_UNIQUE_CARRIER': rng.choice(list(CARRIERS), tails)
+    })
+
+
+def _station_weather(airports, hours, rng, outlier_rate):
+    """Hourly weather grids (airport x hour): wind speed, temperature, visibility and weather status"""
+    hour = np.arange(hours)
+    season = -np.cos(2 * np.pi * hour / (24 * 365)) * 12
+    daily = -np.cos(2 * np.pi * (hour % 24) / 24) * 5
+    climate = rng.normal(12, 8, (airports, 1))
+    temperature = (climate + season + daily + rng.normal(0, 3, (airports, hours))).astype(np.float32)
+    wind = rng.gamma(2.0, 4.5, (airports, hours)).astype(np.float32)
+    active = rng.choice(np.array([0, 1, 2], dtype=np.int8), (airports, hours), p=[0.8, 0.15, 0.05])
+    visibility = np.clip(10 - rng.gamma(0.6, 2.5, (airports, hours)) * (1 + active), 0, 10).astype(np.float32)
+
+    # Sensor glitches: impossible temperatures and wind speeds
+    temperature[rng.random((airports, hours)) < outlier_rate] = rng.choice([-70.0, 99.9])
+    wind[rng.random((airports, hours)) < outlier_rate] = 120.0
+    return {
+        'WIND_SPD': wind.round(1),
+        'TEMPERATURE': temperature.round(1),
+        'VISIBILITY': visibility.round(1),
+        'ACTIVE_WEATHER': active
+    }
+
+
+def _categorical(codes, categories):
+    return pd.Categorical.from_codes(codes, categories=categories)
+
+
+def _flights_chunk(rows, rng, fleet, codes, traffic, weather, days, missing_rate, station_gap_rate, outlier_rate):
+    airports = len(codes)
+    origin = rng.choice(airports, rows, p=traffic)
+    dest = (origin + rng.integers(1, airports, rows)) % airports
+    day = rng.integers(0, days, rows)
+    # Departures cluster between 6:00 and 22:00
+    dep_hour = np.clip(rng.normal(14, 4.5, rows), 0, 23).astype(np.int8)
+    minute = rng.integers(0, 12, rows) * 5
+    grid_hour = day * 24 + dep_hour
+
+    tail = rng.integers(0, len(fleet), rows)
+    cancelled = np.where(rng.random(rows) < 0.02, rng.integers(1, 5, rows), 0).astype(np.int8)
+    delay = np.where(rng.random(rows) < 0.8, rng.normal(-3, 8, rows), rng.exponential(45, rows))
+    delay[rng.random(rows) < outlier_rate] = -rng.integers(61, 300)
+    delay = delay.round().astype(np.float32)
+    delay[(cancelled > 0) & (rng.random(rows) < 0.9)] = np.nan
+
+    df = pd.DataFrame({
+        'FL_DATE': (np.datetime64('2022-01-01', 's') + day.astype('timedelta64[D]')).astype('datetime64[s]'),
+        'DEP_HOUR': pd.array(dep_hour, dtype='Int8'),
+        'CRS_DEP_TIME': pd.array(dep_hour.astype(np.int16) * 100 + minute, dtype='Int16'),
+        'DEP_DELAY': delay,
+        'CANCELLED': pd.array(cancelled, dtype='Int8')
+    })
+    for col in ['TAIL_NUM', 'MANUFACTURER', 'ICAO TYPE', 'OP_UNIQUE_CARRIER']:
+        column = fleet[col].astype('category')
+        df[col] = _categorical(column.cat.codes.to_numpy()[tail], column.cat.categories)
+    df['YEAR OF MANUFACTURE'] = pd.array(fleet['YEAR OF MANUFACTURE'].to_numpy()[tail], dtype='Int16')
+    df['ORIGIN'] = _categorical(origin, codes)
+    df['DEST'] = _categorical(dest, codes)
+
+    station_gap = rng.random(rows) < station_gap_rate
+    for col in ['WIND_SPD', 'TEMPERATURE', 'ACTIVE_WEATHER', 'VISIBILITY']:
+        values = weather[col][origin, grid_hour]
+        missing = station_gap | (rng.random(rows) < missing_rate)
+        if col == 'ACTIVE_WEATHER':
+            df[col] = pd.array(values, dtype='Int8')
+            df.loc[missing, col] = pd.NA
+        else:
+            values = values.copy()
+            values[missing] = np.nan
+            df[col] = values
+    # Rows where DEP_HOUR is unknown
+    df.loc[rng.random(rows) < 0.005, 'DEP_HOUR'] = pd.NA
+    return apply_flights_schema(df[list(FLIGHTS_SCHEMA)])
+
+
+def generate_flights(rows, seed=0, airports=350, tails=7000, days=365, duplicate_rate=0.02,
+                     missing_rate=0.1, station_gap_rate=0.02, outlier_rate=0.002, chunksize=5_000_000):
+    """
+    Synthetic flights frame with `rows` rows (duplicates included) in the FLIGHTS_SCHEMA dtypes.
+    The same seed always produces the same frame. Large frames are generated in chunks of
+    `chunksize` rows so the temporary arrays stay small.
+    """
+    rng = np.random.default_rng(seed)
+    codes = airport_codes(airports)
+    traffic = 1 / np.arange(1, airports + 1) ** 1.1
+    traffic = rng.permutation(traffic / traffic.sum())
+    fleet = _fleet(tails, rng)
+    weather = _station_weather(airports, days * 24, rng, outlier_rate)
+
+    unique_rows = int(round(rows / (1 + duplicate_rate)))
+    chunk_seeds = np.random.SeedSequence(seed).spawn(max(1, -(-unique_rows // chunksize)))
+    chunks = []
+    for i, chunk_seed in enumerate(chunk_seeds):
+        chunk_rows = min(chunksize, unique_rows - i * chunksize)
+        chunks.append(_flights_chunk(
+            chunk_rows, np.random.default_rng(chunk_seed), fleet, codes, traffic, weather,
+            days, missing_rate, station_gap_rate, outlier_rate
+        ))
+    df = concat_frames(chunks)
+
+    # Duplicate rows (same flight reported twice) appended after their originals
+    duplicates = rng.choice(len(df), rows - len(df), replace=False)
+    return concat_frames([df, df.iloc[np.sort(duplicates)]])
+
+
+def generate_stations(airports=350, seed=0):
+    """Stations data with the columns read by extract_airports_data"""
+    rng = np.random.default_rng(seed)
+    codes = airport_codes(airports)
+    states = rng.choice(STATES, airports)
+    return pd.DataFrame({
+        'AIRPORT': codes,
+        'DISPLAY_AIRPORT_CITY_NAME_FULL': [f"City {code}, {state[:2].upper()}" for code, state in zip(codes, states)],
+        'AIRPORT_STATE_NAME': states,
+        'LATITUDE': rng.uniform(25, 49, airports).round(4),
+        'LONGITUDE': rng.uniform(-124, -67, airports).round(4)
+    })
+
+
+def generate_carriers():
+    """Carriers data with the CODE and DESCRIPTION columns"""
+    return pd.DataFrame({'CODE': list(CARRIERS), 'DESCRIPTION': list(CARRIERS.values())})
+
+
+def write_dataset(output_dir, rows, seed=0, shards=False, **kwargs):
+    """
+    Write CompleteData.csv (or monthly CSV shards under shards/), Stations.csv and Carriers.csv.
+    The flights CSV carries an extra column that the extract step has to skip.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    flights = generate_flights(rows, seed=seed, **kwargs)
+    flights = flights.assign(DISTANCE=np.random.default_rng(seed).integers(80, 2700, len(flights)))
+    if shards:
+        shard_dir = os.path.join(output_dir, 'shards')
+        os.makedirs(shard_dir, exist_ok=True)
+        for month, shard in flights.groupby(flights['FL_DATE'].dt.to_period('M'), sort=True):
+            shard.to_csv(os.path.join(shard_dir, f"{month}.csv"), index=False)
+    else:
+        flights.to_csv(os.path.join(output_dir, 'CompleteData.csv'), index=False)
+    generate_stations(kwargs.get('airports', 350), seed).to_csv(os.path.join(output_dir, 'Stations.csv'), index=False)
+    generate_carriers().to_csv(os.path.join(output_dir, 'Carriers.csv'), index=False)
+    print(f"Wrote {len(flights):,} synthetic flights to {output_dir}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default="./Data/synthetic")
+    parser.add_argument('--shards', action='store_true', help="Write monthly CSV shards instead of one file")
+    args = parser.parse_args(argv)
+    write_dataset(args.output, args.rows, seed=args.seed, shards=args.shards)
+
+
+if __name__ == "__main__":
+    main()
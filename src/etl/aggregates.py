@@ -0,0 +1,147 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+# Summary tables (delay cubes) written next to the star tables: table name -> grain columns.
+# Grain columns are fact columns or the derived attributes in CUBE_ATTRIBUTES.
+DELAY_CUBE_GRAINS = {
+    'agg_delay_day_origin': ['date', 'origin_airport_oid'],
+    'agg_delay_month_carrier': ['month', 'OP_UNIQUE_CARRIER'],
+    'agg_delay_hour_weather': ['scheduled_dep_time', 'WEATHER_STATUS_DESCRIPTION']
+}
+
+# Mergeable measures: how the measure of a coarser group is derived from its finer groups
+CUBE_MEASURES = {
+    'flights': 'sum',
+    'cancelled_flights': 'sum',
+    'delay_count': 'sum',
+    'delay_sum': 'sum',
+    'delay_sumsq': 'sum',
+    'delay_min': 'min',
+    'delay_max': 'max'
+}
+
+
+def _month(frame, dimensions):
+    return pd.to_datetime(frame['date']).dt.to_period('M').dt.start_time
+
+
+def _carrier(frame, dimensions):
+    # The fact table has no carrier column: a flight counts for the first carrier dim_aircraft records for
+    # its tail, which approximates the operating carrier of tails that fly for several carriers
+    carriers = dimensions['dim_aircraft'].drop_duplicates('TAIL_NUM').set_index('TAIL_NUM')['OP_UNIQUE_CARRIER']
+    return pd.Series(frame['TAIL_NUM']).map(carriers).astype(object)
+
+
+def _weather_status(frame, dimensions):
+    statuses = dimensions['dim_weather'].set_index('weather_id')['WEATHER_STATUS_DESCRIPTION']
+    return pd.Series(frame['weather_id']).map(statuses).astype(object)
+
+
+# Attributes derived from the fact columns and the dimensions; 'month' can also be derived from a cube's date
+CUBE_ATTRIBUTES = {
+    'month': _month,
+    'OP_UNIQUE_CARRIER': _carrier,
+    'WEATHER_STATUS_DESCRIPTION': _weather_status
+}
+
+
+def load_cube_grains(path):
+    """Load cube grains from a JSON file ({"table name": ["grain column", ...]})"""
+    with open(path) as f:
+        return json.load(f)
+
+
+def _with_attributes(frame, grain, dimensions=None):
+    """Add the derived attributes of `grain` that `frame` does not have yet"""
+    derived = {}
+    for col in grain:
+        if col in frame.columns:
+            continue
+        if col not in CUBE_ATTRIBUTES:
+            raise ValueError(f"Unknown cube grain column: {col}")
+        derived[col] = CUBE_ATTRIBUTES[col](frame, dimensions).to_numpy()
+    return frame.assign(**derived) if derived else frame
+
+
+def build_cube(fact_flights, dimensions, grain):
+    """
+    Aggregate the fact table to `grain`: flights, cancelled flights and the count, sum,
+    sum of squares, minimum and maximum of departure_delay per group (missing grain values form their own group).
+    """
+    delay = pd.to_numeric(fact_flights['departure_delay']).astype('float64')
+    base = _with_attributes(fact_flights, grain, dimensions)
+
+    measures = pd.DataFrame({
+        **{col: base[col] for col in grain},
+        'flights': np.ones(len(base), dtype=np.int64),
+        'cancelled_flights': pd.to_numeric(fact_flights['is_cancelled']).to_numpy(dtype=np.int64),
+        'delay_count': delay.notna().to_numpy(dtype=np.int64),
+        'delay_sum': delay.fillna(0).to_numpy(),
+        'delay_sumsq': (delay.fillna(0) ** 2).to_numpy(),
+        'delay_min': delay.to_numpy(),
+        'delay_max': delay.to_numpy()
+    })
+    return _aggregate(measures, grain)
+
+
+def _aggregate(frame, grain):
+    cube = frame.groupby(grain, observed=True, dropna=False, sort=True).agg(CUBE_MEASURES).reset_index()
+    for col in grain:
+        # Categorical grain values (from the flights frame) are stored as plain values
+        if isinstance(cube[col].dtype, pd.CategoricalDtype):
+            cube[col] = cube[col].astype(cube[col].cat.categories.dtype)
+    return cube
+
+
+def rollup_cube(cube, grain):
+    """
+    Derive a coarser cube from a finer one without touching the fact table,
+    e.g. day x origin -> month x origin or -> origin.
+    """
+    return _aggregate(_with_attributes(cube, grain)[grain + list(CUBE_MEASURES)], grain)
+
+
+def merge_cubes(existing, new, grain):
+    """Combine two cubes of the same grain (e.g. the warehouse cube and the cube of an incremental load)"""
+    if existing is None or existing.empty:
+        return new
+    # Database round trips can change grain dtypes (e.g. dates read back as strings)
+    existing = existing[grain + list(CUBE_MEASURES)].astype(
+        {col: new[col].dtype for col in grain if new[col].dtype.kind in 'Mi'}
+    )
+    return _aggregate(pd.concat([existing, new[grain + list(CUBE_MEASURES)]], ignore_index=True), grain)
+
+
+def cube_statistics(cube):
+    """Average and standard deviation of departure_delay and the cancellation rate per group"""
+    count = cube['delay_count'].where(cube['delay_count'] > 0)
+    mean = cube['delay_sum'] / count
+    variance = (cube['delay_sumsq'] / count - mean ** 2).clip(lower=0)
+    return cube.assign(
+        avg_delay=mean,
+        delay_stddev=np.sqrt(variance),
+        cancellation_rate=cube['cancelled_flights'] / cube['flights']
+    )
+
+
+def build_delay_cubes(fact_flights, dimensions, grains=None):
+    """Build every delay cube in `grains` (default DELAY_CUBE_GRAINS) from the fact table"""
+    grains = DELAY_CUBE_GRAINS if grains is None else grains
+    cubes = {name: build_cube(fact_flights, dimensions, grain) for name, grain in grains.items()}
+    for name, cube in cubes.items():
+        print(f"Built {name}: {len(cube)} groups over {int(cube['flights'].sum())} flights")
+    return cubes
+
+
+def accumulate_cubes(fact_chunks, dimensions, cubes, grains=None):
+    """
+    Pass fact table chunks through unchanged while merging each chunk's cubes into `cubes`
+    (a dict filled per cube name), so the cubes of a streamed fact table need no second pass.
+    """
+    grains = DELAY_CUBE_GRAINS if grains is None else grains
+    for chunk in fact_chunks:
+        for name, grain in grains.items():
+            cubes[name] = merge_cubes(cubes.get(name), build_cube(chunk, dimensions, grain), grain)
+        yield chunk
@@ -0,0 +1,359 @@
+import io
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from psycopg2 import sql
+
+from etl.physical_design import (FOREIGN_KEYS, MONTH_PARTITIONED_TABLES,
+                                 apply_physical_design,
+                                 create_month_partitions, drop_foreign_keys,
+                                 list_partitions)
+from utils.instrumentation import stage
+
+COPY_CHUNKSIZE = 100_000
+# Fact table chunks that may wait for a writer in a pipelined load
+FACT_QUEUE_SIZE = 4
+
+
+def postgres_type(dtype):
+    """
+    Map a pandas dtype to the PostgreSQL column type used for bulk-loaded tables.
+    """
+    if isinstance(dtype, pd.CategoricalDtype):
+        return postgres_type(dtype.categories.dtype)
+    if pd.api.types.is_bool_dtype(dtype):
+        return 'BOOLEAN'
+    if pd.api.types.is_integer_dtype(dtype):
+        return {1: 'SMALLINT', 2: 'SMALLINT', 4: 'INTEGER'}.get(dtype.itemsize, 'BIGINT')
+    if pd.api.types.is_float_dtype(dtype):
+        return 'REAL' if dtype.itemsize == 4 else 'DOUBLE PRECISION'
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        return 'TIMESTAMPTZ'
+    if pd.api.types.is_datetime64_dtype(dtype):
+        return 'TIMESTAMP'
+    return 'TEXT'
+
+
+def create_table_sql(table_name, df, partition_column=None):
+    """
+    CREATE TABLE statement with one column per DataFrame column,
+    range-partitioned on `partition_column` if given.
+    """
+    columns = sql.SQL(', ').join(
+        sql.SQL('{} {}').format(sql.Identifier(col), sql.SQL(postgres_type(dtype)))
+        for col, dtype in df.dtypes.items()
+    )
+    statement = sql.SQL('CREATE TABLE {} ({})').format(sql.Identifier(table_name), columns)
+    if partition_column is not None:
+        statement += sql.SQL(' PARTITION BY RANGE ({})').format(sql.Identifier(partition_column))
+    return statement
+
+
+def iter_copy_chunks(df, chunksize=COPY_CHUNKSIZE):
+    """
+    Yield the rows of `df` as CSV text in chunks of `chunksize` rows,
+    so the CSV for a large table is never built in memory all at once.
+    Missing values are written as empty fields, which COPY reads as NULL.
+    """
+    for start in range(0, len(df), chunksize):
+        yield df.iloc[start:start + chunksize].to_csv(header=False, index=False, na_rep='')
+
+
+def copy_dataframe(cursor, table_name, df, chunksize=COPY_CHUNKSIZE):
+    """
+    Stream a DataFrame into an existing table with COPY FROM STDIN, one chunk at a time.
+    """
+    statement = sql.SQL('COPY {} ({}) FROM STDIN WITH (FORMAT csv)').format(
+        sql.Identifier(table_name),
+        sql.SQL(', ').join(sql.Identifier(col) for col in df.columns)
+    ).as_string(cursor)
+    for chunk in iter_copy_chunks(df, chunksize):
+        cursor.copy_expert(statement, io.StringIO(chunk))
+
+
+def swap_in_table(cursor, staging_name, table_name):
+    """Replace `table_name` with the loaded staging table (and its partitions) in the current transaction"""
+    cursor.execute(sql.SQL('DROP TABLE IF EXISTS {} CASCADE').format(sql.Identifier(table_name)))
+    cursor.execute(sql.SQL('ALTER TABLE {} RENAME TO {}').format(
+        sql.Identifier(staging_name), sql.Identifier(table_name)
+    ))
+    # Partitions are named after their parent, so they are renamed with it
+    for partition_name in list_partitions(cursor, table_name):
+        cursor.execute(sql.SQL('ALTER TABLE {} RENAME TO {}').format(
+            sql.Identifier(partition_name),
+            sql.Identifier(table_name + partition_name[len(staging_name):])
+        ))
+
+
+def bulk_load_table(conn, table_name, df, if_exists='replace', chunksize=COPY_CHUNKSIZE, partition_column=None):
+    """
+    Load one table with COPY inside a single transaction.
+    With if_exists='replace' the rows go into a staging table that is swapped in for the old
+    table at commit, so readers see either the old or the new table, never a partial one.
+    With if_exists='append' the rows are copied into the table (created if missing).
+    With a partition_column the table is range-partitioned by month on that column and
+    the partitions needed for the new rows are created before the copy.
+    Returns the load statistics for the table.
+    """
+    start = time.perf_counter()
+    try:
+        with conn.cursor() as cursor:
+            if if_exists == 'replace':
+                staging_name = f"{table_name}__load"
+                cursor.execute(sql.SQL('DROP TABLE IF EXISTS {}').format(sql.Identifier(staging_name)))
+                cursor.execute(create_table_sql(staging_name, df, partition_column))
+                if partition_column is not None:
+                    create_month_partitions(cursor, staging_name, df[partition_column])
+                copy_dataframe(cursor, staging_name, df, chunksize)
+                swap_in_table(cursor, staging_name, table_name)
+            elif if_exists == 'append':
+                cursor.execute(sql.SQL('SELECT to_regclass({})').format(sql.Literal(table_name)))
+                if cursor.fetchone()[0] is None:
+                    cursor.execute(create_table_sql(table_name, df, partition_column))
+                if partition_column is not None:
+                    create_month_partitions(cursor, table_name, df[partition_column])
+                copy_dataframe(cursor, table_name, df, chunksize)
+            else:
+                raise ValueError(f"Unsupported if_exists for bulk load: {if_exists}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    seconds = time.perf_counter() - start
+    return {
+        'table': table_name,
+        'rows': len(df),
+        'seconds': round(seconds, 3),
+        'rows_per_sec': round(len(df) / seconds) if seconds > 0 else None
+    }
+
+
+def _run_on_pool(pool, func, *args, **kwargs):
+    conn = pool.getconn()
+    try:
+        return func(conn, *args, **kwargs)
+    finally:
+        pool.putconn(conn)
+
+
+def bulk_save_star_schema(star_schema, pool, if_exists='replace', max_workers=4, chunksize=COPY_CHUNKSIZE,
+                          suffix='_star', physical_design=True):
+    """
+    Bulk-load all star tables with COPY.
+    `pool` provides connections through getconn()/putconn(conn), like psycopg2's connection pools,
+    so any local PostgreSQL (or a pool around a throwaway test database) can be plugged in.
+    The fact table starts first on its own connection and the dimension tables load
+    concurrently on up to `max_workers` connections. When appending, the fact rows are copied
+    after the dimension rows so the foreign keys already in place are satisfied.
+    With physical_design=True the keys, indexes and statistics are (re)built after the load.
+    Returns the per-table statistics.
+    """
+    def load(item):
+        table_name, df = item
+        with stage(f'save_to_postgresql.copy.{table_name}', rows_in=len(df)) as record:
+            stats = _run_on_pool(
+                pool, bulk_load_table, table_name + suffix, df, if_exists=if_exists, chunksize=chunksize,
+                partition_column=MONTH_PARTITIONED_TABLES.get(table_name)
+            )
+            record['rows_out'] = stats['rows']
+        print(f"Loaded {table_name} with COPY: {stats['rows']} rows in {stats['seconds']}s "
+              f"({stats['rows_per_sec']} rows/sec)")
+        return stats
+
+    # Tables that take part in a foreign key; replacing only other tables (e.g. summary tables) keeps the keys
+    keyed_tables = set(FOREIGN_KEYS) | {ref[1] for refs in FOREIGN_KEYS.values() for ref in refs}
+    if physical_design and if_exists == 'replace' and keyed_tables & set(star_schema):
+        with stage('save_to_postgresql.drop_foreign_keys'):
+            _run_on_pool(pool, drop_foreign_keys, suffix=suffix)
+
+    # Largest table first, so it is never the one left waiting for a free connection
+    items = sorted(star_schema.items(), key=lambda item: len(item[1]), reverse=True)
+    if if_exists == 'append':
+        batches = [
+            [item for item in items if item[0] not in FOREIGN_KEYS],
+            [item for item in items if item[0] in FOREIGN_KEYS]
+        ]
+    else:
+        batches = [items]
+
+    report = []
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        for batch in batches:
+            report.extend(executor.map(load, batch))
+
+    if physical_design:
+        with stage('save_to_postgresql.physical_design'):
+            _run_on_pool(pool, apply_physical_design, list(star_schema), suffix=suffix)
+    return report
+
+
+def _create_fact_target(conn, staging_name, first_chunk, partition_column, partition_dates):
+    """Create the staging table the fact chunks are copied into, with its partitions"""
+    with conn.cursor() as cursor:
+        cursor.execute(sql.SQL('DROP TABLE IF EXISTS {}').format(sql.Identifier(staging_name)))
+        cursor.execute(create_table_sql(staging_name, first_chunk, partition_column))
+        if partition_column is not None:
+            create_month_partitions(
+                cursor, staging_name, first_chunk[partition_column] if partition_dates is None else partition_dates
+            )
+    conn.commit()
+
+
+def append_staged_table(cursor, staging_name, table_name, df, partition_column=None, partition_dates=None):
+    """
+    Move the rows of a loaded staging table into `table_name` (created from the columns of `df`
+    if missing) and drop the staging table, in the current transaction.
+    """
+    cursor.execute(sql.SQL('SELECT to_regclass({})').format(sql.Literal(table_name)))
+    if cursor.fetchone()[0] is None:
+        cursor.execute(create_table_sql(table_name, df, partition_column))
+    if partition_column is not None:
+        create_month_partitions(cursor, table_name, partition_dates)
+    columns = sql.SQL(', ').join(sql.Identifier(col) for col in df.columns)
+    cursor.execute(sql.SQL('INSERT INTO {} ({}) SELECT {} FROM {}').format(
+        sql.Identifier(table_name), columns, columns, sql.Identifier(staging_name)
+    ))
+    cursor.execute(sql.SQL('DROP TABLE {}').format(sql.Identifier(staging_name)))
+
+
+def _drop_staging_table(conn, staging_name):
+    """Drop the staging table of a failed load (best effort: the original error is the one raised)"""
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(sql.SQL('DROP TABLE IF EXISTS {}').format(sql.Identifier(staging_name)))
+        conn.commit()
+    except Exception as exc:
+        conn.rollback()
+        print(f"Could not drop the staging table {staging_name}: {exc}")
+
+
+def pipelined_save_star_schema(dimensions, fact_chunks, pool, partition_dates=None, if_exists='replace',
+                               max_workers=4, fact_writers=2, queue_size=FACT_QUEUE_SIZE,
+                               chunksize=COPY_CHUNKSIZE, suffix='_star', physical_design=True):
+    """
+    Load the dimension tables and a stream of fact table chunks at the same time.
+    The dimension tables start loading right away on a background thread. Fact chunks are
+    taken from the `fact_chunks` iterator (typically produced as they are built) onto a
+    bounded queue, so at most `queue_size` chunks wait in memory, and copied by
+    `fact_writers` threads on their own connections. The chunks go into a staging table, so a
+    failed load never leaves a partial fact table: after the last chunk and the dimensions,
+    the staging table is swapped in (if_exists='replace') or its rows are inserted into the
+    fact table (if_exists='append') in a single transaction, and on failure it is dropped.
+    `partition_dates` (e.g. the FL_DATE column) lets all monthly partitions be created up
+    front; without it each chunk's partitions are created before it is queued.
+    Returns the per-table statistics.
+    """
+    table_name = 'fact_flights' + suffix
+    partition_column = MONTH_PARTITIONED_TABLES.get('fact_flights')
+    if if_exists not in ('replace', 'append'):
+        raise ValueError(f"Unsupported if_exists for bulk load: {if_exists}")
+    target = f"{table_name}__load"
+    chunks = queue.Queue(maxsize=max(1, queue_size))
+    errors = []
+    lock = threading.Lock()
+    fact_stats = {'table': table_name, 'rows': 0, 'chunks': 0, 'queue_wait_seconds': 0.0}
+
+    def write_chunks():
+        conn = pool.getconn()
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    return
+                if errors:
+                    continue  # keep draining so the producer never blocks on a full queue
+                try:
+                    with stage('save_to_postgresql.copy.fact_flights.chunk', rows_in=len(chunk)):
+                        with conn.cursor() as cursor:
+                            copy_dataframe(cursor, target, chunk, chunksize)
+                        conn.commit()
+                    with lock:
+                        fact_stats['rows'] += len(chunk)
+                        fact_stats['chunks'] += 1
+                except Exception as exc:
+                    conn.rollback()
+                    errors.append(exc)
+        finally:
+            pool.putconn(conn)
+
+    def load_dimensions():
+        try:
+            return bulk_save_star_schema(dimensions, pool, if_exists=if_exists, max_workers=max_workers,
+                                         chunksize=chunksize, suffix=suffix, physical_design=False)
+        except Exception as exc:
+            errors.append(exc)
+            raise
+
+    start = time.perf_counter()
+    if physical_design and if_exists == 'replace':
+        with stage('save_to_postgresql.drop_foreign_keys'):
+            _run_on_pool(pool, drop_foreign_keys, suffix=suffix)
+
+    # The fact chunks go into a staging table, so they need not wait for the dimensions
+    staged_dates = [] if partition_dates is None else [partition_dates]
+    setup_conn = pool.getconn()
+    with ThreadPoolExecutor(max_workers=max(1, fact_writers) + 1) as executor:
+        dimension_report = executor.submit(load_dimensions)
+        try:
+            fact_chunks = iter(fact_chunks)
+            first_chunk = next(fact_chunks, None)
+            if first_chunk is None:
+                raise ValueError("The fact table stream produced no chunks")
+            _create_fact_target(setup_conn, target, first_chunk, partition_column, partition_dates)
+            writers = [executor.submit(write_chunks) for _ in range(max(1, fact_writers))]
+            try:
+                for chunk in itertools.chain([first_chunk], fact_chunks):
+                    if errors:
+                        break
+                    if partition_column is not None and partition_dates is None:
+                        with setup_conn.cursor() as cursor:
+                            create_month_partitions(cursor, target, chunk[partition_column])
+                        setup_conn.commit()
+                        staged_dates.append(chunk[partition_column].drop_duplicates())
+                    wait_start = time.perf_counter()
+                    chunks.put(chunk)
+                    fact_stats['queue_wait_seconds'] += time.perf_counter() - wait_start
+            finally:
+                for _ in writers:
+                    chunks.put(None)
+            for writer in writers:
+                writer.result()
+            report = dimension_report.result()
+            if errors:
+                raise errors[0]
+
+            # Dimension rows are committed by now, so the appended fact rows satisfy the foreign keys
+            with setup_conn.cursor() as cursor:
+                if if_exists == 'replace':
+                    swap_in_table(cursor, target, table_name)
+                else:
+                    append_staged_table(
+                        cursor, target, table_name, first_chunk, partition_column,
+                        pd.concat(staged_dates, ignore_index=True) if partition_column is not None else None
+                    )
+            setup_conn.commit()
+        except Exception:
+            setup_conn.rollback()
+            _drop_staging_table(setup_conn, target)
+            raise
+        finally:
+            pool.putconn(setup_conn)
+
+    seconds = time.perf_counter() - start
+    fact_stats['seconds'] = round(seconds, 3)
+    fact_stats['rows_per_sec'] = round(fact_stats['rows'] / seconds) if seconds > 0 else None
+    fact_stats['queue_wait_seconds'] = round(fact_stats['queue_wait_seconds'], 3)
+    # The time covers building and writing the chunks; a long queue wait means the writes are the bottleneck
+    print(f"Loaded fact_flights with pipelined COPY: {fact_stats['rows']} rows in {fact_stats['chunks']} chunks "
+          f"in {fact_stats['seconds']}s ({fact_stats['rows_per_sec']} rows/sec, including the transform); "
+          f"the transform waited {fact_stats['queue_wait_seconds']}s on a full queue")
+
+    if physical_design:
+        with stage('save_to_postgresql.physical_design'):
+            _run_on_pool(pool, apply_physical_design, ['fact_flights', *dimensions], suffix=suffix)
+    return report + [fact_stats]
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+CACHE_KEY_FIELD = b'flight_cache_key'
+CACHE_METADATA_PREFIX = b'flight_cache.'
+
+
+def source_fingerprint(source, use_hash=False):
+    """
+    Fingerprint a source file or a directory of CSV shards.
+    By default size and mtime are used; use_hash=True hashes the file contents instead
+    (slower, but survives copies and touch).
+    """
+    if os.path.isdir(source):
+        paths = sorted(
+            os.path.join(source, name) for name in os.listdir(source) if name.endswith('.csv')
+        )
+    else:
+        paths = [source]
+
+    entries = []
+    for path in paths:
+        stat = os.stat(path)
+        entry = {'name': os.path.basename(path), 'size': stat.st_size}
+        if use_hash:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+            entry['sha256'] = digest.hexdigest()
+        else:
+            entry['mtime_ns'] = stat.st_mtime_ns
+        entries.append(entry)
+    return entries
+
+
+def make_cache_key(*parts):
+    """Combine JSON-serializable parts (fingerprints, column lists, parameters) into a hex key"""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def write_frame_cache(df, path, key, compression='zstd', preserve_index=False, metadata=None):
+    """
+    Write a DataFrame to a compressed Arrow IPC file with the cache key in the schema metadata.
+    The file is written next to the target and renamed into place, so readers never see a partial cache.
+    preserve_index=None stores the index too (a RangeIndex only as metadata), so it is read back as written.
+    `metadata` (str keys and values) is stored with the key and read back by read_cache_metadata.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    table = pa.Table.from_pandas(df, preserve_index=preserve_index)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        **{CACHE_METADATA_PREFIX + name.encode('utf-8'): value.encode('utf-8')
+           for name, value in (metadata or {}).items()},
+        CACHE_KEY_FIELD: key.encode('utf-8')
+    })
+    tmp_path = f"{path}.tmp"
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with ipc.new_file(sink, table.schema, options=ipc.IpcWriteOptions(compression=compression)) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def _schema_metadata(path):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with pa.memory_map(path, 'r') as source:
+            return ipc.open_file(source).schema.metadata or {}
+    except (pa.ArrowInvalid, OSError):
+        return {}
+
+
+def read_cache_key(path):
+    """Return the cache key stored in an Arrow IPC cache file, or None if there is none"""
+    key = _schema_metadata(path).get(CACHE_KEY_FIELD)
+    return key.decode('utf-8') if key is not None else None
+
+
+def read_cache_metadata(path):
+    """The `metadata` a cache file was written with (empty if the file is missing)"""
+    return {name[len(CACHE_METADATA_PREFIX):].decode('utf-8'): value.decode('utf-8')
+            for name, value in _schema_metadata(path).items() if name.startswith(CACHE_METADATA_PREFIX)}
+
+
+def read_frame_cache(path, key=None, columns=None):
+    """
+    Load a cached DataFrame through a memory map.
+    Returns None when the file is missing or was written under a different key.
+    """
+    if key is not None and read_cache_key(path) != key:
+        return None
+    if not os.path.exists(path):
+        return None
+    with pa.memory_map(path, 'r') as source:
+        table = ipc.open_file(source).read_all()
+    if columns is not None:
+        table = table.select(columns)
+    return table.to_pandas()
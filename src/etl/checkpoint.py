@@ -0,0 +1,226 @@
+"""
+Content-addressed checkpoints of pipeline stage outputs.
+
+A stage output is keyed by a hash of the key of its inputs, the stage parameters and the code
+version of the stage function, so keys chain from the extracted data down the pipeline and can
+be computed without running anything. A stage whose key has a checkpoint is skipped, and its
+output is only loaded when a later stage has to be recomputed (or the caller needs the frame),
+so a rerun resumes from the last valid checkpoint. Changing a cleaning bound changes the key of
+the cleaning stage and everything after it, but not of dedup or weather interpolation.
+A checkpoint also keeps what the stage printed and the files it wrote (FILE_OUTPUT_ARGUMENTS,
+e.g. the quarantine CSV), and a hit prints the log and writes the files again, so a resumed run
+has the same side effects as a fresh one.
+"""
+import contextlib
+import hashlib
+import inspect
+import io
+import json
+import os
+import shutil
+import sys
+
+import pandas as pd
+
+from etl.cache import make_cache_key, read_frame_cache, write_frame_cache
+from utils.instrumentation import run_stage, stage
+
+CHECKPOINT_DIR = "./Data/checkpoints"
+CHECKPOINT_MAX_BYTES = 10 * 2 ** 30
+
+# Stage arguments that do not change the output (parallel variants produce identical frames)
+NON_KEY_ARGUMENTS = {'max_workers', 'n_partitions'}
+
+# Stage arguments naming a file the stage writes; the file is stored with the checkpoint
+FILE_OUTPUT_ARGUMENTS = {'quarantine_path'}
+
+# Packages whose functions and constants are part of a stage's code version
+PROJECT_PACKAGES = ('etl', 'utils')
+
+
+def _code_names(code):
+    """Global names used by a code object and the code objects nested in it (comprehensions, lambdas)"""
+    names = list(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names.extend(_code_names(const))
+    return names
+
+
+def _is_project_function(value):
+    module = getattr(value, '__module__', None) or ''
+    return inspect.isfunction(value) and module.split('.')[0] in PROJECT_PACKAGES
+
+
+def code_version(func):
+    """
+    Hash of the source of `func` and of the project functions and module constants it
+    references, followed recursively (e.g. clean_flights_csv_data -> CLEANING_RULES).
+    """
+    digest = hashlib.sha256()
+    seen = set()
+    pending = [getattr(func, 'func', func)]  # unwrap functools.partial
+    while pending:
+        current = pending.pop()
+        name = f"{current.__module__}.{current.__qualname__}"
+        if name in seen:
+            continue
+        seen.add(name)
+        digest.update(name.encode('utf-8'))
+        digest.update(inspect.getsource(current).encode('utf-8'))
+        for global_name in dict.fromkeys(_code_names(current.__code__)):
+            value = current.__globals__.get(global_name)
+            if _is_project_function(value):
+                pending.append(value)
+            elif isinstance(value, (dict, list, tuple, set, str, int, float)) and not isinstance(value, bool):
+                digest.update(global_name.encode('utf-8'))
+                digest.update(json.dumps(value, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def frame_fingerprint(df):
+    """Content hash of a DataFrame: column names, dtypes and row hashes"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([[col, str(dtype)] for col, dtype in df.dtypes.items()]).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+class _Tee(io.TextIOBase):
+    """Text stream that writes through to `stream` and keeps a copy of everything written"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.copy = io.StringIO()
+
+    def write(self, text):
+        self.copy.write(text)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+class StageOutput:
+    """The output of a stage, identified by its key; read from its checkpoint on first use"""
+
+    def __init__(self, key, frame=None, path=None, name=None):
+        self.key = key
+        self.path = path
+        self.name = name
+        self._frame = frame
+
+    @property
+    def loaded(self):
+        return self._frame is not None
+
+    def frame(self):
+        if self._frame is None:
+            with stage(f'{self.name}.load_checkpoint') as record:
+                self._frame = read_frame_cache(self.path, self.key)
+                if self._frame is None:
+                    raise FileNotFoundError(f"Checkpoint {self.path} of {self.name} is missing or stale")
+                record['rows_out'] = len(self._frame)
+            print(f"Loaded checkpoint of {self.name}: {len(self._frame)} rows from {self.path}")
+        return self._frame
+
+
+class CheckpointStore:
+    """
+    Directory of stage checkpoints (Arrow IPC files named by key).
+    Checkpoints are evicted least recently used first once the directory exceeds `max_bytes`.
+    `recompute` lists the stages to run even if they have a checkpoint (True for all), and
+    enabled=False runs every stage without reading or writing checkpoints.
+    """
+
+    def __init__(self, directory=CHECKPOINT_DIR, max_bytes=CHECKPOINT_MAX_BYTES, recompute=(), enabled=True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.recompute = recompute
+        self.enabled = enabled
+
+    def source(self, frame, key=None, name='source'):
+        """Wrap an input frame; without a key (e.g. the extract cache key) its content is hashed"""
+        if key is None and self.enabled:
+            key = frame_fingerprint(frame)
+        return StageOutput(key, frame=frame, name=name)
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.arrow")
+
+    def _side_path(self, key, name):
+        """Stored log ('log') or output file (the argument name) of a checkpoint"""
+        return os.path.join(self.directory, f"{key}.{name}")
+
+    def _replay(self, key, file_outputs):
+        """Print the stored log of a checkpoint and write its stored files to the requested paths"""
+        log_path = self._side_path(key, 'log')
+        if os.path.exists(log_path):
+            with open(log_path) as f:
+                print(f.read(), end='')
+        for arg, output_path in file_outputs.items():
+            os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+            shutil.copyfile(self._side_path(key, arg), output_path)
+            print(f"Restored {output_path} from the checkpoint")
+
+    def _forced(self, name):
+        return self.recompute is True or name in (self.recompute or ())
+
+    def run(self, name, func, *inputs, **kwargs):
+        """
+        Run func on the frames of `inputs` (StageOutputs) and keyword arguments as a recorded
+        stage, unless a checkpoint for the same inputs, arguments and code exists; a hit replays
+        the stage's log and output files instead. Returns the StageOutput.
+        """
+        if not self.enabled:
+            return StageOutput(None, frame=run_stage(name, func, *(i.frame() for i in inputs), **kwargs), name=name)
+
+        params = {arg: value for arg, value in kwargs.items() if arg not in NON_KEY_ARGUMENTS}
+        key = make_cache_key(name, [i.key for i in inputs], params, code_version(func))
+        path = self.path(key)
+        file_outputs = {arg: kwargs[arg] for arg in FILE_OUTPUT_ARGUMENTS if kwargs.get(arg) is not None}
+        stored = all(os.path.exists(self._side_path(key, arg)) for arg in file_outputs)
+        if not self._forced(name) and os.path.exists(path) and stored:
+            os.utime(path)  # mark as recently used
+            print(f"Checkpoint hit for {name}: {path}")
+            self._replay(key, file_outputs)
+            return StageOutput(key, path=path, name=name)
+
+        log = _Tee(sys.stdout)
+        with contextlib.redirect_stdout(log):
+            frame = run_stage(name, func, *(i.frame() for i in inputs), **kwargs)
+        with stage(f'{name}.write_checkpoint', rows_in=len(frame)):
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._side_path(key, 'log'), 'w') as f:
+                f.write(log.copy.getvalue())
+            for arg, output_path in file_outputs.items():
+                shutil.copyfile(output_path, self._side_path(key, arg))
+            # The index is kept, so a hit returns the same frame as the fresh run
+            write_frame_cache(frame, path, key, preserve_index=None)
+        self.evict(keep=path)
+        return StageOutput(key, frame=frame, path=path, name=name)
+
+    def evict(self, keep=None):
+        """
+        Delete the least recently used checkpoints, with their stored logs and files, until the
+        directory fits in max_bytes. `keep` (a checkpoint path) is never evicted.
+        """
+        checkpoints = {}
+        for entry in os.scandir(self.directory):
+            key = entry.name.split('.')[0]
+            stat = entry.stat()
+            last_used, size, paths = checkpoints.get(key, (0, 0, []))
+            if entry.name.endswith('.arrow'):
+                last_used = stat.st_mtime_ns
+            checkpoints[key] = (last_used, size + stat.st_size, paths + [entry.path])
+        keep_key = os.path.basename(keep).split('.')[0] if keep is not None else None
+        total = sum(size for _, size, _ in checkpoints.values())
+        for key, (_, size, paths) in sorted(checkpoints.items(), key=lambda item: item[1][0]):
+            if total <= self.max_bytes:
+                break
+            if key == keep_key:
+                continue
+            for path in paths:
+                os.remove(path)
+            total -= size
+            print(f"Evicted checkpoint {self.path(key)}")
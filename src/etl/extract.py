@@ -1,23 +1,210 @@
+import contextlib
+import glob
 import os
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+from etl.cache import (make_cache_key, read_frame_cache, source_fingerprint,
+                       write_frame_cache)
+from etl.sampling import SampleCandidates, stratified_sample
+from etl.schema import (FLIGHTS_SCHEMA, apply_flights_schema, concat_frames,
+                        read_csv_options)
+
+DEFAULT_CHUNKSIZE = 500_000
+
+
+def list_flight_shards(flights_source):
+    """
+    Return the CSV files behind a flights source.
+    A directory is treated as a set of (monthly) shards, read in sorted file name order.
+    """
+    if os.path.isdir(flights_source):
+        shards = sorted(glob.glob(os.path.join(flights_source, '*.csv')))
+        if not shards:
+            raise FileNotFoundError(f"No CSV shards found in: {flights_source}")
+        return shards
+    return [flights_source]
+
+
+def _read_csv_options(shard, required_columns_flights, schema):
+    # Only the header is parsed here; required columns missing from the file are skipped
+    header = pd.read_csv(shard, nrows=0).columns
+    usecols = [col for col in required_columns_flights if col in header]
+    return {'usecols': usecols, **read_csv_options(usecols, schema)}
+
+
+def _order_columns(df, required_columns_flights):
+    available_columns = [col for col in required_columns_flights if col in df.columns]
+    return df[available_columns]
+
+
+def _arrow_column_types(options):
+    """Arrow types for the dtype map of read_csv_options: text for categories, double for numbers"""
+    column_types = {}
+    for col, dtype in options['dtype'].items():
+        if dtype == 'category':
+            column_types[col] = pa.string()
+        elif pd.api.types.is_float_dtype(dtype):
+            column_types[col] = pa.float64()
+    return column_types
+
+
+def _iter_arrow_chunks(shard, options, chunksize):
+    """
+    Parse a shard with pyarrow's multi-threaded streaming reader, which holds a few blocks of
+    the file at a time, and regroup its record batches into frames of `chunksize` rows.
+    """
+    convert_options = pa_csv.ConvertOptions(include_columns=options['usecols'],
+                                            column_types=_arrow_column_types(options),
+                                            strings_can_be_null=True)
+
+    def frame(table):
+        return table.to_pandas().astype(options['dtype'])
+
+    pending, rows = [], 0
+    with pa_csv.open_csv(shard, convert_options=convert_options) as reader:
+        for batch in reader:
+            pending.append(batch)
+            rows += batch.num_rows
+            while rows >= chunksize:
+                table = pa.Table.from_batches(pending)
+                yield frame(table.slice(0, chunksize))
+                rest = table.slice(chunksize)
+                pending, rows = rest.to_batches(), rest.num_rows
+    if rows:
+        yield frame(pa.Table.from_batches(pending))
+
 
-def extract_flights_data(flights_csv, filtered_csv, required_columns_flights):
+def _iter_csv_chunks(shard, options, chunksize=DEFAULT_CHUNKSIZE, engine='c'):
+    """
+    Yield the raw parsed chunks of one shard, at most `chunksize` rows each, with either parser.
+    A shard without data rows yields a single empty chunk that has its columns as object columns.
+    """
+    if engine == 'pyarrow':
+        reader = contextlib.closing(_iter_arrow_chunks(shard, options, chunksize))
+    else:
+        reader = pd.read_csv(shard, chunksize=chunksize, **options)
+    empty = True
+    with reader as chunks:
+        for chunk in chunks:
+            if len(chunk):
+                empty = False
+                yield chunk
+    if empty:
+        yield pd.DataFrame({col: pd.Series(dtype=object) for col in options['usecols']})
+
+
+def iter_flights_chunks(flights_csv, required_columns_flights, schema=None, chunksize=DEFAULT_CHUNKSIZE,
+                        engine='c'):
+    """
+    Yield column-pruned chunks of at most `chunksize` rows, in the schema dtypes, from a flights
+    CSV file or a directory of CSV shards. Only one chunk is held in memory at a time.
+    A shard with a header but no rows yields one empty chunk with the schema dtypes.
+    """
+    for shard in list_flight_shards(flights_csv):
+        options = _read_csv_options(shard, required_columns_flights, schema)
+        for chunk in _iter_csv_chunks(shard, options, chunksize, engine):
+            yield apply_flights_schema(_order_columns(chunk, required_columns_flights), schema)
+
+
+def _read_shard(shard, required_columns_flights, schema, chunksize, engine, chunk_filter=None):
+    options = _read_csv_options(shard, required_columns_flights, schema)
+
+    def parsed(df):
+        df = apply_flights_schema(_order_columns(df, required_columns_flights), schema)
+        return df if chunk_filter is None else chunk_filter(df)
+
+    chunks = _iter_csv_chunks(shard, options, chunksize, engine)
+    if chunk_filter is None:
+        return parsed(concat_frames(list(chunks)))
+    return apply_flights_schema(concat_frames([parsed(chunk) for chunk in chunks]), schema)
+
+
+def read_flights_streaming(flights_csv, required_columns_flights, schema=None,
+                           chunksize=DEFAULT_CHUNKSIZE, max_workers=None, engine='c', chunk_filter=None):
+    """
+    Read only the required flight columns, parsed straight into the compact schema dtypes.
+    Each file is parsed in bounded-size chunks (with the multi-threaded pyarrow parser when
+    engine='pyarrow'), and a directory of shards is read in parallel on a thread pool.
+    Shards are concatenated in file name order, so the result does not depend on the worker count.
+    `chunk_filter` (e.g. a SampleCandidates) reduces every parsed chunk before the chunks are combined.
+    """
+    shards = list_flight_shards(flights_csv)
+    if max_workers is None:
+        max_workers = min(len(shards), os.cpu_count() or 1)
+
+    print(f"Streaming {len(shards)} flight file(s) with {max_workers} worker(s) "
+          f"(engine={engine}, chunksize={chunksize})")
+    if max_workers <= 1 or len(shards) == 1:
+        frames = [_read_shard(shard, required_columns_flights, schema, chunksize, engine, chunk_filter)
+                  for shard in shards]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            frames = list(executor.map(
+                lambda shard: _read_shard(shard, required_columns_flights, schema, chunksize, engine, chunk_filter),
+                shards
+            ))
+    return concat_frames(frames)
+
+
+def extract_flights_data(flights_csv, cache_path, required_columns_flights, streaming=False,
+                         chunksize=DEFAULT_CHUNKSIZE, max_workers=None, engine='c', hash_source=False,
+                         schema=None, sample_rate=None, sample_seed=0):
     """
     Extracts and filters flight data from the raw CSV.
-    If a filtered CSV exists, loads it directly.
-    Otherwise, reads the raw CSV, filters columns, and saves the filtered version.
+    If a cache written for the same source file and column list exists, loads it directly.
+    Otherwise, reads the required columns of the raw CSV and saves them to a
+    compressed Arrow cache keyed by the source fingerprint and the column list.
+    With streaming=True the raw data (a CSV file or a directory of CSV shards) is parsed
+    in bounded chunks instead of in one pass. Every path returns the
+    columns in the `schema` dtypes (FLIGHTS_SCHEMA by default).
+    With a sample_rate only the stratified_sample of the flights is returned and cached (use a
+    cache path of its own, see sample_cache_path); streaming reads keep just each chunk's sample
+    candidates, so the full flights are never held in memory. The cache metadata 'rows_total'
+    records the number of flights the sample was drawn from.
     """
-    if os.path.exists(filtered_csv):
-        print(f"Using existing filtered data from: {filtered_csv}")
-        filtered_flights_csv = pd.read_csv(filtered_csv)
+    schema = FLIGHTS_SCHEMA if schema is None else schema
+    sample = None if sample_rate is None else {'rate': sample_rate, 'seed': sample_seed}
+    key = make_cache_key(
+        source_fingerprint(flights_csv, use_hash=hash_source),
+        list(required_columns_flights),
+        schema,
+        *([sample] if sample is not None else [])
+    )
+    filtered_flights_csv = read_frame_cache(cache_path, key)
+    if filtered_flights_csv is not None:
+        print(f"Using existing filtered data from: {cache_path}")
         print(f"Successfully loaded {len(filtered_flights_csv)} filtered flights")
+        return filtered_flights_csv
+
+    if os.path.exists(cache_path):
+        print(f"Cached data in {cache_path} is stale, rebuilding from: {flights_csv}")
+    candidates = None if sample is None else SampleCandidates(sample_rate, seed=sample_seed)
+    if streaming:
+        filtered_flights_csv = read_flights_streaming(
+            flights_csv, required_columns_flights, schema=schema,
+            chunksize=chunksize, max_workers=max_workers, engine=engine, chunk_filter=candidates
+        )
     else:
-        raw_data = pd.read_csv(flights_csv)
-        print(raw_data.columns)
-        available_columns = [col for col in required_columns_flights if col in raw_data.columns]
-        filtered_flights_csv = raw_data[available_columns].copy()
-        os.makedirs(os.path.dirname(filtered_csv), exist_ok=True)
-        filtered_flights_csv.to_csv(filtered_csv, index=False)
+        # Only the required columns are parsed, straight into the schema dtypes
+        options = _read_csv_options(flights_csv, required_columns_flights, schema)
+        print(f"Reading {len(options['usecols'])} flight columns from: {flights_csv}")
+        raw_data = pd.read_csv(flights_csv, **options)
+        filtered_flights_csv = apply_flights_schema(_order_columns(raw_data, required_columns_flights), schema)
+    metadata = None
+    if sample is not None:
+        rows_total = candidates.rows if streaming else len(filtered_flights_csv)
+        if streaming:
+            filtered_flights_csv = candidates.sample(filtered_flights_csv)
+        else:
+            filtered_flights_csv = stratified_sample(filtered_flights_csv, sample_rate, seed=sample_seed)
+        # numbered like a cache hit (the cache does not keep the index)
+        filtered_flights_csv = filtered_flights_csv.reset_index(drop=True)
+        metadata = {'rows_total': str(rows_total)}
+    write_frame_cache(filtered_flights_csv, cache_path, key, metadata=metadata)
     return filtered_flights_csv
 
 def extract_airports_data(airports_csv, required_columns_airports):
@@ -32,4 +219,4 @@ def extract_airports_data(airports_csv, required_columns_airports):
     return filtered_airports_csv
 
 def extract_carriers_data(carriers_csv):
-    return pd.read_csv(carriers_csv)
\ No newline at end of file
+    return pd.read_csv(carriers_csv)
@@ -0,0 +1,162 @@
+"""
+Persistent index of the dedup keys of the flights loaded into the warehouse.
+
+Every loaded flight is recorded as a 64-bit hash of its dedup key (FL_DATE, TAIL_NUM,
+CRS_DEP_TIME) in a sorted array on disk, which lookups memory-map instead of reading old data.
+A Bloom filter in front of it answers most lookups of new keys without touching the array;
+the keys it lets through are checked with a binary search. With 64-bit hashes the chance that
+any new flight collides with an indexed one stays below n_new * n_indexed / 2**64.
+
+The index directory holds keys.npy (sorted uint64 hashes), bloom.npy (filter bits as uint64
+words) and meta.json (key count, filter capacity and the warehouse's highest flight_id when
+the index was last updated, so a stale index can be recognised).
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+DEDUP_KEY = ['FL_DATE', 'TAIL_NUM', 'CRS_DEP_TIME']
+KEY_INDEX_DIR = "./Data/key_index"
+
+# Bloom filter sizing: 10 bits and 7 probes per key (blocked in 64-bit words: about 1-2% false positives)
+BLOOM_BITS_PER_KEY = 10
+BLOOM_PROBES = 7
+
+
+def dedup_key_hashes(df, subset=DEDUP_KEY):
+    """
+    64-bit hash of the dedup key of every row. Values are normalized first (dates to
+    datetime64[s], numbers to float64, text to str), so the same flight hashes the same
+    whatever dtypes the extract produced.
+    """
+    normalized = {}
+    for col in subset:
+        values = df[col]
+        if col == 'FL_DATE':
+            values = pd.to_datetime(values).astype('datetime64[s]')
+            normalized[col] = values.to_numpy().view(np.int64)
+        elif pd.api.types.is_numeric_dtype(values.dtype):
+            normalized[col] = values.to_numpy(dtype=np.float64, na_value=np.nan)
+        else:
+            normalized[col] = values.astype(object).where(values.notna(), '').astype(str).to_numpy()
+    return pd.util.hash_pandas_object(pd.DataFrame(normalized), index=False).to_numpy()
+
+
+def _bloom_probes(hashes, n_words):
+    """
+    Word and bit mask of every hash. The filter is blocked: all probes of a key set bits in one
+    64-bit word (chosen by the low hash bits), so adding or checking a key touches one word.
+    """
+    words = ((hashes & np.uint64(0xFFFFFFFF)) % np.uint64(n_words)).astype(np.intp)
+    with np.errstate(over='ignore'):
+        mixed = (hashes ^ (hashes >> np.uint64(31))) * np.uint64(0xBF58476D1CE4E5B9)
+    masks = np.zeros(len(hashes), dtype=np.uint64)
+    for probe in range(BLOOM_PROBES):
+        masks |= np.uint64(1) << ((mixed >> np.uint64(64 - 6 * (probe + 1))) & np.uint64(63))
+    return words, masks
+
+
+def bloom_add(bloom, hashes):
+    words, masks = _bloom_probes(hashes, len(bloom))
+    np.bitwise_or.at(bloom, words, masks)
+
+
+def bloom_contains(bloom, hashes):
+    """True where a hash may be in the filter; False means it certainly is not"""
+    words, masks = _bloom_probes(hashes, len(bloom))
+    return bloom[words] & masks == masks
+
+
+def _new_bloom(capacity):
+    return np.zeros(max(1, -(-capacity * BLOOM_BITS_PER_KEY // 64)), dtype=np.uint64)
+
+
+class KeyIndex:
+    """The dedup key index in `directory` (empty if it does not exist yet)"""
+
+    def __init__(self, directory=KEY_INDEX_DIR):
+        self.directory = directory
+        self.meta = {'keys': 0, 'capacity': 0, 'max_flight_id': None}
+        meta_path = os.path.join(directory, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.meta = json.load(f)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def __len__(self):
+        return self.meta['keys']
+
+    def _keys(self):
+        if not len(self):
+            return np.empty(0, dtype=np.uint64)
+        return np.load(self._path('keys.npy'), mmap_mode='r')
+
+    def contains(self, hashes):
+        """Boolean mask of the hashes that are in the index"""
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        found = np.zeros(len(hashes), dtype=bool)
+        if not len(self) or not len(hashes):
+            return found
+        candidates = np.flatnonzero(bloom_contains(np.load(self._path('bloom.npy')), hashes))
+        if len(candidates):
+            # Searching in sorted order walks the memory-mapped keys front to back
+            candidates = candidates[np.argsort(hashes[candidates])]
+            keys = self._keys()
+            positions = np.searchsorted(keys, hashes[candidates])
+            positions[positions == len(keys)] = len(keys) - 1
+            found[candidates] = keys[positions] == hashes[candidates]
+        return found
+
+    def add(self, hashes, max_flight_id=None, reset=False):
+        """
+        Add hashes to the index (reset=True replaces its contents) and record the warehouse's
+        highest flight_id after the load they came from. Files are replaced atomically.
+        """
+        hashes = np.unique(np.asarray(hashes, dtype=np.uint64))
+        if not len(hashes) and not reset:
+            self._save_meta(len(self), self.meta['capacity'], max_flight_id)
+            return 0
+        existing = np.empty(0, dtype=np.uint64) if reset else np.asarray(self._keys())
+        if len(existing):
+            hashes = hashes[~self.contains(hashes)]
+            keys = np.sort(np.concatenate([existing, hashes]))
+        else:
+            keys = hashes
+
+        capacity = 0 if reset else self.meta['capacity']
+        if len(keys) > capacity or not os.path.exists(self._path('bloom.npy')):
+            capacity = max(capacity, 2 * len(keys))
+            bloom = _new_bloom(capacity)
+            bloom_add(bloom, keys)
+        else:
+            bloom = np.load(self._path('bloom.npy'))
+            bloom_add(bloom, hashes)
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._save('keys.npy', keys)
+        self._save('bloom.npy', bloom)
+        self._save_meta(len(keys), capacity, max_flight_id)
+        return len(hashes)
+
+    def _save_meta(self, keys, capacity, max_flight_id):
+        os.makedirs(self.directory, exist_ok=True)
+        self.meta = {'keys': keys, 'capacity': capacity, 'max_flight_id': max_flight_id}
+        with open(self._path('meta.json.tmp'), 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(self._path('meta.json.tmp'), self._path('meta.json'))
+
+    def _save(self, name, array):
+        tmp_path = self._path(f"{name}.tmp.npy")
+        np.save(tmp_path, array)
+        os.replace(tmp_path, self._path(name))
+
+
+def drop_loaded_keys(df, key_index, subset=DEDUP_KEY):
+    """Drop the rows whose dedup key is already in the index"""
+    loaded = key_index.contains(dedup_key_hashes(df, subset))
+    print(f"Key index: {int(loaded.sum())} of {len(df)} flights are already in the warehouse")
+    return df[~loaded]
@@ -0,0 +1,385 @@
+"""
+Lazy, planned execution of the extract -> dedup -> weather -> clean part of the pipeline.
+
+A LazyFlights plan records the stages instead of running them, and optimize() rewrites it
+before anything is read:
+- Projection pushdown: the scan parses only the columns a later step or the output needs, and
+  every column is dropped right after its last use (CRS_DEP_TIME after dedup, for example).
+- Predicate pushdown: a cleaning rule moves into the scan, where each chunk is filtered as it is
+  parsed, only when no step in between depends on which rows exist. Dedup is only crossed by
+  rules on the dedup key columns (all copies of a flight then pass or fail together). Weather
+  interpolation, sampling and taps are never crossed: the rows a rule would remove are
+  interpolation anchors and stratum members of the rows that stay. The plan of main.py cleans
+  after the weather interpolation, so there every rule stops at that barrier and runs after it
+  (explain() shows the step that stopped it); rules are only pushed in plans that clean before
+  interpolating, e.g. right after the scan, a filter or dedup.
+- Shared expressions: a derived value that several steps compute (the flight time FL_DATE +
+  DEP_HOUR in the station weather mode) is computed once per chunk in the scan and handed to
+  the steps as a hidden column. FL_DATE itself is parsed once by the scan schema, which makes
+  the to_datetime calls of the later stages no-ops.
+- Sample pushdown: a sample right after the scan picks each chunk's sample candidates as it is
+  parsed (see SampleCandidates in etl/sampling.py), so only those are held; the sample step
+  then draws the same sample from them that it would draw from all the scanned rows.
+execute() runs the optimized plan in one pass: shards are parsed chunk by chunk on a pool of
+scan_workers threads (use the multi-threaded pyarrow parser for a single file) and cast to the
+scan schema, and with max_workers > 1 the dedup, weather and cleaning steps use the partitioned
+implementations of etl/parallel.py in that many processes.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from etl.extract import (DEFAULT_CHUNKSIZE, _iter_csv_chunks, _order_columns,
+                         _read_csv_options, list_flight_shards)
+from etl.key_index import DEDUP_KEY
+from etl.parallel import (WEATHER_FILL_COLUMNS, parallel_clean_flights,
+                          parallel_interpolate_weather,
+                          parallel_remove_duplicates)
+from etl.sampling import (SAMPLE_COVERAGE, SAMPLE_STRATA, SampleCandidates,
+                          stratified_sample)
+from etl.schema import apply_flights_schema, concat_frames
+from etl.transform import (CLEANING_RULES, build_station_weather,
+                           clean_flights_csv_data, cleaning_rule_columns,
+                           evaluate_cleaning_rules, fill_weather_columns,
+                           finalize_weather_columns,
+                           interpolate_all_weather_columns,
+                           interpolate_weather_from_stations,
+                           prepare_weather_columns, remove_duplicates,
+                           weather_datetime)
+from utils.instrumentation import run_stage
+
+# Derived values steps can share: hidden column name -> (input columns, function of a frame, description)
+SHARED_EXPRESSIONS = {
+    '__flight_time': (['FL_DATE', 'DEP_HOUR'], weather_datetime, 'FL_DATE + DEP_HOUR hours')
+}
+
+
+def _step_reads(step):
+    """Columns a step reads from its input"""
+    op = step['op']
+    if op == 'sample':
+        return DEDUP_KEY + [col for col in SAMPLE_STRATA + SAMPLE_COVERAGE if col != 'month']
+    if op in ('filter', 'tap'):
+        return list(step['reads'])
+    if op == 'dedup':
+        return list(step['subset'])
+    if op == 'weather':
+        return WEATHER_FILL_COLUMNS + list(step.get('times', []))
+    if op == 'clean':
+        return cleaning_rule_columns(step['rules'])
+    return []
+
+
+def _expression_uses(step):
+    """Number of times a step computes each shared expression"""
+    if step['op'] == 'weather':
+        # The station mode builds the station series and joins it, each on the flight time
+        return {'__flight_time': 2 if step['mode'] == 'station' else 1}
+    return {}
+
+
+def _pushdown_barrier(step, rule):
+    """Why a cleaning rule cannot move below `step`, or None if it can"""
+    op = step['op']
+    if op == 'dedup':
+        outside = [col for col in cleaning_rule_columns([rule]) if col not in step['subset']]
+        return f"keeps the first copy of each key and the rule reads {outside}" if outside else None
+    if op == 'weather':
+        return "weather interpolation reads neighbouring rows of the same airport"
+    if op == 'sample':
+        return "stratified sampling keeps one row per stratum among all rows"
+    if op == 'clean':
+        return "an earlier cleaning step"
+    if op == 'tap':
+        return f"{step['name']} is recorded from the rows before cleaning"
+    return None
+
+
+def _unique(columns):
+    return list(dict.fromkeys(columns))
+
+
+class LazyFlights:
+    """
+    A logical plan over the flights source. Every method returns a new plan with one more step;
+    nothing is read until execute() or collect().
+    """
+
+    def __init__(self, steps, output=None, optimized=False):
+        self.steps = list(steps)
+        self.output = output
+        self.optimized = optimized
+
+    @classmethod
+    def scan(cls, source, columns, schema=None, chunksize=DEFAULT_CHUNKSIZE, engine='c'):
+        """Plan a read of `columns` from a flights CSV file or directory of shards"""
+        return cls([{
+            'op': 'scan', 'source': source, 'columns': list(columns), 'schema': schema,
+            'chunksize': chunksize, 'engine': engine, 'predicates': [], 'expressions': []
+        }])
+
+    def _then(self, step):
+        return LazyFlights(self.steps + [step], self.output)
+
+    def filter(self, func, reads, description, **kwargs):
+        """
+        Keep the rows func(frame, **kwargs) returns. The function must decide row by row and
+        read only the `reads` columns, so cleaning rules can be pushed past it.
+        """
+        return self._then({'op': 'filter', 'func': func, 'kwargs': kwargs, 'reads': list(reads),
+                           'description': description})
+
+    def tap(self, name, func, reads):
+        """
+        Report func(frame) under `name` in the outputs of execute(), computed from the rows at
+        this point of the plan; func reads only the `reads` columns and the rows go on unchanged.
+        """
+        return self._then({'op': 'tap', 'name': name, 'func': func, 'reads': list(reads)})
+
+    def sample(self, rate, seed=0):
+        return self._then({'op': 'sample', 'rate': rate, 'seed': seed})
+
+    def remove_duplicates(self, subset):
+        return self._then({'op': 'dedup', 'subset': list(subset)})
+
+    def interpolate_weather(self, mode='flight', tolerance=pd.Timedelta(hours=3)):
+        return self._then({'op': 'weather', 'mode': mode, 'tolerance': pd.Timedelta(tolerance)})
+
+    def clean(self, rules=None, quarantine_path=None):
+        rules = CLEANING_RULES if rules is None else rules
+        return self._then({'op': 'clean', 'rules': list(rules), 'quarantine_path': quarantine_path})
+
+    def select(self, columns):
+        """Set the columns of the result (all scanned columns if never called)"""
+        return LazyFlights(self.steps, list(columns))
+
+    def optimize(self):
+        """The plan with predicates and columns pushed into the scan and shared expressions hoisted"""
+        if self.optimized:
+            return self
+        steps = [dict(step) for step in self.steps]
+        scan = steps[0]
+        scan['predicates'], scan['expressions'], scan['sample'] = [], [], None
+
+        # Sample pushdown: the scan keeps each chunk's candidates when nothing runs before the sample
+        if len(steps) > 1 and steps[1]['op'] == 'sample':
+            scan['sample'] = {'rate': steps[1]['rate'], 'seed': steps[1]['seed']}
+            steps[1]['pushed'] = True
+
+        # Predicate pushdown: a prefix of each cleaning step's rules (so rule counts stay in order)
+        for position, step in enumerate(steps):
+            if step['op'] != 'clean':
+                continue
+            pushed, kept = [], list(step['rules'])
+            step['stopped_by'] = None
+            while kept:
+                barrier = next((f"{below['op']}: {_pushdown_barrier(below, kept[0])}"
+                                for below in reversed(steps[1:position])
+                                if _pushdown_barrier(below, kept[0])), None)
+                if step['quarantine_path'] is not None:
+                    barrier = "the quarantine file needs the rejected rows"
+                if barrier:
+                    step['stopped_by'] = barrier
+                    break
+                pushed.append(kept.pop(0))
+            scan['predicates'].extend(pushed)
+            step['rules'] = kept
+        steps = [step for step in steps if step['op'] != 'clean' or step['rules']]
+
+        # Shared expressions: computed once in the scan when the steps would compute them repeatedly
+        uses = {}
+        for step in steps:
+            for name, count in _expression_uses(step).items():
+                uses[name] = uses.get(name, 0) + count
+        for name, count in uses.items():
+            if count > 1:
+                scan['expressions'].append({'name': name, 'uses': count})
+                for step in steps:
+                    if name in _expression_uses(step):
+                        step['times'] = [name]
+
+        # Projection pushdown: walk back from the output, keeping only the columns still needed
+        hidden = [expression['name'] for expression in scan['expressions']]
+        available = _unique(scan['columns'] + hidden)
+        output = self.output if self.output is not None else scan['columns']
+        needed = list(output)
+        projections = {}
+        for position in range(len(steps) - 1, 0, -1):
+            projections[position] = [col for col in available if col in needed]
+            step = steps[position]
+            if step['op'] == 'clean' and step['quarantine_path'] is not None:
+                # The quarantine file gets every column of the rejected rows
+                needed = _unique(needed + [col for col in available if col not in hidden])
+            needed = _unique(needed + _step_reads(step))
+        scan['output_columns'] = [col for col in available if col in needed]
+        expression_inputs = [col for name in hidden for col in SHARED_EXPRESSIONS[name][0]]
+        scan['read_columns'] = [col for col in scan['columns']
+                                if col in needed + cleaning_rule_columns(scan['predicates'])
+                                + expression_inputs]
+
+        optimized_steps = [scan]
+        current = scan['output_columns']
+        for position in range(1, len(steps)):
+            optimized_steps.append(steps[position])
+            keep = [col for col in current if col in projections[position]]
+            if keep != current:
+                optimized_steps.append({'op': 'project', 'columns': keep,
+                                        'dropped': [col for col in current if col not in keep]})
+                current = keep
+        return LazyFlights(optimized_steps, [col for col in output if col in current], optimized=True)
+
+    def explain(self):
+        """Text of the optimized plan, one step per line in execution order"""
+        plan = self.optimize()
+        lines = ["Optimized flights plan:"]
+        for number, step in enumerate(plan.steps, start=1):
+            op = step['op']
+            if op == 'scan':
+                line = (f"Scan {step['source']} (engine={step['engine']}) "
+                        f"read {len(step['read_columns'])}/{len(step['columns'])} columns {step['read_columns']}")
+                if step['predicates']:
+                    line += f"\n       filter pushed into scan: {[rule['name'] for rule in step['predicates']]}"
+                if step['sample']:
+                    line += f"\n       keep sample candidates of every chunk (rate={step['sample']['rate']})"
+                for expression in step['expressions']:
+                    inputs, _, description = SHARED_EXPRESSIONS[expression['name']]
+                    line += (f"\n       compute {expression['name']} = {description} once "
+                             f"(shared by {expression['uses']} uses)")
+                dropped = [col for col in step['read_columns'] if col not in step['output_columns']]
+                if dropped:
+                    line += f"\n       drop after scan: {dropped}"
+            elif op == 'filter':
+                line = f"Filter {step['description']}"
+            elif op == 'tap':
+                line = f"Record {step['name']} from {step['reads']}"
+            elif op == 'sample':
+                line = f"StratifiedSample rate={step['rate']} seed={step['seed']}"
+                if step.get('pushed'):
+                    line += " from the scan's candidates"
+            elif op == 'dedup':
+                line = f"RemoveDuplicates on {step['subset']}"
+            elif op == 'weather':
+                line = f"InterpolateWeather mode={step['mode']}"
+                if step['mode'] == 'station':
+                    line += f" tolerance={step['tolerance']}"
+                if step.get('times'):
+                    line += f" using {step['times'][0]}"
+            elif op == 'clean':
+                line = f"Clean {[rule['name'] for rule in step['rules']]}"
+                if step.get('stopped_by'):
+                    line += f"\n       not pushed down: {step['stopped_by']}"
+            else:
+                line = f"Project drop {step['dropped']}"
+            lines.append(f"  {number}. {line}")
+        lines.append(f"  Output columns: {plan.output}")
+        return "\n".join(lines)
+
+    def execute(self, max_workers=None, scan_workers=None):
+        """
+        Run the optimized plan, parsing shards on `scan_workers` threads (default: one per core)
+        and running the later steps in `max_workers` processes (default: serial). Returns the
+        flights frame and a dict of side outputs:
+        'rows_scanned' (rows left after the filters pushed into the scan, before sampling),
+        'scan_rejected' (rows removed by each pushed rule),
+        'rows_sampled', 'station_weather' (the station series in the station mode) and the
+        value of every tap() by its name.
+        """
+        plan = self.optimize()
+        outputs = {}
+        df = run_stage('lazy.scan', _execute_scan, plan.steps[0], outputs, scan_workers)
+        for step in plan.steps[1:]:
+            df = run_stage(f"lazy.{step['op']}", _execute_step, step, df, outputs, max_workers)
+        return df[plan.output], outputs
+
+    def collect(self, max_workers=None, scan_workers=None):
+        return self.execute(max_workers, scan_workers)[0]
+
+
+def _scan_chunk(chunk, scan, rejected, candidates=None):
+    # parse_dates leaves FL_DATE in the parser's unit; the eager extract returns the schema's
+    chunk = apply_flights_schema(_order_columns(chunk, scan['read_columns']), scan['schema'])
+    if scan['predicates']:
+        keep, counts, _ = evaluate_cleaning_rules(chunk, scan['predicates'])
+        for name, count in counts.items():
+            rejected[name] = rejected.get(name, 0) + count
+        chunk = chunk[keep]
+    if candidates is not None:
+        chunk = candidates(chunk)
+    for expression in scan['expressions']:
+        _, func, _ = SHARED_EXPRESSIONS[expression['name']]
+        chunk = chunk.assign(**{expression['name']: func(chunk)})
+    return chunk[scan['output_columns']]
+
+
+def _scan_shard(shard, scan, candidates=None):
+    """Parse one shard chunk by chunk, applying the pushed-down work to every chunk"""
+    rejected = {}
+    options = _read_csv_options(shard, scan['read_columns'], scan['schema'])
+    chunks = [_scan_chunk(chunk, scan, rejected, candidates)
+              for chunk in _iter_csv_chunks(shard, options, scan['chunksize'], scan['engine'])]
+    return concat_frames(chunks), rejected
+
+
+def _execute_scan(scan, outputs, max_workers=None):
+    shards = list_flight_shards(scan['source'])
+    max_workers = min(len(shards), max_workers or os.cpu_count() or 1)
+    print(f"Lazy scan of {len(shards)} flight file(s) with {max_workers} thread(s), "
+          f"{len(scan['read_columns'])} of {len(scan['columns'])} columns")
+    candidates = None
+    if scan['sample']:
+        candidates = SampleCandidates(scan['sample']['rate'], seed=scan['sample']['seed'])
+    if max_workers <= 1:
+        results = [_scan_shard(shard, scan, candidates) for shard in shards]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(lambda shard: _scan_shard(shard, scan, candidates), shards))
+
+    if candidates is not None:
+        outputs['rows_scanned'] = candidates.rows
+        print(f"Kept {sum(len(result[0]) for result in results)} sample candidates of {candidates.rows} flights")
+    else:
+        outputs['rows_scanned'] = sum(len(result[0]) for result in results)
+    outputs['scan_rejected'] = {rule['name']: sum(result[1].get(rule['name'], 0) for result in results)
+                                for rule in scan['predicates']}
+    for name, count in outputs['scan_rejected'].items():
+        print(f"Flights CSV: Removed {count} invalid rows after {name} cleaning (in the scan)")
+    return concat_frames([result[0] for result in results])
+
+
+def _execute_step(step, df, outputs, max_workers=None):
+    parallel = max_workers is not None and max_workers > 1
+    op = step['op']
+    times_column = step.get('times', [None])[0]
+    if op == 'filter':
+        return step['func'](df, **step['kwargs'])
+    if op == 'tap':
+        outputs[step['name']] = step['func'](df[step['reads']])
+        return df
+    if op == 'sample':
+        total_rows = outputs['rows_scanned'] if step.get('pushed') else None
+        df = stratified_sample(df, step['rate'], seed=step['seed'], total_rows=total_rows)
+        outputs['rows_sampled'] = len(df)
+        return df
+    if op == 'dedup':
+        if parallel:
+            return parallel_remove_duplicates(df, subset=step['subset'], max_workers=max_workers)
+        return remove_duplicates(df, subset=step['subset'])
+    if op == 'weather' and step['mode'] == 'station':
+        times = None if times_column is None else df[times_column]
+        station_weather = build_station_weather(df, times=times)
+        outputs['station_weather'] = station_weather
+        return interpolate_weather_from_stations(df, station_weather, tolerance=step['tolerance'], times=times)
+    if op == 'weather':
+        if parallel:
+            return parallel_interpolate_weather(df, max_workers=max_workers, times_column=times_column)
+        if times_column is None:
+            return interpolate_all_weather_columns(df)
+        df = prepare_weather_columns(df)
+        return finalize_weather_columns(fill_weather_columns(df, times=df[times_column]))
+    if op == 'clean':
+        if parallel:
+            return parallel_clean_flights(df, rules=step['rules'], quarantine_path=step['quarantine_path'],
+                                          max_workers=max_workers)
+        return clean_flights_csv_data(df, rules=step['rules'], quarantine_path=step['quarantine_path'])
+    return df[step['columns']]
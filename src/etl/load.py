@@ -1,8 +1,19 @@
-import sqlite3
-
+import numpy as np
 import pandas as pd
 import psycopg2
-from sqlalchemy import create_engine
+from psycopg2.pool import ThreadedConnectionPool
+from sqlalchemy import create_engine, inspect, text
+
+from etl.aggregates import (DELAY_CUBE_GRAINS, accumulate_cubes,
+                            build_delay_cubes, merge_cubes)
+from etl.bulk_load import (COPY_CHUNKSIZE, FACT_QUEUE_SIZE,
+                            bulk_save_star_schema, pipelined_save_star_schema)
+from etl.key_index import dedup_key_hashes, drop_loaded_keys
+from utils.instrumentation import run_stage, stage
+
+
+# Flights per fact table chunk in a pipelined load
+FACT_CHUNKSIZE = 500_000
 
 
 def create_date_dimension(flights_df):
@@ -27,44 +38,131 @@ def create_date_dimension(flights_df):
     return dim_date
 
 
-def create_weather_dimension(flights_df):
+WEATHER_STATUS_MAP = {
+    0.0: 'No weather events present',
+    1.0: 'Weather event(s) present',
+    2.0: 'Significant weather event(s) present'
+}
+WEATHER_STATUS_UNKNOWN = 'Unknown'
+
+# Bit layout of the packed weather key: rounded wind speed, rounded temperature,
+# visibility in tenths and the weather status code. The all-ones value of a field marks NaN.
+_WEATHER_KEY_FIELDS = [('WIND_SPD', 1, 16), ('TEMPERATURE', 1, 16), ('VISIBILITY', 10, 24)]
+_WEATHER_STATUS_BITS = 4
+
+
+def _status_codes(descriptions):
+    """Integer code per weather status description (unknown descriptions share one code)"""
+    statuses = list(WEATHER_STATUS_MAP.values())
+    codes = pd.Index(statuses).get_indexer(pd.Index(descriptions))
+    return np.where(codes >= 0, codes, len(statuses)).astype(np.int64)
+
+
+def weather_status_description(active_weather):
+    """Map ACTIVE_WEATHER codes to their descriptions"""
+    return active_weather.map(WEATHER_STATUS_MAP).astype(object).fillna(WEATHER_STATUS_UNKNOWN)
+
+
+def pack_weather_keys(wind_spd, temperature, visibility, status_codes):
+    """
+    Pack the rounded weather tuple (WIND_SPD to 0 decimals, TEMPERATURE to 0 decimals,
+    VISIBILITY to 1 decimal, weather status) into one int64 per row.
+    Two rows get the same key exactly when their rounded tuples are equal (NaN equals NaN),
+    so the key can stand in for the four-column join.
+    """
+    key = np.zeros(len(status_codes), dtype=np.int64)
+    for (name, scale, bits), values in zip(_WEATHER_KEY_FIELDS, (wind_spd, temperature, visibility)):
+        values = np.asarray(values, dtype=np.float64)
+        missing = np.isnan(values)
+        scaled = np.rint(np.where(missing, 0, values) * scale) + (1 << (bits - 1))
+        if ((scaled < 0) | (scaled >= (1 << bits) - 1)).any():
+            raise ValueError(f"{name} is out of range for the packed weather key")
+        field = np.where(missing, (1 << bits) - 1, scaled).astype(np.int64)
+        key = (key << bits) | field
+    return (key << _WEATHER_STATUS_BITS) | np.asarray(status_codes, dtype=np.int64)
+
+
+def round_weather_values(values, scale):
+    """
+    Round weather values to 1/scale steps the way the packed key does (Series.round in float64),
+    keeping float32 columns float32 so the rounded value packs to the same key.
+    """
+    rounded = np.rint(np.asarray(values, dtype=np.float64) * scale) / scale
+    dtype = values.dtype if getattr(values.dtype, 'kind', None) == 'f' else np.float64
+    return rounded.astype(dtype)
+
+
+def flight_weather_keys(flights_df):
+    """Packed weather key of every flight (or station) row"""
+    # Same codes as _status_codes(weather_status_description(...)), without building the strings
+    codes = pd.Index(list(WEATHER_STATUS_MAP)).get_indexer(pd.Index(flights_df['ACTIVE_WEATHER']))
+    status_codes = np.where(codes >= 0, codes, len(WEATHER_STATUS_MAP))
+    return pack_weather_keys(
+        flights_df['WIND_SPD'], flights_df['TEMPERATURE'], flights_df['VISIBILITY'], status_codes
+    )
+
+
+def dimension_weather_keys(dim_weather):
+    """Packed weather key of every dim_weather row"""
+    return pack_weather_keys(
+        dim_weather['WIND_SPD'], dim_weather['TEMPERATURE'], dim_weather['VISIBILITY'],
+        _status_codes(dim_weather['WEATHER_STATUS_DESCRIPTION'])
+    )
+
+
+def lookup_ids(values, keys, ids):
+    """
+    Map `values` to the id of the matching entry in `keys` with a hash lookup
+    (missing values map to <NA>). Categorical values are resolved once per category
+    and then expanded through their codes. The first id wins for duplicated keys.
+    """
+    keys = pd.Index(keys)
+    ids = np.asarray(ids)
+    unique = ~keys.duplicated()
+    keys, ids = keys[unique], ids[unique]
+
+    if isinstance(getattr(values, 'dtype', None), pd.CategoricalDtype):
+        positions = keys.get_indexer(values.cat.categories)
+        positions = np.append(positions, -1)[values.cat.codes.to_numpy()]
+    else:
+        positions = keys.get_indexer(pd.Index(values))
+    resolved = pd.array(np.where(positions >= 0, ids[positions], 0), dtype='Int64')
+    resolved[positions < 0] = pd.NA
+    return resolved
+
+
+def create_weather_dimension(flights_df, station_weather=None):
     """
     Create weather dimension with WEATHER_STATUS_DESCRIPTION instead of ACTIVE_WEATHER
+    If the hourly station weather series is given, it is used as the source instead of the flight rows
+    (every flight's weather is a row of that series, so all fact rows still find their weather_id).
+    Members are the distinct packed weather keys in order of first appearance.
     """
-    # Map ACTIVE_WEATHER to descriptions FIRST
-    weather_status_map = {
-        0.0: 'No weather events present',
-        1.0: 'Weather event(s) present',
-        2.0: 'Significant weather event(s) present'
-    }
-    
-    # Copy and transform the data
-    df_weather = flights_df[['WIND_SPD', 'TEMPERATURE', 'ACTIVE_WEATHER', 'VISIBILITY']].copy()
-    df_weather['WIND_SPD'] = df_weather['WIND_SPD'].round(0)
-    df_weather['TEMPERATURE'] = df_weather['TEMPERATURE'].round(0)
-    df_weather['VISIBILITY'] = df_weather['VISIBILITY'].round(1)
-    
-    # Replace ACTIVE_WEATHER with description
-    df_weather['WEATHER_STATUS_DESCRIPTION'] = df_weather['ACTIVE_WEATHER'].map(weather_status_map).fillna('Unknown')
-    df_weather = df_weather.drop('ACTIVE_WEATHER', axis=1)
-    
-    # Get unique combinations based on ALL columns including description
-    dim_weather = df_weather.drop_duplicates().reset_index(drop=True)
-    dim_weather['weather_id'] = range(1, len(dim_weather) + 1)
-    
-    # Reorder columns
-    dim_weather = dim_weather[[
-        'weather_id',
-        'WIND_SPD',
-        'TEMPERATURE',
-        'WEATHER_STATUS_DESCRIPTION',
-        'VISIBILITY'
-    ]]
+    source = flights_df if station_weather is None else station_weather
+    first_rows = ~pd.Index(flight_weather_keys(source)).duplicated()
+    members = source[first_rows]
+
+    dim_weather = pd.DataFrame({
+        'weather_id': np.arange(1, len(members) + 1),
+        'WIND_SPD': round_weather_values(members['WIND_SPD'], 1),
+        'TEMPERATURE': round_weather_values(members['TEMPERATURE'], 1),
+        'WEATHER_STATUS_DESCRIPTION': weather_status_description(members['ACTIVE_WEATHER']).to_numpy(),
+        'VISIBILITY': round_weather_values(members['VISIBILITY'], 10)
+    })
     
     return dim_weather
 
 
-def create_star_schema_dimensions(filtered_flights_csv, filtered_airports_csv, carriers_data):
+# Flight columns the dimensions and the fact table are built from
+STAR_SCHEMA_INPUT_COLUMNS = [
+    'FL_DATE', 'DEP_HOUR', 'DEP_DELAY', 'CANCELLED',
+    'TAIL_NUM', 'MANUFACTURER', 'ICAO TYPE', 'YEAR OF MANUFACTURE',
+    'OP_UNIQUE_CARRIER', 'ORIGIN', 'DEST',
+    'WIND_SPD', 'TEMPERATURE', 'ACTIVE_WEATHER', 'VISIBILITY'
+]
+
+
+def create_star_schema_dimensions(filtered_flights_csv, filtered_airports_csv, carriers_data, station_weather=None):
     """
     Create dimension tables for star schema with proper keys
     """
@@ -74,7 +172,7 @@ def create_star_schema_dimensions(filtered_flights_csv, filtered_airports_csv, c
     dimensions['dim_date'] = create_date_dimension(filtered_flights_csv)
     
     # 2. Weather Dimension
-    dimensions['dim_weather'] = create_weather_dimension(filtered_flights_csv)
+    dimensions['dim_weather'] = create_weather_dimension(filtered_flights_csv, station_weather)
     
     # 3. Aircraft Dimension
     aircraft_cols = ['TAIL_NUM', 'MANUFACTURER', 'ICAO TYPE', 'YEAR OF MANUFACTURE', 'OP_UNIQUE_CARRIER']
@@ -118,138 +216,194 @@ def create_star_schema_dimensions(filtered_flights_csv, filtered_airports_csv, c
     return dimensions
 
 
-def create_fact_table(filtered_flights_csv, dimensions):
+def create_fact_table(filtered_flights_csv, dimensions, first_flight_id=1, dim_weather_keys=None):
     """
     Create fact table with proper foreign keys
+    Foreign keys are resolved with hash lookups on packed keys (weather) and codes (airports)
+    and the fact columns are assembled in one pass, without merging or copying the flights frame.
+    flight_id counts from first_flight_id; dim_weather_keys can pass the packed dim_weather keys
+    when the table is built in chunks.
     """
-    fact_flights = filtered_flights_csv.copy()
-    
-    # Round weather values to match dimension
-    fact_flights['WIND_SPD'] = fact_flights['WIND_SPD'].round(0)
-    fact_flights['TEMPERATURE'] = fact_flights['TEMPERATURE'].round(0)
-    fact_flights['VISIBILITY'] = fact_flights['VISIBILITY'].round(1)
-    
-    # Generate flight_id as PK
-    fact_flights['flight_id'] = range(1, len(fact_flights) + 1)
-    
-    # 1. Keep flight_date
-    fact_flights['date'] = pd.to_datetime(fact_flights['FL_DATE'])
+    dim_weather = dimensions['dim_weather']
+    dim_airports = dimensions['dim_airports']
+
+    rows = len(filtered_flights_csv)
+    with stage('create_fact_table.weather_keys', rows_in=rows):
+        flight_keys = flight_weather_keys(filtered_flights_csv)
+        dim_keys = dimension_weather_keys(dim_weather) if dim_weather_keys is None else dim_weather_keys
+    with stage('create_fact_table.weather_lookup', rows_in=rows):
+        weather_id = lookup_ids(flight_keys, dim_keys, dim_weather['weather_id'])
+        if not weather_id.isna().any():
+            weather_id = weather_id.to_numpy(dtype=np.int64)
+    with stage('create_fact_table.airport_lookup', rows_in=rows):
+        origin_airport_oid = lookup_ids(filtered_flights_csv['ORIGIN'], dim_airports['iata_code'], dim_airports['airport_id'])
+        dest_airport_oid = lookup_ids(filtered_flights_csv['DEST'], dim_airports['iata_code'], dim_airports['airport_id'])
+
+    # .array keeps the compact (nullable, categorical) dtypes of the flights frame
+    with stage('create_fact_table.assemble', rows_in=rows) as record:
+        fact_flights = pd.DataFrame({
+            'flight_id': np.arange(first_flight_id, first_flight_id + len(filtered_flights_csv)),
+            'date': pd.to_datetime(filtered_flights_csv['FL_DATE']).array,
+            'scheduled_dep_time': filtered_flights_csv['DEP_HOUR'].array,
+            'departure_delay': filtered_flights_csv['DEP_DELAY'].array,
+            'is_cancelled': (filtered_flights_csv['CANCELLED'] > 0).to_numpy(dtype=int, na_value=0),
+            'cancellation_code': filtered_flights_csv['CANCELLED'].array,
+            'TAIL_NUM': filtered_flights_csv['TAIL_NUM'].array,
+            'origin_airport_oid': origin_airport_oid,
+            'dest_airport_oid': dest_airport_oid,
+            'weather_id': weather_id
+        })
+        record['rows_out'] = len(fact_flights)
     
-    # 2. Transform ACTIVE_WEATHER to description for joining
-    weather_status_map = {
-        0.0: 'No weather events present',
-        1.0: 'Weather event(s) present',
-        2.0: 'Significant weather event(s) present'
+    return fact_flights
+
+
+def iter_fact_chunks(filtered_flights_csv, dimensions, chunksize=FACT_CHUNKSIZE):
+    """
+    Build the fact table in chunks of `chunksize` flights, with the same rows and
+    flight_ids as create_fact_table on the whole frame.
+    """
+    dim_keys = dimension_weather_keys(dimensions['dim_weather'])
+    for start in range(0, len(filtered_flights_csv), chunksize):
+        yield create_fact_table(
+            filtered_flights_csv.iloc[start:start + chunksize], dimensions,
+            first_flight_id=start + 1, dim_weather_keys=dim_keys
+        )
+
+
+# Natural key and surrogate key (if any) of each star schema dimension
+DIMENSION_KEYS = {
+    'dim_date': (['date'], None),
+    'dim_weather': (['WIND_SPD', 'TEMPERATURE', 'WEATHER_STATUS_DESCRIPTION', 'VISIBILITY'], 'weather_id'),
+    'dim_aircraft': (['TAIL_NUM'], None),
+    'dim_aircraft_carriers': (['OP_UNIQUE_CARRIER'], None),
+    'dim_airports': (['iata_code'], 'airport_id'),
+    'dim_cancellation': (['cancellation_code'], None)
+}
+
+POSTGRES_CONFIG = {
+    'user': 'talhacaliskan',
+    'password': '',
+    'host': 'localhost',
+    'port': 5432,
+    'dbname': 'flight_warehouse'
+}
+
+
+def create_warehouse_engine(user, password, host, port, dbname):
+    """
+    Create a SQLAlchemy engine for the PostgreSQL warehouse.
+    """
+    return create_engine(f'postgresql+psycopg2://{user}:{password}@{host}:{port}/{dbname}')
+
+
+def read_warehouse_table(engine, table_name, columns=None):
+    """
+    Read a star table from the warehouse, or return None if it does not exist yet.
+    """
+    if not inspect(engine).has_table(table_name):
+        return None
+    column_sql = '*' if columns is None else ', '.join(f'"{col}"' for col in columns)
+    return pd.read_sql(f'SELECT {column_sql} FROM "{table_name}"', engine)
+
+
+def read_warehouse_state(engine, cube_names=()):
+    """
+    Read what an incremental load needs from the warehouse: all dimension tables, the summary
+    tables in `cube_names`, the FL_DATE partitions already loaded and the highest flight_id.
+    Returns None if the fact table does not exist yet.
+    """
+    if not inspect(engine).has_table('fact_flights_star'):
+        return None
+    with engine.connect() as conn:
+        loaded = pd.read_sql('SELECT DISTINCT "date" FROM fact_flights_star', conn)
+        max_flight_id = conn.execute(text('SELECT MAX(flight_id) FROM fact_flights_star')).scalar()
+    return {
+        'dimensions': {name: read_warehouse_table(engine, name + '_star') for name in DIMENSION_KEYS},
+        'cubes': {name: read_warehouse_table(engine, name + '_star') for name in cube_names},
+        'loaded_dates': set(pd.to_datetime(loaded['date']).dt.normalize()),
+        'max_flight_id': int(max_flight_id or 0)
     }
-    fact_flights['WEATHER_STATUS_DESCRIPTION'] = fact_flights['ACTIVE_WEATHER'].map(weather_status_map).fillna('Unknown')
-    
-    # Join with weather dimension using description instead of code
-    weather_cols = ['WIND_SPD', 'TEMPERATURE', 'WEATHER_STATUS_DESCRIPTION', 'VISIBILITY']
-    fact_flights = fact_flights.merge(
-        dimensions['dim_weather'][['weather_id'] + weather_cols],
-        on=weather_cols,
-        how='left'
-    )
-    
-    fact_flights = fact_flights.drop(weather_cols + ['ACTIVE_WEATHER'], axis=1)
-    
-    # 3. Add origin and destination airport FKs directly
-    # Join origin airport
-    fact_flights = fact_flights.merge(
-        dimensions['dim_airports'][['iata_code', 'airport_id']], 
-        left_on='ORIGIN', 
-        right_on='iata_code', 
-        how='left'
-    )
-    fact_flights = fact_flights.rename(columns={'airport_id': 'origin_airport_oid'})
-    fact_flights = fact_flights.drop('iata_code', axis=1)
-    
-    # Join destination airport
-    fact_flights = fact_flights.merge(
-        dimensions['dim_airports'][['iata_code', 'airport_id']], 
-        left_on='DEST', 
-        right_on='iata_code', 
-        how='left'
+
+
+def select_new_partitions(filtered_flights_csv, loaded_dates):
+    """
+    Keep only flights whose FL_DATE partition has not been loaded yet.
+    """
+    flight_dates = pd.to_datetime(filtered_flights_csv['FL_DATE']).dt.normalize()
+    is_new = ~flight_dates.isin(loaded_dates)
+    print(f"Incremental load: {is_new.sum()} of {len(filtered_flights_csv)} flights are in new FL_DATE partitions "
+          f"({flight_dates[is_new].nunique()} new dates)")
+    return filtered_flights_csv[is_new.to_numpy()]
+
+
+def _key_index_is_current(key_index, state):
+    # The index is only trusted if it was last updated by the load that produced the current warehouse
+    return (
+        key_index is not None and len(key_index) > 0
+        and key_index.meta['max_flight_id'] == state['max_flight_id']
     )
-    fact_flights = fact_flights.rename(columns={'airport_id': 'dest_airport_oid'})
-    fact_flights = fact_flights.drop('iata_code', axis=1)
 
-    # Somehow the airport IDs are not integers if I dont convert them
-    fact_flights['origin_airport_oid'] = fact_flights['origin_airport_oid'].astype('Int64')
-    fact_flights['dest_airport_oid'] = fact_flights['dest_airport_oid'].astype('Int64')
 
-    # Drop ORIGIN and DEST after getting airport IDs
-    fact_flights = fact_flights.drop(['ORIGIN', 'DEST'], axis=1)
-    
-    # 4. Rename columns to match fact table schema
-    fact_flights = fact_flights.rename(columns={
-        'DEP_HOUR': 'scheduled_dep_time',
-        'DEP_DELAY': 'departure_delay',
-        'CANCELLED': 'cancellation_code',  
-        'TAIL_NUM': 'TAIL_NUM' 
-    })
-    
-    # Add is_cancelled binary measure
-    fact_flights['is_cancelled'] = (fact_flights['cancellation_code'] > 0).astype(int)
-    
-    # 5. Drop unnecessary columns
-    if 'FL_DATE' in fact_flights.columns:
-        fact_flights = fact_flights.drop('FL_DATE', axis=1)
-    if 'CRS_DEP_TIME' in fact_flights.columns:
-        fact_flights = fact_flights.drop('CRS_DEP_TIME', axis=1)
-    
-    # Drop aircraft-related columns
-    aircraft_cols_to_drop = ['MANUFACTURER', 'ICAO TYPE', 'YEAR OF MANUFACTURE', 'OP_UNIQUE_CARRIER']
-    for col in aircraft_cols_to_drop:
-        if col in fact_flights.columns:
-            fact_flights = fact_flights.drop(col, axis=1)
-    
-    # Select final columns in proper order
-    fact_columns = [
-        'flight_id',
-        'date',
-        'scheduled_dep_time',
-        'departure_delay',
-        'is_cancelled',
-        'cancellation_code',
-        'TAIL_NUM',
-        'origin_airport_oid',
-        'dest_airport_oid',
-        'weather_id'
-    ]
-    
-    fact_flights = fact_flights[fact_columns]
-    
-    return fact_flights
+def select_incremental_flights(filtered_flights_csv, state, key_index=None):
+    """
+    The flights an incremental load still has to add to the warehouse described by `state`
+    (see read_warehouse_state): those whose dedup key is not in `key_index`, or without an
+    up-to-date key index, those in FL_DATE partitions not loaded yet. Only reads the key
+    columns, so it can run right after the extract, before dedup, interpolation and cleaning.
+    When the partitions are used, a key index is rebuilt from the flights of the loaded
+    partitions, so the load that follows keeps it up to date and later loads can trust it.
+    """
+    if _key_index_is_current(key_index, state):
+        return drop_loaded_keys(filtered_flights_csv, key_index)
+    if key_index is not None:
+        print("Key index is missing or out of date, selecting new flights by FL_DATE partition")
+        _rebuild_key_index(key_index, filtered_flights_csv, state)
+    return select_new_partitions(filtered_flights_csv, state['loaded_dates'])
 
 
-def transform_to_star_schema(filtered_flights_csv, filtered_airports_csv, carriers_data, db_path="flight_warehouse.db"):
+def _rebuild_key_index(key_index, filtered_flights_csv, state):
     """
-    Main function to transform normalized data to star schema and save to SQLite DB
+    Reset the key index to the flights of the FL_DATE partitions the warehouse already has.
+    The fact table does not keep CRS_DEP_TIME, so the keys come from the input, the same source
+    the loads record (see transform_to_star_schema's key_hashes); the index is only rebuilt when
+    the input covers every loaded partition (otherwise keys would be missing).
     """
-    print("\nCreating Star Schema...")
+    flight_dates = pd.to_datetime(filtered_flights_csv['FL_DATE']).dt.normalize()
+    loaded = flight_dates.isin(state['loaded_dates']).to_numpy()
+    covered = set(flight_dates[loaded].unique())
+    if not state['loaded_dates'] <= covered:
+        print(f"Key index not rebuilt: the input covers {len(covered)} of the {len(state['loaded_dates'])} "
+              f"FL_DATE partitions in the warehouse")
+        return
+    _record_loaded_keys(key_index, dedup_key_hashes(filtered_flights_csv[loaded]), state['max_flight_id'],
+                        reset=True)
 
-    dimensions = create_star_schema_dimensions(
-        filtered_flights_csv, 
-        filtered_airports_csv, 
-        carriers_data
+
+def extend_dimension(existing, candidates, natural_key, surrogate_key=None):
+    """
+    Add the members of `candidates` that are not in `existing` yet.
+    Existing members keep their surrogate keys; new members get keys after the current maximum.
+    Returns the full dimension and the new members only.
+    """
+    if existing is None or existing.empty:
+        return candidates, candidates
+
+    # Database round trips can change key dtypes (e.g. dates read back as strings)
+    existing = existing.astype(candidates[natural_key].dtypes.to_dict())
+    match = candidates[natural_key].merge(
+        existing[natural_key].drop_duplicates(), on=natural_key, how='left', indicator=True
     )
-    fact_flights = create_fact_table(filtered_flights_csv, dimensions)
-    star_schema = {
-        'fact_flights': fact_flights,
-        **dimensions
-    }
+    new_members = candidates[(match['_merge'] == 'left_only').to_numpy()]
+    if surrogate_key is not None:
+        next_key = int(existing[surrogate_key].max()) + 1
+        new_members = new_members.assign(**{surrogate_key: range(next_key, next_key + len(new_members))})
 
-    save_to_postgresql(
-    star_schema,
-    user='talhacaliskan',
-    password='',
-    host='localhost',
-    port=5432,
-    dbname='flight_warehouse')
+    full_dimension = pd.concat([existing[list(candidates.columns)], new_members], ignore_index=True)
+    return full_dimension, new_members
 
-    print(f"\nStar schema tables saved to {db_path}")
 
+def _print_foreign_key_verification(fact_flights):
     print("\nForeign Key Verification:")
     print(f"  Origin airports: {fact_flights['origin_airport_oid'].nunique()} unique airports")
     print(f"  Destination airports: {fact_flights['dest_airport_oid'].nunique()} unique airports")
@@ -257,20 +411,247 @@ def transform_to_star_schema(filtered_flights_csv, filtered_airports_csv, carrie
     print(f"  Aircraft (TAIL_NUM) references {fact_flights['TAIL_NUM'].nunique()} unique aircraft")
     print(f"  Cancellation codes: {fact_flights['cancellation_code'].value_counts().to_dict()}")
 
+
+def _default_writer(writer):
+    if writer is not None:
+        return writer
+    from etl.writers import PostgresWriter
+    return PostgresWriter()
+
+
+def transform_to_star_schema(filtered_flights_csv, filtered_airports_csv, carriers_data, writer=None,
+                             station_weather=None, incremental=False, cube_grains=None, pipelined=False,
+                             fact_chunksize=FACT_CHUNKSIZE, key_index=None, state=None, key_hashes=None,
+                             already_selected=False):
+    """
+    Main function to transform normalized data to star schema and save it with `writer`
+    (a WarehouseWriter from etl/writers.py, by default PostgreSQL at POSTGRES_CONFIG).
+    With incremental=True only the new rows are appended (see load_incremental_star_schema).
+    The delay cubes in `cube_grains` (default DELAY_CUBE_GRAINS, {} for none) are built from
+    the fact table and saved with the star tables.
+    With pipelined=True the fact table is built in chunks that are written while the next ones
+    are built, and it is not returned (see transform_to_star_schema_pipelined).
+    With a key_index (etl/key_index.py) the dedup keys of the loaded flights are recorded,
+    and incremental loads skip flights whose key is already in the warehouse.
+    The index holds the keys of the flights as they were selected, before cleaning, which is
+    also what a rebuild from the input records (see _rebuild_key_index): flights the cleaning
+    rejected are not selected again. `key_hashes` are those keys (dedup_key_hashes of the
+    flights before cleaning) when filtered_flights_csv has been cleaned since; by default the
+    keys of filtered_flights_csv are recorded.
+    `state` passes the warehouse state an incremental run has already read, and
+    already_selected=True tells the incremental load that the flights are only those
+    select_incremental_flights kept for it.
+    """
+    if incremental and pipelined:
+        raise ValueError("A pipelined load replaces the warehouse; it cannot be combined with incremental=True")
+    writer = _default_writer(writer)
+    if incremental:
+        return load_incremental_star_schema(
+            filtered_flights_csv, filtered_airports_csv, carriers_data, station_weather, cube_grains, writer,
+            key_index, state, key_hashes, already_selected
+        )
+
+    if pipelined:
+        star_schema = transform_to_star_schema_pipelined(
+            filtered_flights_csv, filtered_airports_csv, carriers_data, writer, station_weather,
+            cube_grains, fact_chunksize
+        )
+        _record_loaded_keys(key_index, _loaded_key_hashes(key_index, filtered_flights_csv, key_hashes),
+                            len(filtered_flights_csv), reset=True)
+        return star_schema
+
+    print("\nCreating Star Schema...")
+
+    dimensions = run_stage(
+        'create_star_schema_dimensions',
+        create_star_schema_dimensions,
+        filtered_flights_csv, 
+        filtered_airports_csv, 
+        carriers_data,
+        station_weather
+    )
+    fact_flights = run_stage('create_fact_table', create_fact_table, filtered_flights_csv, dimensions)
+    cubes = run_stage('build_delay_cubes', build_delay_cubes, fact_flights, dimensions, cube_grains)
+    star_schema = {
+        'fact_flights': fact_flights,
+        **dimensions,
+        **cubes
+    }
+
+    run_stage(f'save_to_{writer.name}', writer.write, star_schema)
+    _record_loaded_keys(key_index, _loaded_key_hashes(key_index, filtered_flights_csv, key_hashes),
+                        len(fact_flights), reset=True)
+
+    _print_foreign_key_verification(fact_flights)
+
     return star_schema
 
 
-def save_to_postgresql(star_schema, user, password, host, port, dbname):
+def _loaded_key_hashes(key_index, flights, key_hashes=None):
+    """The dedup key hashes a load records: `key_hashes` if the caller has them, else those of `flights`"""
+    if key_index is None or key_hashes is not None:
+        return key_hashes
+    return dedup_key_hashes(flights)
+
+
+def _record_loaded_keys(key_index, hashes, max_flight_id, reset=False):
+    """Add the dedup key hashes of flights that were just loaded to the key index (reset=True after a full load)"""
+    if key_index is None:
+        return
+    with stage('update_key_index', rows_in=len(hashes)):
+        added = key_index.add(hashes, max_flight_id=max_flight_id, reset=reset)
+    print(f"Key index: recorded {added} new keys ({len(key_index)} in total)")
+
+
+def transform_to_star_schema_pipelined(filtered_flights_csv, filtered_airports_csv, carriers_data, writer,
+                                       station_weather=None, cube_grains=None, fact_chunksize=FACT_CHUNKSIZE):
+    """
+    Build and save the star schema with the fact table streamed in chunks: the writer saves the
+    dimensions and each fact chunk while the following chunks are built, so only a few chunks
+    are in memory and the run takes about the longer of the transform and the write, not their sum.
+    The delay cubes are merged chunk by chunk and saved after the fact table.
+    Returns the dimensions and cubes; the fact table is only in the warehouse.
+    """
+    print("\nCreating Star Schema (pipelined)...")
+
+    dimensions = run_stage(
+        'create_star_schema_dimensions', create_star_schema_dimensions,
+        filtered_flights_csv, filtered_airports_csv, carriers_data, station_weather
+    )
+    cubes = {}
+    fact_chunks = accumulate_cubes(
+        iter_fact_chunks(filtered_flights_csv, dimensions, fact_chunksize), dimensions, cubes, cube_grains
+    )
+    run_stage(f'save_to_{writer.name}', writer.write_pipelined, dimensions, fact_chunks,
+              partition_dates=filtered_flights_csv['FL_DATE'])
+    if cubes:
+        run_stage('save_delay_cubes', writer.write, cubes)
+    for name, cube in cubes.items():
+        print(f"Built {name}: {len(cube)} groups over {int(cube['flights'].sum())} flights")
+    return {**dimensions, **cubes}
+
+
+def load_incremental_star_schema(filtered_flights_csv, filtered_airports_csv, carriers_data, station_weather=None,
+                                 cube_grains=None, writer=None, key_index=None, state=None, key_hashes=None,
+                                 already_selected=False):
+    """
+    Append only new FL_DATE partitions to the warehouse.
+    Dimension members already in the warehouse keep their keys, new members are appended with
+    keys after the current maximum, and new fact rows continue the flight_id sequence.
+    The delay cubes of the new rows are merged into the warehouse cubes, which are replaced.
+    New flights are those whose dedup key is not in `key_index`, so late flights of loaded
+    dates are added too; without an up-to-date key index, those in FL_DATE partitions not loaded yet
+    (see select_incremental_flights). Callers that already applied it right after the extract
+    pass already_selected=True, and the flights are loaded as they are.
+    `state` is the warehouse state when the caller has read it, otherwise it is read here.
+    `key_hashes` are the keys to record for the new flights (see transform_to_star_schema).
+    Returns the appended rows per table and the updated cubes.
+    """
+    writer = _default_writer(writer)
+    cube_grains = DELAY_CUBE_GRAINS if cube_grains is None else cube_grains
+    if state is None:
+        state = writer.read_state(cube_names=list(cube_grains))
+    if state is None:
+        print("\nNo existing warehouse found, running a full load")
+        return transform_to_star_schema(
+            filtered_flights_csv, filtered_airports_csv, carriers_data, writer=writer,
+            station_weather=station_weather, cube_grains=cube_grains, key_index=key_index, key_hashes=key_hashes
+        )
+
+    print("\nCreating Star Schema (incremental)...")
+    new_flights = filtered_flights_csv
+    if not already_selected:
+        new_flights = run_stage('select_incremental_flights', select_incremental_flights,
+                                filtered_flights_csv, state, key_index)
+    # Also true when the selection has just rebuilt the index from the loaded partitions
+    use_key_index = _key_index_is_current(key_index, state)
+    if new_flights.empty:
+        print("Nothing to load: all FL_DATE partitions are already in the warehouse")
+        return {}
+
+    candidates = run_stage('create_star_schema_dimensions', create_star_schema_dimensions,
+                           new_flights, filtered_airports_csv, carriers_data, station_weather)
+    dimensions = {}
+    new_rows = {}
+    for name, candidate in candidates.items():
+        natural_key, surrogate_key = DIMENSION_KEYS[name]
+        dimensions[name], new_rows[name] = extend_dimension(
+            state['dimensions'][name], candidate, natural_key, surrogate_key
+        )
+
+    fact_flights = run_stage('create_fact_table', create_fact_table, new_flights, dimensions)
+    fact_flights['flight_id'] += state['max_flight_id']
+    new_rows = {'fact_flights': fact_flights, **new_rows}
+
+    run_stage(f'save_to_{writer.name}', writer.write, new_rows, if_exists='append')
+    if use_key_index:
+        _record_loaded_keys(key_index, _loaded_key_hashes(key_index, new_flights, key_hashes),
+                            int(fact_flights['flight_id'].max()))
+    _print_foreign_key_verification(fact_flights)
+
+    new_cubes = run_stage('build_delay_cubes', build_delay_cubes, fact_flights, dimensions, cube_grains)
+    cubes = {
+        name: merge_cubes(state['cubes'].get(name), cube, cube_grains[name])
+        for name, cube in new_cubes.items()
+    }
+    if cubes:
+        run_stage('save_delay_cubes', writer.write, cubes, if_exists='replace')
+    return {**new_rows, **cubes}
+
+
+def save_to_postgresql_pipelined(dimensions, fact_chunks, user, password, host, port, dbname, partition_dates=None,
+                                 if_exists='replace', max_workers=4, fact_writers=2, queue_size=FACT_QUEUE_SIZE,
+                                 chunksize=COPY_CHUNKSIZE):
+    """
+    Save the dimension tables and a stream of fact table chunks to a PostgreSQL database
+    concurrently (see pipelined_save_star_schema in etl/bulk_load.py).
+    """
+    with stage('save_to_postgresql.connect'):
+        pool = ThreadedConnectionPool(
+            1, max(1, max_workers) + max(1, fact_writers) + 1,
+            user=user, password=password, host=host, port=port, dbname=dbname
+        )
+    try:
+        report = pipelined_save_star_schema(
+            dimensions, fact_chunks, pool, partition_dates=partition_dates, if_exists=if_exists,
+            max_workers=max_workers, fact_writers=fact_writers, queue_size=queue_size, chunksize=chunksize
+        )
+    finally:
+        pool.closeall()
+    print(f"\nStar schema tables saved to PostgreSQL database '{dbname}' at {host}:{port}")
+    return report
+
+
+def save_to_postgresql(star_schema, user, password, host, port, dbname, if_exists='replace',
+                       method='copy', max_workers=4, chunksize=COPY_CHUNKSIZE):
     """
     Save star schema tables to a PostgreSQL database.
+    With if_exists='append' the rows are added to the existing tables.
+    method='copy' bulk-loads every table with COPY FROM STDIN (dimension tables concurrently,
+    each table in its own transaction); method='insert' uses DataFrame.to_sql.
     """
-    conn_str = f'postgresql+psycopg2://{user}:{password}@{host}:{port}/{dbname}'
-    engine = create_engine(conn_str)
+    if method == 'copy':
+        with stage('save_to_postgresql.connect'):
+            pool = ThreadedConnectionPool(
+                1, max(1, max_workers),
+                user=user, password=password, host=host, port=port, dbname=dbname
+            )
+        try:
+            report = bulk_save_star_schema(
+                star_schema, pool, if_exists=if_exists, max_workers=max_workers, chunksize=chunksize
+            )
+        finally:
+            pool.closeall()
+        print(f"\nStar schema tables saved to PostgreSQL database '{dbname}' at {host}:{port}")
+        return report
+
+    engine = create_warehouse_engine(user, password, host, port, dbname)
 
     for table_name, df in star_schema.items():
-        df.to_sql(table_name + "_star", engine, if_exists='replace', index=False)
+        with stage(f'save_to_postgresql.insert.{table_name}', rows_in=len(df)):
+            df.to_sql(table_name + "_star", engine, if_exists=if_exists, index=False)
         print(f"Saved {table_name} to PostgreSQL ({len(df)} rows, {len(df.columns)} columns)")
         if len(df) > 0:
             print(f"    Columns: {list(df.columns)}")
     engine.dispose()
-    print(f"\nStar schema tables saved to PostgreSQL database '{dbname}' at {host}:{port}")
\ No newline at end of file
+    print(f"\nStar schema tables saved to PostgreSQL database '{dbname}' at {host}:{port}")
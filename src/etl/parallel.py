@@ -0,0 +1,146 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from etl.transform import (CLEANING_RULES, WEATHER_NUMERIC_COLUMNS,
+                           apply_cleaning_result, cleaning_rule_columns,
+                           evaluate_cleaning_rules, fill_weather_columns,
+                           finalize_weather_columns, prepare_weather_columns)
+
+# Columns the weather fill reads and writes
+WEATHER_FILL_COLUMNS = ['FL_DATE', 'DEP_HOUR', 'ORIGIN', 'ACTIVE_WEATHER'] + WEATHER_NUMERIC_COLUMNS
+
+# Frame of the current stage inside a worker process, set once by the pool initializer
+_worker_frame = None
+
+
+def default_workers():
+    """Number of worker processes used when none is given: one per core"""
+    return os.cpu_count() or 1
+
+
+def _init_worker(frame):
+    global _worker_frame
+    _worker_frame = frame
+
+
+def _run_on_worker_frame(func, positions):
+    return func(_worker_frame.iloc[positions])
+
+
+def hash_partitions(keys, n_partitions):
+    """
+    Split the row positions into at most `n_partitions` groups by a hash of `keys`.
+    Rows with equal keys always land in the same partition, and positions stay ascending
+    within each partition, so a partition sees its rows in the serial order.
+    """
+    hashes = pd.util.hash_pandas_object(keys, index=False).to_numpy()
+    codes = (hashes % np.uint64(n_partitions)).astype(np.intp)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.cumsum(np.bincount(codes, minlength=n_partitions))[:-1]
+    return [positions for positions in np.split(order, bounds) if len(positions)]
+
+
+def range_partitions(n_rows, n_partitions):
+    """Split the row positions into at most `n_partitions` contiguous ranges"""
+    return [positions for positions in np.array_split(np.arange(n_rows), n_partitions) if len(positions)]
+
+
+def run_partitioned(func, frame, partitions, max_workers=None):
+    """
+    Run func(partition) for every partition of `frame` and return the results in partition order.
+    With more than one worker the partitions run in a process pool. The frame is handed to each
+    worker once when the pool starts, so only the partition positions are sent per task.
+    """
+    max_workers = default_workers() if max_workers is None else max_workers
+    if max_workers <= 1 or len(partitions) <= 1:
+        return [func(frame.iloc[positions]) for positions in partitions]
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(partitions)),
+                             initializer=_init_worker, initargs=(frame,)) as executor:
+        return list(executor.map(_run_on_worker_frame, [func] * len(partitions), partitions))
+
+
+def _scatter(partitions, results, n_rows, dtype):
+    """Place per-partition numpy results back at their row positions"""
+    combined = np.empty(n_rows, dtype=dtype)
+    for positions, result in zip(partitions, results):
+        combined[positions] = result
+    return combined
+
+
+def _partition_count(max_workers, n_partitions):
+    # A few partitions per worker keep the pool busy when some keys (hub airports) are much larger
+    max_workers = default_workers() if max_workers is None else max_workers
+    if n_partitions is not None:
+        return n_partitions
+    return 1 if max_workers <= 1 else max_workers * 4
+
+
+def _duplicated_rows(frame):
+    return frame.duplicated().to_numpy()
+
+
+def parallel_remove_duplicates(df, subset=None, partition_column='FL_DATE', max_workers=None, n_partitions=None):
+    """
+    remove_duplicates on hash partitions of `partition_column`.
+    The partition column must be part of the duplicate key, so duplicates always share a
+    partition; the first occurrence is kept, exactly as in the serial version.
+    """
+    if subset is not None and partition_column not in subset:
+        raise ValueError(f"Partition column {partition_column} must be part of the duplicate subset {subset}")
+    frame = df if subset is None else df[list(subset)]
+    partitions = hash_partitions(df[partition_column], _partition_count(max_workers, n_partitions))
+    results = run_partitioned(_duplicated_rows, frame, partitions, max_workers)
+    duplicated = _scatter(partitions, results, len(df), bool)
+
+    result = df[~duplicated]
+    print(f"Removed duplicates from flights data: {len(df) - len(result)} rows")
+    return result
+
+
+def _fill_weather_partition(frame, times_column=None):
+    filled = fill_weather_columns(frame, times=None if times_column is None else frame[times_column])
+    return filled[[col for col in ['ACTIVE_WEATHER'] + WEATHER_NUMERIC_COLUMNS if col in filled.columns]]
+
+
+def parallel_interpolate_weather(df, max_workers=None, n_partitions=None, times_column=None):
+    """
+    interpolate_all_weather_columns on hash partitions of ORIGIN.
+    Weather is only filled within an airport, so every airport is handled whole by one worker;
+    the filled columns are put back in the original row order before the serial finishing steps.
+    times_column names a column of precomputed flight datetimes to fill on.
+    """
+    df = prepare_weather_columns(df)
+    columns = [col for col in WEATHER_FILL_COLUMNS if col in df.columns]
+    if times_column is not None:
+        columns.append(times_column)
+    partitions = hash_partitions(df['ORIGIN'], _partition_count(max_workers, n_partitions))
+    results = run_partitioned(partial(_fill_weather_partition, times_column=times_column),
+                              df[columns], partitions, max_workers)
+
+    if results:
+        positions = np.concatenate(partitions)
+        restore = np.empty_like(positions)
+        restore[positions] = np.arange(len(positions))
+        filled = pd.concat(results, ignore_index=True).take(restore)
+        df = df.assign(**{col: pd.Series(filled[col].array, index=df.index) for col in filled.columns})
+    return finalize_weather_columns(df)
+
+
+def parallel_clean_flights(df, rules=None, quarantine_path=None, max_workers=None, n_partitions=None):
+    """
+    clean_flights_csv_data on contiguous row ranges. The rules look at one row at a time,
+    so the per-range masks and per-rule counts add up to the serial ones.
+    """
+    rules = CLEANING_RULES if rules is None else rules
+    partitions = range_partitions(len(df), _partition_count(max_workers, n_partitions))
+    results = run_partitioned(partial(evaluate_cleaning_rules, rules=rules),
+                              df[cleaning_rule_columns(rules)], partitions, max_workers)
+
+    keep = _scatter(partitions, [result[0] for result in results], len(df), bool)
+    first_rejection = _scatter(partitions, [result[2] for result in results], len(df), np.int16)
+    counts = {rule['name']: sum(result[1][rule['name']] for result in results) for rule in rules}
+    return apply_cleaning_result(df, rules, keep, counts, first_rejection, quarantine_path)
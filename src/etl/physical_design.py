@@ -0,0 +1,139 @@
+import pandas as pd
+from psycopg2 import sql
+
+# Physical design of the star schema, applied after the bulk load (table names without suffix)
+PRIMARY_KEYS = {
+    'fact_flights': ['flight_id', 'date'],  # a partitioned table's key must include the partition column
+    'dim_weather': ['weather_id'],
+    'dim_airports': ['airport_id'],
+    'dim_date': ['date']
+}
+
+FOREIGN_KEYS = {
+    'fact_flights': [
+        ('weather_id', 'dim_weather', 'weather_id'),
+        ('origin_airport_oid', 'dim_airports', 'airport_id'),
+        ('dest_airport_oid', 'dim_airports', 'airport_id'),
+        ('date', 'dim_date', 'date')
+    ]
+}
+
+INDEXES = {
+    'fact_flights': ['date', 'origin_airport_oid', 'dest_airport_oid', 'TAIL_NUM']
+}
+
+# Tables range-partitioned by month, with their partition column
+MONTH_PARTITIONED_TABLES = {
+    'fact_flights': 'date'
+}
+
+
+def month_partitions(dates):
+    """
+    Monthly range partitions covering `dates`, as (suffix, start, end) tuples.
+    """
+    months = pd.to_datetime(pd.Series(dates)).dropna().dt.to_period('M').unique()
+    return [
+        (f"p{month.year:04d}{month.month:02d}", month.start_time.date(), (month + 1).start_time.date())
+        for month in sorted(months)
+    ]
+
+
+def create_month_partitions(cursor, table_name, dates):
+    """
+    Create the missing monthly partitions of `table_name` for the given dates.
+    Returns the names of all partitions covering them.
+    """
+    names = []
+    for suffix, start, end in month_partitions(dates):
+        partition_name = f"{table_name}_{suffix}"
+        cursor.execute(sql.SQL('CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM ({}) TO ({})').format(
+            sql.Identifier(partition_name), sql.Identifier(table_name),
+            sql.Literal(start.isoformat()), sql.Literal(end.isoformat())
+        ))
+        names.append(partition_name)
+    return names
+
+
+def list_partitions(cursor, table_name):
+    """Names of the partitions attached to `table_name`"""
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = %s",
+        (table_name,)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _constraint_exists(cursor, constraint_name):
+    cursor.execute('SELECT 1 FROM pg_constraint WHERE conname = %s', (constraint_name,))
+    return cursor.fetchone() is not None
+
+
+def _table_exists(cursor, table_name):
+    cursor.execute('SELECT to_regclass(%s)', (table_name,))
+    return cursor.fetchone()[0] is not None
+
+
+def drop_foreign_keys(conn, suffix='_star'):
+    """
+    Drop the fact table's foreign keys before the tables are replaced, so the
+    concurrent table swaps never wait on each other through a constraint.
+    """
+    with conn.cursor() as cursor:
+        for table, references in FOREIGN_KEYS.items():
+            table_name = table + suffix
+            if not _table_exists(cursor, table_name):
+                continue
+            for column, _, _ in references:
+                cursor.execute(sql.SQL('ALTER TABLE {} DROP CONSTRAINT IF EXISTS {}').format(
+                    sql.Identifier(table_name), sql.Identifier(f"fk_{table_name}_{column.lower()}")
+                ))
+    conn.commit()
+
+
+def apply_physical_design(conn, tables, suffix='_star'):
+    """
+    Create primary keys, foreign keys and indexes on the loaded star tables, then ANALYZE them.
+    Runs after the bulk load so the data is not indexed row by row; existing constraints and
+    indexes (from an earlier run or an append) are left in place.
+    """
+    with conn.cursor() as cursor:
+        for table, columns in PRIMARY_KEYS.items():
+            table_name = table + suffix
+            constraint_name = f"pk_{table_name}"
+            if table in tables and not _constraint_exists(cursor, constraint_name):
+                cursor.execute(sql.SQL('ALTER TABLE {} ADD CONSTRAINT {} PRIMARY KEY ({})').format(
+                    sql.Identifier(table_name), sql.Identifier(constraint_name),
+                    sql.SQL(', ').join(sql.Identifier(col) for col in columns)
+                ))
+
+        for table, references in FOREIGN_KEYS.items():
+            table_name = table + suffix
+            for column, referenced_table, referenced_column in references:
+                constraint_name = f"fk_{table_name}_{column.lower()}"
+                if table not in tables or referenced_table not in tables:
+                    continue
+                if _constraint_exists(cursor, constraint_name):
+                    continue
+                cursor.execute(sql.SQL('ALTER TABLE {} ADD CONSTRAINT {} FOREIGN KEY ({}) REFERENCES {} ({})').format(
+                    sql.Identifier(table_name), sql.Identifier(constraint_name), sql.Identifier(column),
+                    sql.Identifier(referenced_table + suffix), sql.Identifier(referenced_column)
+                ))
+
+        for table, columns in INDEXES.items():
+            if table not in tables:
+                continue
+            table_name = table + suffix
+            for column in columns:
+                cursor.execute(sql.SQL('CREATE INDEX IF NOT EXISTS {} ON {} ({})').format(
+                    sql.Identifier(f"idx_{table_name}_{column.lower()}"),
+                    sql.Identifier(table_name), sql.Identifier(column)
+                ))
+
+        for table in tables:
+            cursor.execute(sql.SQL('ANALYZE {}').format(sql.Identifier(table + suffix)))
+    conn.commit()
+    print(f"Applied keys, indexes and statistics to {len(tables)} star tables")
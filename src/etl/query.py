@@ -0,0 +1,280 @@
+"""
+In-process queries over a built star schema.
+
+StarQuery loads the star tables once into numpy arrays:
+- The fact rows are sorted by (date, origin airport) and indexed by offsets. offsets[d * n + o]
+  is the first row of date d and origin o, so the rows of a date range, optionally narrowed to
+  some origins, are a few contiguous slices that are found without scanning.
+- Every attribute a query can filter or group on (date, month, origin, dest, carrier,
+  weather_status, hour, cancellation_code) is stored per fact row as a small integer code into a
+  sorted label array. The codes are resolved once through the dimension tables (the carrier via
+  dim_aircraft, the weather status via dim_weather), so queries do no joins. Like the carrier
+  cubes (see _carrier in etl/aggregates.py), a flight's carrier is the first one dim_aircraft
+  records for its tail, an approximation for tails that fly for several carriers.
+query() answers filtered group-by aggregates with vectorized scans of the selected rows and
+np.bincount. Each result is kept in an LRU cache keyed by the normalized query.
+"""
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+QUERY_CACHE_SIZE = 256
+
+# Fact columns the engine reads
+QUERY_FACT_COLUMNS = ['date', 'scheduled_dep_time', 'departure_delay', 'is_cancelled', 'cancellation_code',
+                      'TAIL_NUM', 'origin_airport_oid', 'dest_airport_oid', 'weather_id']
+
+# Measures a query can return. The sums are mergeable like the cube measures in etl/aggregates.py.
+QUERY_MEASURES = ['flights', 'cancelled_flights', 'cancellation_rate', 'delay_count', 'delay_sum', 'avg_delay']
+
+# Above this many possible groups the group codes are compacted by sorting instead of counted densely
+DENSE_GROUP_LIMIT = 1 << 22
+
+
+def _encode(keys, label_of_keys=None):
+    """
+    Codes of `keys` into their sorted distinct labels. label_of_keys maps an array of distinct
+    keys to their labels (default: the keys themselves), None for unknown. Missing keys and
+    unknown labels share the last code, labelled None. Returns (codes, labels).
+    """
+    key_codes, distinct = pd.factorize(keys)
+    labels = np.asarray(distinct, dtype=object) if label_of_keys is None else label_of_keys(distinct)
+    label_codes, sorted_labels = pd.factorize(pd.Series(labels, dtype=object), sort=True)
+    missing = len(sorted_labels)
+    label_codes = np.where(label_codes < 0, missing, label_codes)
+    # key code -1 (missing key) picks the appended missing code
+    codes = np.append(label_codes, missing)[key_codes]
+    labels = np.append(np.asarray(sorted_labels, dtype=object), None)
+    dtype = np.int16 if len(labels) < np.iinfo(np.int16).max else np.int32
+    return codes.astype(dtype), labels
+
+
+def _dimension_labels(keys, values):
+    """label_of_keys for a dimension: the value of each distinct key, None if the key is unknown"""
+    keys = pd.Index(keys)
+    values = np.append(np.asarray(values, dtype=object), None)
+
+    def labels(distinct):
+        return values[keys.get_indexer(pd.Index(distinct))]
+    return labels
+
+
+def _integer_labels(distinct):
+    return np.array([None if pd.isna(value) else int(value) for value in distinct], dtype=object)
+
+
+def _ranges(starts, ends):
+    """Positions of the concatenated half-open ranges [starts[i], ends[i])"""
+    lengths = ends - starts
+    keep = lengths > 0
+    starts, lengths = starts[keep], lengths[keep]
+    if not len(lengths):
+        return np.empty(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+    return np.arange(lengths.sum(), dtype=np.int64) + offsets
+
+
+def _as_list(value):
+    return list(value) if isinstance(value, (list, tuple, set, frozenset)) else [value]
+
+
+def _normalize_date(value):
+    """The day of any value pd.Timestamp accepts, so equal dates make equal cache keys"""
+    return None if value is None else pd.Timestamp(value).normalize()
+
+
+class StarQuery:
+    """
+    Query engine over the star tables (the dict transform_to_star_schema returns, names without
+    the '_star' suffix; see from_arrow to load an Arrow export). `cache_size` results are cached.
+    """
+
+    def __init__(self, star_schema, cache_size=QUERY_CACHE_SIZE):
+        fact = star_schema['fact_flights']
+        dim_airports = star_schema['dim_airports']
+        dim_weather = star_schema['dim_weather']
+        dim_aircraft = star_schema['dim_aircraft'].drop_duplicates('TAIL_NUM')
+
+        airport = _dimension_labels(dim_airports['airport_id'], dim_airports['iata_code'])
+        tails = fact['TAIL_NUM'].astype('category')
+        carrier_of_tail = _dimension_labels(dim_aircraft['TAIL_NUM'].astype(object),
+                                            dim_aircraft['OP_UNIQUE_CARRIER'].astype(object))
+        categories = np.append(tails.cat.categories.to_numpy(dtype=object), None)
+
+        dates = pd.to_datetime(fact['date']).dt.normalize().to_numpy()
+        columns = {
+            'date': _encode(dates),
+            'origin': _encode(fact['origin_airport_oid'].to_numpy(dtype=np.float64, na_value=np.nan), airport),
+            'dest': _encode(fact['dest_airport_oid'].to_numpy(dtype=np.float64, na_value=np.nan), airport),
+            'carrier': _encode(tails.cat.codes.to_numpy(), lambda codes: carrier_of_tail(categories[codes])),
+            'weather_status': _encode(
+                fact['weather_id'].to_numpy(dtype=np.float64, na_value=np.nan),
+                _dimension_labels(dim_weather['weather_id'], dim_weather['WEATHER_STATUS_DESCRIPTION'])
+            ),
+            'hour': _encode(fact['scheduled_dep_time'].to_numpy(dtype=np.float64, na_value=np.nan),
+                            _integer_labels),
+            'cancellation_code': _encode(fact['cancellation_code'].to_numpy(dtype=np.float64, na_value=np.nan),
+                                         _integer_labels)
+        }
+        self.labels = {name: labels for name, (_, labels) in columns.items()}
+        date_codes = columns['date'][0]
+        # month of every date label, as a code into the month labels
+        month_of_date, self.labels['month'] = _encode(
+            pd.DatetimeIndex(self.labels['date'][:-1]).strftime('%Y-%m').to_numpy()
+        )
+        self.month_of_date = np.append(month_of_date, len(self.labels['month']) - 1)
+
+        # Sort by (date, origin) and index the first row of every (date, origin) block
+        self.n_dates = len(self.labels['date'])
+        self.n_origins = len(self.labels['origin'])
+        block = date_codes.astype(np.int64) * self.n_origins + columns['origin'][0]
+        order = np.argsort(block, kind='stable')
+        self.offsets = np.searchsorted(block[order], np.arange(self.n_dates * self.n_origins + 1))
+
+        self.dates = pd.DatetimeIndex(self.labels['date'][:-1])
+        self.lookup = {name: {label: code for code, label in enumerate(labels)} for name, labels in self.labels.items()}
+        self.codes = {name: codes[order] for name, (codes, _) in columns.items()}
+        self.codes['month'] = self.month_of_date[self.codes['date']]
+        delay = fact['departure_delay'].to_numpy(dtype=np.float64, na_value=np.nan)[order]
+        self.delay_present = ~np.isnan(delay)
+        self.delay = np.where(self.delay_present, delay, 0)
+        self.cancelled = pd.to_numeric(fact['is_cancelled']).to_numpy(dtype=np.int8, na_value=0)[order]
+        self.rows = len(fact)
+
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_arrow(cls, input_dir="./Data/tables_arrow", suffix='_star', cache_size=QUERY_CACHE_SIZE):
+        """Load the tables written by save_tables_arrow (only the columns the engine reads)"""
+        from utils.output import load_table_arrow
+
+        columns = {
+            'fact_flights': QUERY_FACT_COLUMNS,
+            'dim_airports': ['airport_id', 'iata_code'],
+            'dim_weather': ['weather_id', 'WEATHER_STATUS_DESCRIPTION'],
+            'dim_aircraft': ['TAIL_NUM', 'OP_UNIQUE_CARRIER']
+        }
+        star_schema = {table: load_table_arrow(table + suffix, columns=table_columns, input_dir=input_dir)
+                       for table, table_columns in columns.items()}
+        return cls(star_schema, cache_size=cache_size)
+
+    def _label_codes(self, name, values):
+        """Codes of the requested labels of an attribute (labels that never occur are skipped)"""
+        if name not in self.labels:
+            raise ValueError(f"Unknown query attribute: {name} (known: {sorted(self.labels)})")
+        if name == 'date':
+            values = [pd.Timestamp(value).normalize() for value in values]
+        lookup = self.lookup[name]
+        return np.array([lookup[value] for value in values if value in lookup], dtype=np.int64)
+
+    def _date_code_range(self, date_from, date_to):
+        """First and one-past-last date code of the inclusive date range"""
+        dates = self.dates
+        start = 0 if date_from is None else dates.searchsorted(pd.Timestamp(date_from).normalize())
+        end = len(dates) if date_to is None else dates.searchsorted(pd.Timestamp(date_to).normalize(), side='right')
+        if date_from is None and date_to is None:
+            end = self.n_dates  # rows without a date are only selected without a date range
+        return int(start), int(end)
+
+    def _select(self, date_codes, origins):
+        """Rows of the (ascending) date codes and origins: a slice, or an array of positions"""
+        if origins is None:
+            starts = self.offsets[date_codes * self.n_origins]
+            ends = self.offsets[(date_codes + 1) * self.n_origins]
+            if not len(date_codes):
+                return slice(0, 0)
+            if date_codes[-1] - date_codes[0] == len(date_codes) - 1:
+                return slice(int(starts[0]), int(ends[-1]))
+            return _ranges(starts, ends)
+        blocks = (date_codes[:, None] * self.n_origins + origins[None, :]).ravel()
+        return _ranges(self.offsets[blocks], self.offsets[blocks + 1])
+
+    def query(self, measures=('flights', 'avg_delay'), group_by=(), date_from=None, date_to=None, **filters):
+        """
+        Aggregate the flights between date_from and date_to (inclusive, any value pd.Timestamp
+        accepts) that match every filter (attribute=label or a list of labels, e.g.
+        origin='ATL', carrier=['AA', 'DL'], weather_status='Rain'), grouped by the `group_by`
+        attributes. Returns a DataFrame with one row per non-empty group and the `measures`
+        (see QUERY_MEASURES). Missing attribute values form their own group, labelled None.
+        """
+        measures, group_by = list(measures), list(group_by)
+        for measure in measures:
+            if measure not in QUERY_MEASURES:
+                raise ValueError(f"Unknown measure: {measure} (known: {QUERY_MEASURES})")
+        filters = {name: tuple(_as_list(value)) for name, value in sorted(filters.items())}
+        if 'date' in filters:
+            filters['date'] = tuple(_normalize_date(value) for value in filters['date'])
+        date_from, date_to = _normalize_date(date_from), _normalize_date(date_to)
+        key = (tuple(measures), tuple(group_by), date_from, date_to, repr(filters))
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return self.cache[key].copy()
+
+        self.misses += 1
+        result = self._run(measures, group_by, date_from, date_to, filters)
+        self.cache[key] = result
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return result.copy()
+
+    def _run(self, measures, group_by, date_from, date_to, filters):
+        filter_codes = {name: self._label_codes(name, values) for name, values in filters.items()}
+        # Date, month and origin filters are answered by the offset index, the others by scanning
+        date_codes = np.arange(*self._date_code_range(date_from, date_to))
+        if 'date' in filter_codes:
+            date_codes = np.intersect1d(date_codes, filter_codes.pop('date'))
+        if 'month' in filter_codes:
+            date_codes = date_codes[np.isin(self.month_of_date[date_codes], filter_codes.pop('month'))]
+        rows = self._select(date_codes, filter_codes.pop('origin', None))
+
+        mask = None
+        for name, codes in filter_codes.items():
+            matches = np.isin(self.codes[name][rows], codes)
+            mask = matches if mask is None else mask & matches
+        if mask is not None:
+            rows = (np.flatnonzero(mask) + rows.start) if isinstance(rows, slice) else rows[mask]
+
+        sizes = [len(self.labels[name]) for name in group_by]
+        groups = np.zeros(rows.stop - rows.start if isinstance(rows, slice) else len(rows), dtype=np.int64)
+        for name, size in zip(group_by, sizes):
+            groups = groups * size + self.codes[name][rows]
+        n_groups = int(np.prod(sizes, dtype=np.int64))
+        if n_groups > DENSE_GROUP_LIMIT:
+            order = np.argsort(groups, kind='stable')
+            sorted_groups = groups[order]
+            first = np.concatenate([[True], sorted_groups[1:] != sorted_groups[:-1]])
+            group_ids = sorted_groups[first]
+            groups = np.empty_like(groups)
+            groups[order] = np.cumsum(first) - 1
+        else:
+            group_ids = np.arange(n_groups)
+
+        count = len(group_ids)
+        flights = np.bincount(groups, minlength=count)
+        present = flights > 0
+        sums = {
+            'flights': flights,
+            'cancelled_flights': np.bincount(groups, weights=self.cancelled[rows], minlength=count).astype(np.int64),
+            'delay_count': np.bincount(groups, weights=self.delay_present[rows], minlength=count).astype(np.int64),
+            'delay_sum': np.bincount(groups, weights=self.delay[rows], minlength=count)
+        }
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sums['cancellation_rate'] = sums['cancelled_flights'] / flights
+            sums['avg_delay'] = np.where(sums['delay_count'] > 0, sums['delay_sum'] / sums['delay_count'], np.nan)
+
+        result = {}
+        remaining = group_ids[present]
+        for name, size in reversed(list(zip(group_by, sizes))):
+            remaining, codes = np.divmod(remaining, size)
+            result[name] = self.labels[name][codes]
+        result = {name: result[name] for name in group_by}
+        result.update({measure: sums[measure][present] for measure in measures})
+        return pd.DataFrame(result)
+
+    def cache_info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.cache), 'max_size': self.cache_size}
@@ -0,0 +1,125 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from etl.key_index import dedup_key_hashes
+
+# Every (ORIGIN, carrier, month) stratum keeps at least one row
+SAMPLE_STRATA = ['ORIGIN', 'OP_UNIQUE_CARRIER', 'month']
+# Columns whose every value keeps at least one row, so the dimensions built from them stay complete
+SAMPLE_COVERAGE = ['DEST', 'TAIL_NUM', 'FL_DATE']
+
+
+def sample_scores(df, seed=0):
+    """
+    Uniform [0, 1) score per row from the hash of its dedup key and the seed. The score does
+    not depend on row order or chunking, and duplicate rows score alike, so they are sampled together.
+    """
+    hashes = dedup_key_hashes(df) ^ np.uint64(seed & 0xFFFFFFFFFFFFFFFF)
+    with np.errstate(over='ignore'):
+        hashes = (hashes ^ (hashes >> np.uint64(33))) * np.uint64(0xFF51AFD7ED558CCD)
+        hashes = (hashes ^ (hashes >> np.uint64(33))) * np.uint64(0xC4CEB9FE1A85EC53)
+        hashes ^= hashes >> np.uint64(33)
+    return (hashes >> np.uint64(11)).astype(np.float64) / 2 ** 53
+
+
+def _lowest_score_rows(keys, scores):
+    """Position of the lowest-scoring row of every group of `keys` (a DataFrame of group columns)"""
+    codes = keys.groupby(list(keys.columns), observed=True, sort=False, dropna=False).ngroup().to_numpy()
+    order = np.lexsort((scores, codes))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = codes[order][1:] != codes[order][:-1]
+    return order[first]
+
+
+def _coverage_rows(df, scores, strata=SAMPLE_STRATA, coverage=SAMPLE_COVERAGE):
+    """Mask of the lowest-scoring row of every stratum and of every value of the `coverage` columns"""
+    required = np.zeros(len(df), dtype=bool)
+    columns = {col: df[col] for col in strata if col != 'month'}
+    if 'month' in strata:
+        columns['month'] = pd.to_datetime(df['FL_DATE']).dt.to_period('M')
+    required[_lowest_score_rows(pd.DataFrame(columns), scores)] = True
+    for col in coverage:
+        present = df[col].notna().to_numpy()
+        positions = np.flatnonzero(present)
+        required[positions[_lowest_score_rows(df.loc[present, [col]], scores[present])]] = True
+    return required
+
+
+def stratified_sample(df, rate, seed=0, strata=SAMPLE_STRATA, coverage=SAMPLE_COVERAGE, total_rows=None):
+    """
+    Reproducible sample of at most round(rate * total_rows) flights (total_rows defaults to len(df);
+    pass it when `df` holds only the sample_candidates of a larger input).
+    The lowest-scoring row of every stratum and of every value in the `coverage` columns is always
+    kept (see sample_scores); the rest of the sample is the rows scoring below `rate`, cut at the
+    lowest scores when they would exceed the sample size. Only when the coverage rows alone exceed
+    it is the sample larger. The 'month' stratum is derived from FL_DATE.
+    Returns the sample in the original row order.
+    """
+    if not 0 < rate <= 1:
+        raise ValueError(f"Sample rate must be in (0, 1], got {rate}")
+    total_rows = len(df) if total_rows is None else total_rows
+    if rate == 1:
+        return df
+    scores = sample_scores(df, seed)
+    required = _coverage_rows(df, scores, strata, coverage)
+    optional = (scores < rate) & ~required
+    budget = max(0, round(rate * total_rows) - int(required.sum()))
+    if optional.sum() > budget:
+        # Rows of equal score (duplicates) stay together, so the cut may leave the sample a few rows short
+        optional &= scores < np.sort(scores[optional])[budget]
+
+    sample = df[required | optional]
+    print(f"Sampled {len(sample)} of {total_rows} flights ({len(sample) / max(total_rows, 1):.2%}, rate {rate}, "
+          f"seed {seed}), {int(required.sum())} of them covering every {', '.join(strata)} stratum "
+          f"and every {', '.join(coverage)} value")
+    if required.sum() > round(rate * total_rows):
+        print(f"Warning: the coverage rows alone exceed the sample size of rate {rate}")
+    return sample
+
+
+def sample_candidates(df, rate, seed=0, strata=SAMPLE_STRATA, coverage=SAMPLE_COVERAGE):
+    """
+    The rows of a chunk that can be in the stratified_sample of the whole input: those scoring
+    below `rate` and the chunk's lowest-scoring row of every stratum and coverage value (the
+    lowest-scoring row of a group over all chunks is the lowest of the chunks' lowest).
+    """
+    if rate == 1:
+        return df
+    scores = sample_scores(df, seed)
+    return df[(scores < rate) | _coverage_rows(df, scores, strata, coverage)]
+
+
+class SampleCandidates:
+    """
+    Chunk filter that samples while the flights are read: each chunk is cut down to its
+    sample_candidates and the rows are counted, and sample() then draws from the candidates of
+    all chunks the same sample stratified_sample draws from the whole input. Chunks may be
+    filtered from several threads.
+    """
+
+    def __init__(self, rate, seed=0, strata=SAMPLE_STRATA, coverage=SAMPLE_COVERAGE):
+        if not 0 < rate <= 1:
+            raise ValueError(f"Sample rate must be in (0, 1], got {rate}")
+        self.rate = rate
+        self.seed = seed
+        self.strata = strata
+        self.coverage = coverage
+        self.rows = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, chunk):
+        with self.lock:
+            self.rows += len(chunk)
+        return sample_candidates(chunk, self.rate, self.seed, self.strata, self.coverage)
+
+    def sample(self, candidates):
+        return stratified_sample(candidates, self.rate, self.seed, self.strata, self.coverage, total_rows=self.rows)
+
+
+def sample_cache_path(cache_path, rate, seed=0):
+    """Extract cache of a sample, next to the cache of the full extract"""
+    root, ext = os.path.splitext(cache_path)
+    return f"{root}.sample-{rate:g}-{seed}{ext}"
@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Compact in-memory dtypes for the flights frame. Codes are categoricals, hours, flags and small
+# counts are nullable small ints and FL_DATE is parsed once. DEP_DELAY and the weather measures
+# stay float64 by default: delays are summed into the cubes, and weather values are interpolated
+# and rounded into dim_weather keys, so float32 values change the weather dimension (see flights_schema).
+FLIGHTS_SCHEMA = {
+    'FL_DATE': 'datetime64[s]',
+    'DEP_HOUR': 'Int8',
+    'CRS_DEP_TIME': 'Int16',
+    'DEP_DELAY': 'float64',
+    'CANCELLED': 'Int8',
+    'TAIL_NUM': 'category',
+    'MANUFACTURER': 'category',
+    'ICAO TYPE': 'category',
+    'YEAR OF MANUFACTURE': 'Int16',
+    'OP_UNIQUE_CARRIER': 'category',
+    'ORIGIN': 'category',
+    'DEST': 'category',
+    'WIND_SPD': 'float64',
+    'TEMPERATURE': 'float64',
+    'ACTIVE_WEATHER': 'Int8',
+    'VISIBILITY': 'float64'
+}
+
+NULLABLE_INT_DTYPES = ('Int8', 'Int16', 'Int32', 'Int64')
+
+# Weather measures stored as float32 with compact_weather=True
+COMPACT_WEATHER_COLUMNS = ['WIND_SPD', 'TEMPERATURE', 'VISIBILITY']
+
+
+def flights_schema(compact_weather=False):
+    """
+    FLIGHTS_SCHEMA, or with compact_weather=True the same schema with float32 weather measures.
+    The compact frame is smaller but not equivalent: interpolated float32 values round to
+    different dim_weather rows, so the weather dimension and the fact weather_id change.
+    """
+    if not compact_weather:
+        return FLIGHTS_SCHEMA
+    return {**FLIGHTS_SCHEMA, **{col: 'float32' for col in COMPACT_WEATHER_COLUMNS}}
+
+
+def read_csv_options(columns, schema=None):
+    """
+    dtype and parse_dates arguments for pd.read_csv that produce the schema dtypes
+    for the given columns while parsing. parse_dates yields the parser's own datetime unit,
+    so readers pass the parsed frame through apply_flights_schema to get the schema unit.
+    Nullable integer columns are parsed as float64 (the parser fails on a value like "5.5"),
+    and apply_flights_schema downcasts them once their values are checked.
+    """
+    schema = FLIGHTS_SCHEMA if schema is None else schema
+    dates = [col for col in columns if str(schema.get(col, '')).startswith('datetime64')]
+    dtypes = {col: 'float64' if schema[col] in NULLABLE_INT_DTYPES else schema[col]
+              for col in columns if col in schema and col not in dates}
+    return {'dtype': dtypes, 'parse_dates': dates}
+
+
+def _to_nullable_int(values, dtype, col):
+    """
+    `values` as the nullable integer `dtype` when they are all whole numbers in its range,
+    otherwise as float64, so a value like 5.5 is kept instead of failing the cast.
+    """
+    values = pd.to_numeric(values, errors='coerce').astype('float64')
+    present = values.dropna().to_numpy()
+    info = np.iinfo(dtype.lower())
+    if len(present) and ((present % 1 != 0).any() or present.min() < info.min or present.max() > info.max):
+        print(f"Schema: {col} has values that are not {dtype} integers, kept as float64")
+        return values
+    return values.astype(dtype)
+
+
+def apply_flights_schema(df, schema=None):
+    """
+    Cast the columns of `df` that appear in the schema to their compact dtypes.
+    Columns that already have the right dtype are left untouched; integer columns with
+    fractional or out-of-range values stay float64 (see _to_nullable_int).
+    """
+    schema = FLIGHTS_SCHEMA if schema is None else schema
+    casts = {}
+    for col, dtype in schema.items():
+        if col not in df.columns or str(df[col].dtype) == dtype:
+            continue
+        if dtype.startswith('datetime64'):
+            casts[col] = pd.to_datetime(df[col]).astype(dtype)
+        elif dtype in NULLABLE_INT_DTYPES:
+            casts[col] = _to_nullable_int(df[col], dtype, col)
+        else:
+            casts[col] = df[col].astype(dtype)
+    return df.assign(**casts) if casts else df
+
+
+def concat_frames(frames, schema=None):
+    """
+    Concatenate chunks read with the schema. Categorical columns are combined with
+    union_categoricals, because chunks read separately carry different categories
+    and a plain concat would fall back to object strings. An integer column that one
+    chunk had to keep as float64 is float64 in every chunk. Empty chunks are left out
+    unless every chunk is empty. Without any chunk the result is an empty frame with
+    the columns and dtypes of `schema`.
+    """
+    frames = [frame for frame in frames if frame is not None]
+    # Empty chunks (of a shard without rows, say) add no rows but may carry other category dtypes
+    frames = [frame for frame in frames if len(frame)] or frames[:1]
+    if not frames:
+        schema = FLIGHTS_SCHEMA if schema is None else schema
+        return apply_flights_schema(pd.DataFrame(columns=list(schema)), schema)
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+
+    floats = [col for col in frames[0].columns
+              if any(str(frame[col].dtype) == 'float64' for frame in frames)
+              and any(str(frame[col].dtype) in NULLABLE_INT_DTYPES for frame in frames)]
+    if floats:
+        frames = [frame.astype(dict.fromkeys(floats, 'float64')) for frame in frames]
+
+    combined = {}
+    for col in frames[0].columns:
+        if isinstance(frames[0][col].dtype, pd.CategoricalDtype):
+            combined[col] = pd.Series(union_categoricals([frame[col] for frame in frames]), name=col)
+    result = pd.concat([frame.drop(columns=list(combined)) for frame in frames], ignore_index=True)
+    result = result.assign(**combined)
+    return result[list(frames[0].columns)]
+
+
+def memory_usage_mb(df):
+    """Deep memory usage of a DataFrame in megabytes"""
+    return df.memory_usage(deep=True).sum() / 2 ** 20
+
+
+def report_memory(df, stage):
+    """Print the row count and memory footprint of the flights frame after a pipeline stage"""
+    print(f"[memory] {stage}: {len(df):,} rows, {memory_usage_mb(df):,.1f} MB")
+    return memory_usage_mb(df)
@@ -1,46 +1,202 @@
+import json
+import os
 from datetime import timedelta
 
 import numpy as np
 import pandas as pd
 
+WEATHER_NUMERIC_COLUMNS = ['WIND_SPD', 'TEMPERATURE', 'VISIBILITY']
 
-def interpolate_all_weather_columns(df):
+
+def weather_datetime(df):
+    """Observation time of each flight row: FL_DATE plus DEP_HOUR (missing hours count as 0)"""
+    return pd.to_datetime(df['FL_DATE']) + pd.to_timedelta(df['DEP_HOUR'].fillna(0), unit='h')
+
+
+def group_layout(keys, times):
     """
-    Fill all weather columns with debug output.
+    Sort rows once by (key, time) and describe the groups in sorted order.
+    The sort is stable, so rows with equal keys and times keep their original order.
+    Missing keys sort last and missing times sort last within their group.
+    Returns a dict with the sort order and, per sorted row, its group start and end (exclusive),
+    the last position of its run of equal timestamps and whether its key is present.
     """
-    df = df.copy()
-    
-    # Store original index to maintain row order
-    df['original_index'] = df.index
-    
-    df['datetime'] = pd.to_datetime(df['FL_DATE']) + pd.to_timedelta(df['DEP_HOUR'].fillna(0), unit='h')
-    df = df.set_index('datetime')
-    df = df.sort_values(['ORIGIN', 'datetime'])
-    
-    # Convert numeric columns
-    numeric_cols = ['WIND_SPD', 'TEMPERATURE', 'VISIBILITY']
-    for col in numeric_cols:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
+    codes, _ = pd.factorize(keys, sort=True)
+    key_valid = codes >= 0
+    codes = np.where(key_valid, codes, codes.max(initial=-1) + 1)
+
+    times = pd.DatetimeIndex(times)
+    time_i8 = times.asi8
+    sort_times = np.where(times.isna(), np.iinfo(np.int64).max, time_i8)
+
+    # Rank the timestamps densely so (key, time) packs into a single int64 sort key
+    time_rank, unique_times = pd.factorize(sort_times, sort=True)
+    order = np.argsort(codes.astype(np.int64) * len(unique_times) + time_rank, kind='stable')
+    n = len(order)
+    sorted_codes = codes[order]
+    sorted_times = sort_times[order]
+
+    new_group = np.ones(n, dtype=bool)
+    new_group[1:] = sorted_codes[1:] != sorted_codes[:-1]
+    group_starts = np.flatnonzero(new_group)
+    group_ends = np.append(group_starts[1:], n)
+    group_id = np.cumsum(new_group) - 1
+
+    new_run = new_group.copy()
+    new_run[1:] |= sorted_times[1:] != sorted_times[:-1]
+    run_last = np.append(np.flatnonzero(new_run)[1:], n) - 1
+    run_id = np.cumsum(new_run) - 1
+
+    return {
+        'order': order,
+        'row_start': group_starts[group_id] if n else group_starts,
+        'row_end': group_ends[group_id] if n else group_ends,
+        'run_last': run_last[run_id] if n else run_last,
+        'key_valid': key_valid[order],
+        'time_i8': time_i8[order]
+    }
+
+
+def _previous_valid(valid, layout):
+    """Position of the last valid row at or before each row within its group, or -1"""
+    positions = np.where(valid, np.arange(len(valid)), -1)
+    previous = np.maximum.accumulate(positions) if len(valid) else positions
+    return np.where(previous >= layout['row_start'], previous, -1)
+
+
+def _next_valid(valid, layout):
+    """Position of the first valid row at or after each row within its group, or -1"""
+    n = len(valid)
+    positions = np.where(valid, np.arange(n), n)
+    following = np.minimum.accumulate(positions[::-1])[::-1] if n else positions
+    return np.where(following < layout['row_end'], following, -1)
+
+
+def segmented_ffill_bfill(values, layout):
+    """
+    Forward fill then backward fill sorted values within each group.
+    Equivalent to groupby(key).transform(lambda x: x.ffill().bfill()) on the sorted rows.
+    """
+    valid = pd.notna(values) & layout['key_valid']
+    previous = _previous_valid(valid, layout)
+    source = np.where(previous >= 0, previous, _next_valid(valid, layout))
+    source = np.where(layout['key_valid'], source, -1)
+    return pd.api.extensions.take(values, source, allow_fill=True)
+
+
+def segmented_time_interpolate(values, layout):
+    """
+    Time-weighted linear interpolation of sorted float values within each group.
+    Reproduces groupby(key).transform(lambda x: x.interpolate(method='time')) exactly:
+    leading gaps stay NaN, trailing gaps take the last observation, and the interpolation
+    formula (including its NaN fallbacks) is the one np.interp uses.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    result = values.copy()
+    valid = ~np.isnan(values) & layout['key_valid']
+    result[~layout['key_valid']] = np.nan
+
+    previous = _previous_valid(valid, layout)
+    following = _next_valid(valid, layout)
+    n = len(values)
+
+    # A gap is only filled once its group has had an observation (limit_direction='forward')
+    has_previous = np.zeros(n, dtype=bool)
+    has_previous[1:] = previous[:-1] >= layout['row_start'][1:]
+    targets = np.flatnonzero(~valid & has_previous & layout['key_valid'])
+    if len(targets) == 0:
+        return result
+
+    x = layout['time_i8'].astype(np.float64)
+    # np.interp anchors on the last observation whose time is <= the gap's time,
+    # which includes observations sharing the gap's timestamp further down the group
+    left = previous[layout['run_last'][targets]]
+    right = np.full(len(targets), -1)
+    has_next = left + 1 < layout['row_end'][targets]
+    right[has_next] = following[left[has_next] + 1]
+
+    x_target = x[targets]
+    x_left = x[left]
+    y_left = values[left]
+    filled = y_left.copy()
+
+    interior = (right >= 0) & (x_left != x_target)
+    r = right[interior]
+    xl, yl, xt = x_left[interior], y_left[interior], x_target[interior]
+    xr, yr = x[r], values[r]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = (yr - yl) / (xr - xl)
+        interpolated = slope * (xt - xl) + yl
+        retry = np.isnan(interpolated)
+        interpolated[retry] = slope[retry] * (xt[retry] - xr[retry]) + yr[retry]
+    flat = np.isnan(interpolated) & (yl == yr)
+    interpolated[flat] = yl[flat]
+    filled[interior] = interpolated
+
+    result[targets] = filled
+    return result
+
+
+def _inverse_order(order):
+    inverse = np.empty_like(order)
+    inverse[order] = np.arange(len(order))
+    return inverse
+
+
+def fill_weather_columns(df, times=None):
+    """
+    Fill weather gaps per ORIGIN airport in one vectorized pass.
+    Rows are sorted once by (ORIGIN, datetime); ACTIVE_WEATHER is forward/backward filled and
+    WIND_SPD, TEMPERATURE and VISIBILITY are time-interpolated on that shared layout.
+    `times` defaults to the flight datetime built from FL_DATE and DEP_HOUR.
+    Returns a frame in the input row order with the input index; no rows are dropped.
+    """
+    if times is None:
+        times = weather_datetime(df)
+    layout = group_layout(df['ORIGIN'], times)
+    order = layout['order']
+    inverse = _inverse_order(order)
+    filled_columns = {}
 
-    print(f'Amount of NaN values before interpolation: {df[numeric_cols + ["ACTIVE_WEATHER"]].isna().sum()}')
-    # Forward/backward fill for ACTIVE_WEATHER
     if 'ACTIVE_WEATHER' in df.columns:
-        df['ACTIVE_WEATHER'] = df.groupby('ORIGIN')['ACTIVE_WEATHER'].transform(
-            lambda x: x.ffill().bfill()
-        )
-    
-    # Time interpolation for numeric columns
+        active = df['ACTIVE_WEATHER'].array.take(order)
+        filled = segmented_ffill_bfill(active, layout).take(inverse)
+        filled_columns['ACTIVE_WEATHER'] = pd.Series(filled, index=df.index, name='ACTIVE_WEATHER')
+
+    for col in WEATHER_NUMERIC_COLUMNS:
+        if col not in df.columns:
+            continue
+        column = pd.to_numeric(df[col], errors='coerce')
+        # Integer columns cannot hold gaps, so there is nothing to interpolate
+        if column.dtype.kind != 'f':
+            filled_columns[col] = column
+            continue
+        values = column.to_numpy(dtype=np.float64, na_value=np.nan)
+        filled = segmented_time_interpolate(values[order], layout)[inverse]
+        filled_columns[col] = pd.Series(filled, index=df.index).astype(column.dtype)
+
+    return df.assign(**filled_columns)
+
+
+def prepare_weather_columns(df):
+    """Make the numeric weather columns numeric and print the NaN counts before interpolation"""
+    numeric_cols = WEATHER_NUMERIC_COLUMNS
     for col in numeric_cols:
-        if col in df.columns:
-            df[col] = df.groupby('ORIGIN')[col].transform(
-                lambda x: x.interpolate(method='time')
-            )
-    
-    # Reset index and restore original order
-    df = df.reset_index()
-    df = df.sort_values('original_index')
-    df = df.drop(['original_index', 'datetime'], axis=1)
+        if col in df.columns and not pd.api.types.is_numeric_dtype(df[col]):
+            df = df.assign(**{col: pd.to_numeric(df[col], errors='coerce')})
+    print(f'Amount of NaN values before interpolation: {df[numeric_cols + ["ACTIVE_WEATHER"]].isna().sum()}')
+    return df
+
+
+def finalize_weather_columns(df):
+    """
+    Restore the original row order after filling, number the rows from 0 and drop the rows
+    whose weather could not be interpolated.
+    """
+    numeric_cols = WEATHER_NUMERIC_COLUMNS
+    # Restore the original order (by index label) and number the rows from 0
+    if not df.index.is_monotonic_increasing:
+        df = df.iloc[np.argsort(df.index.to_numpy(), kind='stable')]
     df = df.reset_index(drop=True)
     print(f'Amount of NaN values after interpolation: {df[numeric_cols + ["ACTIVE_WEATHER"]].isna().sum()}')
     # Drop all rows with NaN in numeric columns or ACTIVE_WEATHER since they couldnt be interpolated
@@ -49,6 +205,98 @@ def interpolate_all_weather_columns(df):
     return df
 
 
+def interpolate_all_weather_columns(df):
+    """
+    Fill all weather columns with debug output.
+    """
+    df = prepare_weather_columns(df)
+    df = fill_weather_columns(df)
+    return finalize_weather_columns(df)
+
+
+def build_station_weather(df, freq='h', times=None):
+    """
+    Collapse the per-flight weather columns into one row per (ORIGIN, hour).
+    Partial observations within the same hour are combined (first non-null value per column),
+    every station gets a complete grid from its first to its last observed hour,
+    and the gaps on that grid are filled with the same rules as interpolate_all_weather_columns.
+    `times` defaults to the flight datetime built from FL_DATE and DEP_HOUR.
+    """
+    if times is None:
+        times = weather_datetime(df)
+    weather_cols = [col for col in WEATHER_NUMERIC_COLUMNS + ['ACTIVE_WEATHER'] if col in df.columns]
+    observations = df[['ORIGIN'] + weather_cols].assign(hour=times.dt.floor(freq))
+    observations = observations.dropna(subset=weather_cols, how='all')
+    observed = observations.groupby(['ORIGIN', 'hour'], sort=True, observed=True)[weather_cols].first()
+    observed = observed.reset_index()
+
+    # Complete hourly grid per station, built without a Python loop over stations
+    span = observed.groupby('ORIGIN', sort=True, observed=True)['hour'].agg(['min', 'max'])
+    step = pd.Timedelta(1, unit=freq)
+    counts = ((span['max'] - span['min']) // step).to_numpy(dtype=np.int64) + 1
+    starts = np.repeat(span['min'].to_numpy(), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    grid = pd.DataFrame({
+        'ORIGIN': np.repeat(span.index.to_numpy(), counts),
+        'hour': starts + offsets * step.to_timedelta64()
+    })
+    if isinstance(observed['ORIGIN'].dtype, pd.CategoricalDtype):
+        grid['ORIGIN'] = grid['ORIGIN'].astype(observed['ORIGIN'].dtype)
+    grid['hour'] = grid['hour'].astype(observed['hour'].dtype)
+    station_weather = grid.merge(observed, on=['ORIGIN', 'hour'], how='left')
+
+    station_weather = fill_weather_columns(station_weather, times=station_weather['hour'])
+    print(f"Station weather series: {len(station_weather)} (ORIGIN, hour) rows for "
+          f"{len(span)} stations, built from {len(df)} flight rows")
+    return station_weather
+
+
+def attach_station_weather(df, station_weather, tolerance=pd.Timedelta(hours=3), times=None):
+    """
+    Replace the weather columns of each flight with the nearest station observation
+    for its ORIGIN within `tolerance`, using a sorted as-of join.
+    Flights without an observation in range get NaN weather. Row order and index are kept.
+    """
+    if times is None:
+        times = weather_datetime(df)
+    weather_cols = [col for col in station_weather.columns if col not in ('ORIGIN', 'hour')]
+    flights = df.drop(columns=[col for col in weather_cols if col in df.columns])
+    flights = flights.assign(_weather_time=times, _row=np.arange(len(df)))
+    flights = flights.sort_values('_weather_time', kind='stable')
+    stations = station_weather.rename(columns={'hour': '_weather_time'}).sort_values('_weather_time', kind='stable')
+    stations['_weather_time'] = stations['_weather_time'].astype(flights['_weather_time'].dtype)
+
+    merged = pd.merge_asof(
+        flights, stations,
+        on='_weather_time', by='ORIGIN',
+        direction='nearest', tolerance=pd.Timedelta(tolerance)
+    )
+    merged = merged.sort_values('_row').drop(columns=['_weather_time', '_row'])
+    merged.index = df.index
+    return merged[list(df.columns)]
+
+
+def interpolate_weather_from_stations(df, station_weather=None, tolerance=pd.Timedelta(hours=3), times=None):
+    """
+    Fill flight weather from the hourly station series instead of interpolating per flight row.
+    Builds the station series when it is not given. Like interpolate_all_weather_columns,
+    rows are renumbered from 0 and rows left without weather are dropped.
+    `times` (the flight datetimes, if already computed) is shared by both steps.
+    """
+    weather_cols = WEATHER_NUMERIC_COLUMNS + ['ACTIVE_WEATHER']
+    print(f'Amount of NaN values before station join: {df[weather_cols].isna().sum()}')
+    if times is None:
+        times = weather_datetime(df)
+    if station_weather is None:
+        station_weather = build_station_weather(df, times=times)
+
+    df = attach_station_weather(df, station_weather, tolerance=tolerance, times=times)
+    df = df.reset_index(drop=True)
+    print(f'Amount of NaN values after station join: {df[weather_cols].isna().sum()}')
+    df.dropna(subset=weather_cols, inplace=True)
+    return df
+
+
 def remove_duplicates(df, subset=None):
     """
     Remove duplicate rows from DataFrame based on a subset of columns.
@@ -63,28 +311,126 @@ def remove_duplicates(df, subset=None):
     return df
     
 
-def clean_flights_csv_data(df):
-    """Clean the entire flights CSV before table creation"""
-    initial_count = len(df)
-    
-    # Remove invalid delays
-    df = df[(df['DEP_DELAY'] >= -60)]
-    new_count = len(df)
-    print(f"Flights CSV: Removed {initial_count - len(df)} invalid rows after delay cleaning")
+# Cleaning rules, applied in order. Each rule keeps the rows that satisfy it:
+#   min / max          keep values inside the bounds (missing values are rejected)
+#   exclude            reject these values, compared case-insensitively (missing values are rejected)
+#   reject_when_above  reject rows where every listed column is above its threshold
+# Rules can also be loaded from a JSON file with the same structure (see load_cleaning_rules).
+CLEANING_RULES = [
+    # Remove delay entries that are more than an hour before the scheduled flight
+    {'name': 'delay', 'column': 'DEP_DELAY', 'min': -60},
     # Remove cancelled flights with no valid DEP_HOUR
-    df = df[~((df['DEP_HOUR'] > 0) & (df['CANCELLED'] > 0))]
-    print(f"Flights CSV: Removed {new_count - len(df)} invalid rows after cancellation cleaning")
-    new_count = len(df)
+    {'name': 'cancellation', 'reject_when_above': {'DEP_HOUR': 0, 'CANCELLED': 0}},
     # Remove invalid temperature values (e.g. unrealistic temperatures -> temps are in celsius also see for hottest day in 2022 (53 Celsius) https://en.wikipedia.org/wiki/2022_North_American_heat_waves#:~:text=On%20September%201%2C%20Death%20Valley,of%20North%20America%20at%20large.)
-    df = df[(df['TEMPERATURE'] <= 60) & (df['TEMPERATURE'] >= -40)]
-    print(f"Flights CSV: Removed {new_count - len(df)} invalid rows after temperature cleaning")
-    new_count = len(df)
+    {'name': 'temperature', 'column': 'TEMPERATURE', 'min': -40, 'max': 60},
     # Remove invalid wind speed values (e.g. unrealistic wind speeds -> see Wind_Speed_Outliers in Data/Charts also see https://www.skyscanner.com/tips-and-inspiration/what-windspeed-delays-flights#:~:text=With%20this%20in%20mind%2C%20horizontal,affect%20take%2Doff%20and%20landing.)
-    df = df[(df['WIND_SPD'] <= 35) & (df['WIND_SPD'] >= 0)]
-    print(f"Flights CSV: Removed {new_count - len(df)} invalid rows after wind speed cleaning")
-    new_count = len(df)
+    {'name': 'wind speed', 'column': 'WIND_SPD', 'min': 0, 'max': 35},
     # Remove entries where aircraft manufacturer is unknown or missing
-    df = df[(df['MANUFACTURER'].notna()) & (df['MANUFACTURER'].str.lower() != 'unknown')]
-    print(f"Flights CSV: Removed {new_count - len(df)} invalid rows after manufacturer cleaning")
+    {'name': 'manufacturer', 'column': 'MANUFACTURER', 'exclude': ['unknown']}
+]
 
-    return df
+
+def load_cleaning_rules(path):
+    """Load a cleaning rule list from a JSON file (same structure as CLEANING_RULES)"""
+    with open(path) as f:
+        rules = json.load(f)
+    for rule in rules:
+        if 'name' not in rule:
+            raise ValueError(f"Cleaning rule without a name: {rule}")
+    return rules
+
+
+def _float_values(series):
+    return series.to_numpy(dtype='float64', na_value=np.nan)
+
+
+def _excluded_values_mask(series, excluded):
+    """True where the value is missing or matches one of `excluded` (case-insensitive)"""
+    excluded = [str(value).lower() for value in excluded]
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Lower-case the categories once instead of every row
+        codes = series.cat.codes.to_numpy()
+        bad_categories = series.cat.categories.astype(str).str.lower().isin(excluded)
+        return (codes < 0) | np.asarray(bad_categories)[codes]
+    return (series.isna() | series.astype(str).str.lower().isin(excluded)).to_numpy(dtype=bool)
+
+
+def cleaning_rule_mask(df, rule):
+    """Boolean numpy mask of the rows of `df` kept by a single cleaning rule"""
+    keep = np.ones(len(df), dtype=bool)
+    if 'min' in rule or 'max' in rule:
+        values = _float_values(df[rule['column']])
+        # Comparisons with NaN are False, so missing values are rejected
+        if 'min' in rule:
+            keep &= values >= rule['min']
+        if 'max' in rule:
+            keep &= values <= rule['max']
+    if 'exclude' in rule:
+        keep &= ~_excluded_values_mask(df[rule['column']], rule['exclude'])
+    if 'reject_when_above' in rule:
+        reject = np.ones(len(df), dtype=bool)
+        for column, threshold in rule['reject_when_above'].items():
+            reject &= _float_values(df[column]) > threshold
+        keep &= ~reject
+    return keep
+
+
+def evaluate_cleaning_rules(df, rules=None):
+    """
+    Evaluate the cleaning rules into one combined keep mask.
+    Rules are counted in order, so each count is the number of rows the rule removes
+    from the rows that passed the rules before it (the same numbers as filtering one
+    rule after another). Returns the keep mask, the counts per rule name and, per row,
+    the index of the first rule that rejected it (-1 for kept rows).
+    """
+    rules = CLEANING_RULES if rules is None else rules
+    keep = np.ones(len(df), dtype=bool)
+    first_rejection = np.full(len(df), -1, dtype=np.int16)
+    counts = {}
+    for position, rule in enumerate(rules):
+        rejected = keep & ~cleaning_rule_mask(df, rule)
+        counts[rule['name']] = int(rejected.sum())
+        first_rejection[rejected] = position
+        keep &= ~rejected
+    return keep, counts, first_rejection
+
+
+def cleaning_rule_columns(rules=None):
+    """Columns read by the cleaning rules"""
+    rules = CLEANING_RULES if rules is None else rules
+    columns = []
+    for rule in rules:
+        for col in [rule.get('column')] + list(rule.get('reject_when_above', {})):
+            if col is not None and col not in columns:
+                columns.append(col)
+    return columns
+
+
+def write_quarantine(df, reasons, path):
+    """Write rejected rows with their rejection reason to a CSV file"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    df.assign(REJECT_REASON=reasons).to_csv(path, index=False)
+    print(f"Flights CSV: Quarantined {len(df)} rejected rows to {path}")
+
+
+def clean_flights_csv_data(df, rules=None, quarantine_path=None):
+    """
+    Clean the entire flights CSV before table creation.
+    All rules are evaluated into one mask and the frame is filtered once.
+    With a quarantine_path the rejected rows are written there with the rule that rejected them.
+    """
+    rules = CLEANING_RULES if rules is None else rules
+    keep, counts, first_rejection = evaluate_cleaning_rules(df, rules)
+    return apply_cleaning_result(df, rules, keep, counts, first_rejection, quarantine_path)
+
+
+def apply_cleaning_result(df, rules, keep, counts, first_rejection, quarantine_path=None):
+    """Log the per-rule counts of an evaluated rule list, quarantine the rejected rows and filter once"""
+    for name, count in counts.items():
+        print(f"Flights CSV: Removed {count} invalid rows after {name} cleaning")
+
+    if quarantine_path is not None:
+        names = np.array([rule['name'] for rule in rules], dtype=object)
+        write_quarantine(df[~keep], names[first_rejection[~keep]], quarantine_path)
+
+    return df[keep]
@@ -0,0 +1,214 @@
+"""
+Warehouse backends the star schema is written to.
+
+A writer saves a dict of star tables (write) and reads back what an incremental load needs
+(read_state). PostgresWriter uses save_to_postgresql; SQLiteWriter writes an embedded
+database file, for local development and CI without a database server.
+"""
+import os
+import sqlite3
+import time
+
+import pandas as pd
+
+from etl.load import (DIMENSION_KEYS, POSTGRES_CONFIG, create_warehouse_engine,
+                      read_warehouse_state, save_to_postgresql,
+                      save_to_postgresql_pipelined)
+from etl.physical_design import FOREIGN_KEYS, INDEXES, PRIMARY_KEYS
+from utils.instrumentation import stage
+
+SQLITE_BATCH_SIZE = 100_000
+
+# Pragmas for the bulk load: WAL journal, no fsync while loading, 512 MB page cache, in-memory temp b-trees
+SQLITE_LOAD_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'OFF',
+    'cache_size': -512 * 1024,
+    'temp_store': 'MEMORY'
+}
+
+
+class WarehouseWriter:
+    """Interface of a warehouse backend"""
+    name = None
+
+    def write(self, star_schema, if_exists='replace'):
+        """Save the star tables (names without the '_star' suffix); if_exists is 'replace' or 'append'"""
+        raise NotImplementedError
+
+    def write_pipelined(self, dimensions, fact_chunks, partition_dates=None, if_exists='replace'):
+        """
+        Save the dimension tables and the fact table from an iterator of chunks.
+        Backends without concurrent writes collect the chunks and save everything at once.
+        """
+        return self.write({'fact_flights': pd.concat(list(fact_chunks), ignore_index=True), **dimensions},
+                          if_exists=if_exists)
+
+    def read_state(self, cube_names=()):
+        """
+        The dimension tables, the summary tables in `cube_names`, the loaded FL_DATE partitions
+        and the highest flight_id, or None if the warehouse has no fact table yet.
+        """
+        raise NotImplementedError
+
+
+class PostgresWriter(WarehouseWriter):
+    """PostgreSQL warehouse, loaded with COPY by save_to_postgresql"""
+    name = 'postgresql'
+
+    def __init__(self, config=None, **options):
+        self.config = POSTGRES_CONFIG if config is None else config
+        self.options = options
+
+    def write(self, star_schema, if_exists='replace'):
+        return save_to_postgresql(star_schema, **self.config, if_exists=if_exists, **self.options)
+
+    def write_pipelined(self, dimensions, fact_chunks, partition_dates=None, if_exists='replace'):
+        return save_to_postgresql_pipelined(dimensions, fact_chunks, **self.config, partition_dates=partition_dates,
+                                            if_exists=if_exists, **self.options)
+
+    def read_state(self, cube_names=()):
+        engine = create_warehouse_engine(**self.config)
+        try:
+            return read_warehouse_state(engine, cube_names)
+        finally:
+            engine.dispose()
+
+
+def sqlite_type(dtype):
+    """Declared SQLite column type for a pandas dtype (TIMESTAMP columns are read back as datetimes)"""
+    if isinstance(dtype, pd.CategoricalDtype):
+        return sqlite_type(dtype.categories.dtype)
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return 'INTEGER'
+    if pd.api.types.is_float_dtype(dtype):
+        return 'REAL'
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return 'TIMESTAMP'
+    return 'TEXT'
+
+
+def _sqlite_values(column):
+    """A column as Python values sqlite3 can bind: None for missing values, ISO text for datetimes"""
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        column = column.astype(column.cat.categories.dtype)
+    if pd.api.types.is_datetime64_any_dtype(column.dtype):
+        column = column.dt.strftime('%Y-%m-%d %H:%M:%S')
+    # object arrays hold Python ints/floats/strs, which sqlite3 binds without adapters
+    return column.astype(object).where(column.notna(), None).to_numpy()
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class SQLiteWriter(WarehouseWriter):
+    """
+    Embedded SQLite warehouse in one file.
+    Each write is a single transaction of batched executemany inserts under SQLITE_LOAD_PRAGMAS;
+    the primary-key (unique) and foreign-key column indexes are created after the rows are in,
+    then ANALYZE. SQLite cannot add constraints to existing tables, so keys are indexes only.
+    """
+    name = 'sqlite'
+
+    def __init__(self, path="flight_warehouse.db", batch_size=SQLITE_BATCH_SIZE, suffix='_star'):
+        self.path = path
+        self.batch_size = batch_size
+        self.suffix = suffix
+
+    def _connect(self, pragmas=None):
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        for pragma, value in (pragmas or {}).items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        return conn
+
+    def _insert(self, conn, table_name, df, if_exists):
+        if if_exists == 'replace':
+            conn.execute(f"DROP TABLE IF EXISTS {_quote(table_name)}")
+        elif if_exists != 'append':
+            raise ValueError(f"Unsupported if_exists for SQLite: {if_exists}")
+        columns = ', '.join(f"{_quote(col)} {sqlite_type(dtype)}" for col, dtype in df.dtypes.items())
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {_quote(table_name)} ({columns})")
+
+        statement = (f"INSERT INTO {_quote(table_name)} ({', '.join(_quote(col) for col in df.columns)}) "
+                     f"VALUES ({', '.join('?' * len(df.columns))})")
+        for start in range(0, len(df), self.batch_size):
+            chunk = df.iloc[start:start + self.batch_size]
+            conn.executemany(statement, zip(*(_sqlite_values(chunk[col]) for col in chunk.columns)))
+
+    def _create_indexes(self, conn, tables):
+        """Unique indexes on the primary keys and indexes on the fact table's key columns"""
+        for table in tables:
+            table_name = table + self.suffix
+            if table in PRIMARY_KEYS:
+                conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {_quote(f'pk_{table_name}')} "
+                             f"ON {_quote(table_name)} ({', '.join(_quote(col) for col in PRIMARY_KEYS[table])})")
+            columns = [column for column, _, _ in FOREIGN_KEYS.get(table, [])] + INDEXES.get(table, [])
+            for column in dict.fromkeys(columns):
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {_quote(f'idx_{table_name}_{column.lower()}')} "
+                             f"ON {_quote(table_name)} ({_quote(column)})")
+            conn.execute(f"ANALYZE {_quote(table_name)}")
+
+    def write(self, star_schema, if_exists='replace'):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = self._connect(SQLITE_LOAD_PRAGMAS)
+        try:
+            conn.execute("BEGIN")
+            for table, df in star_schema.items():
+                with stage(f'save_to_sqlite.insert.{table}', rows_in=len(df)) as record:
+                    start = time.perf_counter()
+                    self._insert(conn, table + self.suffix, df, if_exists)
+                    seconds = time.perf_counter() - start
+                    record['rows_out'] = len(df)
+                print(f"Loaded {table} into SQLite: {len(df)} rows in {seconds:.3f}s "
+                      f"({round(len(df) / seconds) if seconds > 0 else None} rows/sec)")
+            with stage('save_to_sqlite.indexes'):
+                self._create_indexes(conn, list(star_schema))
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        print(f"\nStar schema tables saved to SQLite database {self.path}")
+
+    def _has_table(self, conn, table_name):
+        return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                            (table_name,)).fetchone() is not None
+
+    def read_table(self, conn, table):
+        """Read a star table, with TIMESTAMP columns parsed; None if it does not exist"""
+        table_name = table + self.suffix
+        if not self._has_table(conn, table_name):
+            return None
+        df = pd.read_sql(f"SELECT * FROM {_quote(table_name)}", conn)
+        for _, column, declared_type, *_ in conn.execute(f"PRAGMA table_info({_quote(table_name)})"):
+            if declared_type == 'TIMESTAMP':
+                df[column] = pd.to_datetime(df[column])
+        return df
+
+    def read_state(self, cube_names=()):
+        if not os.path.exists(self.path):
+            return None
+        conn = self._connect()
+        try:
+            if not self._has_table(conn, 'fact_flights' + self.suffix):
+                return None
+            fact = _quote('fact_flights' + self.suffix)
+            loaded = pd.read_sql(f'SELECT DISTINCT "date" FROM {fact}', conn)
+            max_flight_id = conn.execute(f"SELECT MAX(flight_id) FROM {fact}").fetchone()[0]
+            return {
+                'dimensions': {name: self.read_table(conn, name) for name in DIMENSION_KEYS},
+                'cubes': {name: self.read_table(conn, name) for name in cube_names},
+                'loaded_dates': set(pd.to_datetime(loaded['date']).dt.normalize()),
+                'max_flight_id': int(max_flight_id or 0)
+            }
+        finally:
+            conn.close()
+
+
+WRITERS = {
+    'postgresql': PostgresWriter,
+    'sqlite': SQLiteWriter
+}
@@ -1,73 +1,305 @@
 """
 Main entry point for the flight data warehouse ETL process
 """
+import argparse
 import os
 import sys
 
 import pandas as pd
 
+from etl.aggregates import DELAY_CUBE_GRAINS, load_cube_grains
+from etl.cache import read_cache_key, read_cache_metadata
+from etl.checkpoint import CHECKPOINT_DIR, CheckpointStore
 from etl.extract import (extract_airports_data, extract_carriers_data,
                          extract_flights_data)
-from etl.load import transform_to_star_schema
-from etl.transform import (clean_flights_csv_data,
-                           interpolate_all_weather_columns, remove_duplicates)
-from utils.output import plot_flight_data_eda, save_tables
+from etl.key_index import DEDUP_KEY, KEY_INDEX_DIR, KeyIndex, dedup_key_hashes
+from etl.lazy import LazyFlights
+from etl.load import (FACT_CHUNKSIZE, STAR_SCHEMA_INPUT_COLUMNS,
+                      select_incremental_flights, transform_to_star_schema)
+from etl.parallel import (parallel_clean_flights, parallel_interpolate_weather,
+                          parallel_remove_duplicates)
+from etl.sampling import SAMPLE_STRATA, sample_cache_path, stratified_sample
+from etl.schema import flights_schema, report_memory
+from etl.transform import (build_station_weather, clean_flights_csv_data,
+                           interpolate_all_weather_columns,
+                           interpolate_weather_from_stations,
+                           load_cleaning_rules, remove_duplicates)
+from etl.writers import PostgresWriter, SQLiteWriter
+from utils.data_profile import print_profile, profile_frame
+from utils.instrumentation import (record_run_info, run_stage, stage, start_run,
+                                   write_run_report)
+from utils.output import plot_flight_data_eda, save_tables, save_tables_arrow
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-def analyze_null_values(df, dataset_name="Dataset"):
-    """Analyze null values in the dataset for cleaning insights"""
-    print(f"\n{'='*60}")
-    print(f"NULL VALUE ANALYSIS - {dataset_name}")
-    print(f"{'='*60}")
-    
-    total_rows = len(df)
-    print(f"Total rows: {total_rows:,}")
-    
-    # Overall null statistics
-    null_stats = []
-    for col in df.columns:
-        null_count = df[col].isnull().sum()
-        null_percentage = (null_count / total_rows) * 100
-        data_type = str(df[col].dtype)
-        unique_values = df[col].nunique()
-        
-        null_stats.append({
-            'Column': col,
-            'Null_Count': null_count,
-            'Null_Percentage': round(null_percentage, 2),
-            'Data_Type': data_type,
-            'Unique_Values': unique_values,
-            'Non_Null_Count': total_rows - null_count
-        })
-    
-    null_df = pd.DataFrame(null_stats)
-    null_df = null_df.sort_values('Null_Percentage', ascending=False)
-    
-    print("\nNULL VALUE SUMMARY BY COLUMN:")
-    print(null_df.to_string(index=False))
-    
-    
+def analyze_null_values(df, dataset_name="Dataset", approx_distinct=False):
+    """
+    Analyze null values in the dataset for cleaning insights.
+    Null counts and row null patterns come from one pass over the columns; with approx_distinct
+    the distinct counts are HyperLogLog estimates (see utils/data_profile.py).
+    """
+    null_df, summary = profile_frame(df, approx_distinct=approx_distinct)
+    print_profile(null_df, summary, dataset_name)
+    return null_df
 
+
+def parse_args(argv=None):
+    """Parse command line options for the ETL run"""
+    parser = argparse.ArgumentParser(description="Flight data warehouse ETL")
+    parser.add_argument('--flights', default="./Data/CompleteData.csv",
+                        help="Flights CSV file or a directory of monthly CSV shards")
+    parser.add_argument('--streaming', action='store_true',
+                        help="Read only the required columns in bounded-size chunks")
+    parser.add_argument('--chunksize', type=int, default=500_000,
+                        help="Rows per chunk in streaming mode")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Number of shards read in parallel, also by the --lazy scan (default: one per core)")
+    parser.add_argument('--parser-engine', choices=['c', 'pyarrow'], default='c',
+                        help="CSV parser for streaming mode (pyarrow is multi-threaded)")
+    parser.add_argument('--compact-weather', action='store_true',
+                        help="Hold the weather measures as float32 (smaller, but the interpolated values round "
+                             "to a different weather dimension than the default float64)")
+    parser.add_argument('--hash-source', action='store_true',
+                        help="Key the extract cache on a content hash instead of size and mtime")
+    parser.add_argument('--weather-mode', choices=['flight', 'station'], default='flight',
+                        help="Interpolate weather per flight row, or on an hourly (ORIGIN, hour) "
+                             "station series joined back to the flights")
+    parser.add_argument('--weather-tolerance', type=float, default=3.0,
+                        help="Maximum distance in hours for the station weather join")
+    parser.add_argument('--warehouse', choices=['postgresql', 'sqlite'], default='postgresql',
+                        help="Warehouse backend: the PostgreSQL server in etl.load.POSTGRES_CONFIG "
+                             "or an embedded SQLite file")
+    parser.add_argument('--sqlite-path', default="./Data/flight_warehouse.db",
+                        help="Database file of the sqlite warehouse")
+    parser.add_argument('--pipelined', action='store_true',
+                        help="Build the fact table in chunks that are written to the warehouse while the next "
+                             "ones are built (the fact table is then not saved to Data/tables)")
+    parser.add_argument('--fact-chunksize', type=int, default=FACT_CHUNKSIZE,
+                        help="Flights per fact table chunk with --pipelined")
+    parser.add_argument('--key-index', nargs='?', const=KEY_INDEX_DIR, default=None, metavar='DIR',
+                        help="Record the dedup keys of loaded flights in a persistent index, so incremental "
+                             f"loads skip flights already in the warehouse (default directory: {KEY_INDEX_DIR})")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Append only new FL_DATE partitions to the existing warehouse; the other flights are "
+                             "dropped right after the extract, so weather is interpolated from the new ones only")
+    parser.add_argument('--cleaning-rules', default=None,
+                        help="JSON file with the cleaning rules (default: the built-in CLEANING_RULES)")
+    parser.add_argument('--quarantine', default=None,
+                        help="Write the rows rejected by cleaning, with the reason, to this CSV file")
+    parser.add_argument('--transform-workers', type=int, default=None,
+                        help="Run dedup, weather interpolation and cleaning on hash partitions "
+                             "in this many worker processes (default: serial)")
+    parser.add_argument('--cube-grains', default=None,
+                        help="JSON file with the delay cube grains (default: DELAY_CUBE_GRAINS in etl/aggregates.py)")
+    parser.add_argument('--checkpoint-dir', default=CHECKPOINT_DIR,
+                        help="Directory of the stage checkpoints")
+    parser.add_argument('--checkpoint-max-gb', type=float, default=10.0,
+                        help="Least recently used checkpoints are evicted above this size")
+    parser.add_argument('--recompute', nargs='*', default=None, metavar='STAGE',
+                        help="Recompute these stages (all stages if none are named) even if they have a checkpoint")
+    parser.add_argument('--no-checkpoints', action='store_true',
+                        help="Run every stage without reading or writing checkpoints")
+    parser.add_argument('--lazy', action='store_true',
+                        help="Run extract, dedup, weather and cleaning as one optimized plan read straight from "
+                             "the CSV (no extract cache, checkpoints or null analysis); the plan is printed first")
+    parser.add_argument('--sample-rate', type=float, default=None, metavar='RATE',
+                        help="Run on a reproducible sample of at most RATE of the flights, stratified by ORIGIN, "
+                             "carrier and month (every airport, carrier, aircraft and date is kept; the actual "
+                             "rate is in the run report)")
+    parser.add_argument('--sample-seed', type=int, default=0,
+                        help="Seed of --sample-rate; the same seed selects the same flights")
+    parser.add_argument('--approx-distinct', action='store_true',
+                        help="Estimate the distinct counts of the null value analysis with HyperLogLog")
+    parser.add_argument('--output-format', choices=['csv', 'arrow', 'both'], default='csv',
+                        help="Export the star tables to Data/tables as CSV and/or to Data/tables_arrow as typed "
+                             "Arrow IPC files, with fact_flights partitioned by year and month (incremental loads "
+                             "append their rows to the Arrow export and leave the CSV tables as they are)")
+    parser.add_argument('--arrow-compression', choices=['zstd', 'lz4', 'none'], default='zstd',
+                        help="Compression of the Arrow export (none lets readers use the memory-mapped "
+                             "columns without copying)")
+    parser.add_argument('--eda', action='store_true',
+                        help="Save the EDA outlier charts of the extracted flights to Data/Charts (headless)")
+    parser.add_argument('--report', default="./Data/run_report.json",
+                        help="JSON file for the per-stage run report (wall/CPU time, memory, rows)")
+    parser.add_argument('--profile-stage', default=None,
+                        help="Run this stage (e.g. clean_flights_csv_data or create_fact_table.weather_lookup) "
+                             "under cProfile and tracemalloc and write its hotspots to Data/profiles")
+    parser.add_argument('--trace-allocations', action='store_true',
+                        help="Record the peak Python allocations of every stage with tracemalloc (slower)")
+    args = parser.parse_args(argv)
+    if args.lazy and args.eda:
+        parser.error("--eda charts the extracted flights, which --lazy does not materialize")
+    if args.pipelined and args.incremental:
+        parser.error("--pipelined streams a full load; --incremental appends with a single write")
+    return args
+
+
+def record_sample(args, rows_extracted, rows_sampled):
+    """Record the --sample-rate parameters and row counts in the run report; returns them as Arrow metadata"""
+    sample = {
+        'rate': args.sample_rate, 'seed': args.sample_seed, 'strata': SAMPLE_STRATA,
+        'rows_extracted': rows_extracted, 'rows_sampled': rows_sampled,
+        'actual_rate': round(rows_sampled / max(rows_extracted, 1), 6)
+    }
+    record_run_info('sample', sample)
+    return {f"etl.sample_{name}": str(value) for name, value in sample.items()}
+
+
+def flight_airports_of(flights):
+    """The airport codes that appear as ORIGIN or DEST of the flights"""
+    return set(flights['ORIGIN'].unique()) | set(flights['DEST'].unique())
+
+
+def run_lazy_pipeline(args, flights_csv, required_columns_flights, state=None, key_index=None):
+    """
+    The same stages as run_eager_pipeline as one optimized plan read straight from the CSV
+    (see etl/lazy.py), without the extract cache and checkpoints. Returns the same values.
+    """
+    plan = LazyFlights.scan(flights_csv, required_columns_flights, schema=flights_schema(args.compact_weather),
+                            chunksize=args.chunksize, engine=args.parser_engine)
+    if state is not None:
+        plan = plan.filter(select_incremental_flights, DEDUP_KEY, "flights not in the warehouse yet",
+                           state=state, key_index=key_index)
+    if args.sample_rate is not None:
+        plan = plan.sample(args.sample_rate, seed=args.sample_seed)
+    # The airports and the key index come from the flights as selected and sampled, before cleaning
+    plan = plan.tap('flight_airports', flight_airports_of, ['ORIGIN', 'DEST'])
+    if key_index is not None:
+        plan = plan.tap('key_hashes', dedup_key_hashes, DEDUP_KEY)
+    plan = (plan.remove_duplicates(subset=['FL_DATE', 'TAIL_NUM', 'CRS_DEP_TIME'])
+            .interpolate_weather(args.weather_mode, tolerance=pd.Timedelta(hours=args.weather_tolerance))
+            .clean(load_cleaning_rules(args.cleaning_rules) if args.cleaning_rules else None,
+                   quarantine_path=args.quarantine)
+            .select(STAR_SCHEMA_INPUT_COLUMNS))
+    print(plan.explain())
+    filtered_flights_csv, outputs = run_stage('lazy_pipeline', plan.execute,
+                                              max_workers=args.transform_workers, scan_workers=args.workers)
+    sample_metadata = None
+    if args.sample_rate is not None:
+        sample_metadata = record_sample(args, outputs['rows_scanned'], outputs['rows_sampled'])
+    report_memory(filtered_flights_csv, "clean")
+    return (filtered_flights_csv, outputs.get('station_weather'), outputs['flight_airports'], sample_metadata,
+            outputs.get('key_hashes'))
+
+
+def run_eager_pipeline(args, flights_csv, filtered_cache, required_columns_flights, state=None, key_index=None):
+    """
+    Extract, deduplicate, interpolate and clean the flights stage by stage, with checkpoints.
+    With the warehouse `state` of an incremental run, only the flights it does not have yet are
+    kept after the extract.
+    Returns the cleaned flights, the station weather series (station mode), the airports that
+    appear in the extracted flights, the sample metadata of --sample-rate and, with a key index,
+    the dedup key hashes of the flights before cleaning.
+    """
+    # Without an incremental selection in between, the sample is taken by the extract as the flights are read
+    sample_in_extract = args.sample_rate is not None and state is None
+    if sample_in_extract:
+        filtered_cache = sample_cache_path(filtered_cache, args.sample_rate, args.sample_seed)
+    filtered_flights_csv = run_stage(
+        'extract_flights_data', extract_flights_data,
+        flights_csv, filtered_cache, required_columns_flights,
+        streaming=args.streaming, chunksize=args.chunksize,
+        max_workers=args.workers, engine=args.parser_engine,
+        hash_source=args.hash_source, schema=flights_schema(args.compact_weather),
+        sample_rate=args.sample_rate if sample_in_extract else None, sample_seed=args.sample_seed
+    )
+    report_memory(filtered_flights_csv, "extract")
+    # Each stage's output is checkpointed under a key of its input, arguments and code (see etl/checkpoint.py),
+    # so a rerun skips the stages whose key is unchanged
+    checkpoints = CheckpointStore(args.checkpoint_dir, max_bytes=int(args.checkpoint_max_gb * 2 ** 30),
+                                  recompute=args.recompute if args.recompute != [] else True,
+                                  enabled=not args.no_checkpoints)
+    flights = checkpoints.source(filtered_flights_csv, key=read_cache_key(filtered_cache), name='extract_flights_data')
+
+    # Incremental runs go on with the flights the warehouse does not have yet, before any transform
+    if state is not None:
+        filtered_flights_csv = run_stage('select_incremental_flights', select_incremental_flights,
+                                         filtered_flights_csv, state, key_index=key_index)
+        flights = checkpoints.source(filtered_flights_csv, name='select_incremental_flights')
+
+    # Fast iteration: run the rest of the pipeline on a seeded sample stratified by ORIGIN, carrier and month
+    sample_metadata = None
+    if sample_in_extract:
+        rows_extracted = int(read_cache_metadata(filtered_cache)['rows_total'])
+        sample_metadata = record_sample(args, rows_extracted, len(filtered_flights_csv))
+    elif args.sample_rate is not None:
+        rows_extracted = len(filtered_flights_csv)
+        filtered_flights_csv = run_stage('stratified_sample', stratified_sample, filtered_flights_csv,
+                                         rate=args.sample_rate, seed=args.sample_seed)
+        flights = checkpoints.source(filtered_flights_csv, name='stratified_sample')
+        sample_metadata = record_sample(args, rows_extracted, len(filtered_flights_csv))
+
+    # The key index records the flights as selected, before cleaning
+    key_hashes = dedup_key_hashes(filtered_flights_csv) if key_index is not None else None
+
+    #plot_flight_data_eda(filtered_flights_csv)
+    if args.eda:
+        run_stage('plot_flight_data_eda', plot_flight_data_eda, filtered_flights_csv, headless=True)
     
-    # Find rows with all nulls
-    all_null_rows = df.isnull().all(axis=1).sum()
-    print(f"Rows with ALL null values: {all_null_rows:,}")
-    
-    # Find rows with no nulls
-    no_null_rows = df.notnull().all(axis=1).sum()
-    print(f"Rows with NO null values: {no_null_rows:,} ({(no_null_rows/total_rows)*100:.1f}%)")
+    # Airports that appear in the flights data (before cleaning)
+    flight_airports = flight_airports_of(filtered_flights_csv)
     
-    return null_df
+    run_stage('analyze_null_values', analyze_null_values, filtered_flights_csv, "Flights Data",
+              approx_distinct=args.approx_distinct)
+
+    # Remove duplicate entries (check by flight time, tail number for plane and departure time (there cant be multiple entries like this for a single plane))
+    # With --transform-workers the same stages run on partitions in a process pool, with identical output
+    workers = args.transform_workers
+    if workers:
+        flights = checkpoints.run('remove_duplicates', parallel_remove_duplicates, flights,
+                                  subset=['FL_DATE','TAIL_NUM', 'CRS_DEP_TIME'], max_workers=workers)
+    else:
+        flights = checkpoints.run('remove_duplicates', remove_duplicates, flights,
+                                  subset=['FL_DATE','TAIL_NUM', 'CRS_DEP_TIME'])
+    if flights.loaded:
+        report_memory(flights.frame(), "remove_duplicates")
+    #Find the nearest neighbor for ACTIVE_WEATHER in a time window and interpolate based on time for numerical weather columns (drop remaining NaNs (Approx. 3000 rows))
+    station_weather = None
+    if args.weather_mode == 'station':
+        station_weather = checkpoints.run('build_station_weather', build_station_weather, flights)
+        flights = checkpoints.run(
+            'interpolate_weather', interpolate_weather_from_stations,
+            flights, station_weather,
+            tolerance=pd.Timedelta(hours=args.weather_tolerance)
+        )
+    elif workers:
+        flights = checkpoints.run('interpolate_weather', parallel_interpolate_weather, flights,
+                                  max_workers=workers)
+    else:
+        flights = checkpoints.run('interpolate_weather', interpolate_all_weather_columns, flights)
+    if flights.loaded:
+        report_memory(flights.frame(), "interpolate_weather")
+
+    # Whats done in clean flights:
+    # 1. Remove delay entries that are more than an hour before scheduled flight (negative departure delays)
+    # 2. Remove cancelled flights with no valid DEP_HOUR (DEP_HOUR != 0)
+    # 3. Remove invalid temperature values (e.g. unrealistic temperatures, see figure Wind_Speed_Outliers in Data/Charts)
+    # 4. Remove invalid wind speed values (e.g. unrealistic wind speeds -> see Wind_Speed_Outliers in Data/Charts also see https://www.skyscanner.com/tips-and-inspiration/what-windspeed-delays-flights#:~:text=With%20this%20in%20mind%2C%20horizontal,affect%20take%2Doff%20and%20landing.)
+    # 5. Remove rows where aircraft manufacturer is unknown or missing
+    # The rules are listed in CLEANING_RULES (etl/transform.py) or loaded from --cleaning-rules
+    cleaning_rules = load_cleaning_rules(args.cleaning_rules) if args.cleaning_rules else None
+    if workers:
+        flights = checkpoints.run('clean_flights_csv_data', parallel_clean_flights, flights,
+                                  rules=cleaning_rules, quarantine_path=args.quarantine, max_workers=workers)
+    else:
+        flights = checkpoints.run('clean_flights_csv_data', clean_flights_csv_data, flights,
+                                  rules=cleaning_rules, quarantine_path=args.quarantine)
+    filtered_flights_csv = flights.frame()
+    if station_weather is not None:
+        station_weather = station_weather.frame()
+    report_memory(filtered_flights_csv, "clean")
+    return filtered_flights_csv, station_weather, flight_airports, sample_metadata, key_hashes
 
 
-def main():
+def main(argv=None):
     """Main ETL pipeline execution"""
+    args = parse_args(argv)
     print("Starting Flight Data Warehouse ETL Process...")
+    start_run(profile_stage=args.profile_stage, trace_allocations=args.trace_allocations)
     
     # Define data paths
-    flights_csv = "./Data/CompleteData.csv"
-    filtered_csv = "./Data/filtered_flights_2022_01_01_hour_0.csv"
+    flights_csv = args.flights
+    filtered_cache = "./Data/filtered_flights_2022_01_01_hour_0.arrow"
     #us-airports is a more extensive list but stations includes all airports in the flights data
     # If you want to use us-airports, change airports_csv to "./Data/us-airports.csv" and rename the columns accordingly
     airports_csv = "./Data/Stations.csv"
@@ -84,37 +316,61 @@ def main():
         'AIRPORT', 'DISPLAY_AIRPORT_CITY_NAME_FULL', 'AIRPORT_STATE_NAME'
     ]
 
-    filtered_flights_csv = extract_flights_data(flights_csv, filtered_csv, required_columns_flights)
-    filtered_airports_csv = extract_airports_data(airports_csv, required_columns_airports)
-    carriers_data = extract_carriers_data(carriers_csv)
+    writer = SQLiteWriter(args.sqlite_path) if args.warehouse == 'sqlite' else PostgresWriter()
+    key_index = KeyIndex(args.key_index) if args.key_index else None
+    cube_grains = load_cube_grains(args.cube_grains) if args.cube_grains else None
+    # An incremental run into an existing warehouse only transforms the flights it does not have yet
+    cube_names = list(DELAY_CUBE_GRAINS if cube_grains is None else cube_grains)
+    state = None
+    if args.incremental:
+        state = run_stage('read_warehouse_state', writer.read_state, cube_names=cube_names)
 
-    #plot_flight_data_eda(filtered_flights_csv)
-    
-    # Only keep airports that exist in flights data
-    flight_airports = set(filtered_flights_csv['ORIGIN'].unique()) | set(filtered_flights_csv['DEST'].unique())
-    filtered_airports_csv = filtered_airports_csv[filtered_airports_csv['iata_code'].isin(flight_airports)]
-    # Clean city names
-    filtered_airports_csv['city'] = filtered_airports_csv['city'].str.replace(r',\s*[A-Z]{2}$', '', regex=True)
+    if args.lazy:
+        filtered_flights_csv, station_weather, flight_airports, sample_metadata, key_hashes = run_lazy_pipeline(
+            args, flights_csv, required_columns_flights, state, key_index)
+    else:
+        filtered_flights_csv, station_weather, flight_airports, sample_metadata, key_hashes = run_eager_pipeline(
+            args, flights_csv, filtered_cache, required_columns_flights, state, key_index)
 
-    print(f"Filtered airports to {len(filtered_airports_csv)} airports that appear in flights data")
-    
-    analyze_null_values(filtered_flights_csv, "Flights Data")
+    filtered_airports_csv = run_stage('extract_airports_data', extract_airports_data, airports_csv, required_columns_airports)
+    carriers_data = run_stage('extract_carriers_data', extract_carriers_data, carriers_csv)
 
-    # Remove duplicate entries (check by flight time, tail number for plane and departure time (there cant be multiple entries like this for a single plane))
-    filtered_flights_csv = remove_duplicates(filtered_flights_csv, subset=['FL_DATE','TAIL_NUM', 'CRS_DEP_TIME'])
-    #Find the nearest neighbor for ACTIVE_WEATHER in a time window and interpolate based on time for numerical weather columns (drop remaining NaNs (Approx. 3000 rows))
-    filtered_flights_csv = interpolate_all_weather_columns(filtered_flights_csv)
+    # Only keep airports that exist in flights data
+    with stage('filter_airports', rows_in=len(filtered_airports_csv)) as record:
+        filtered_airports_csv = filtered_airports_csv[filtered_airports_csv['iata_code'].isin(flight_airports)]
+        # Clean city names
+        filtered_airports_csv['city'] = filtered_airports_csv['city'].str.replace(r',\s*[A-Z]{2}$', '', regex=True)
+        record['rows_out'] = len(filtered_airports_csv)
 
-    # Whats done in clean flights:
-    # 1. Remove delay entries that are more than an hour before scheduled flight (negative departure delays)
-    # 2. Remove cancelled flights with no valid DEP_HOUR (DEP_HOUR != 0)
-    # 3. Remove invalid temperature values (e.g. unrealistic temperatures, see figure Wind_Speed_Outliers in Data/Charts)
-    # 4. Remove invalid wind speed values (e.g. unrealistic wind speeds -> see Wind_Speed_Outliers in Data/Charts also see https://www.skyscanner.com/tips-and-inspiration/what-windspeed-delays-flights#:~:text=With%20this%20in%20mind%2C%20horizontal,affect%20take%2Doff%20and%20landing.)
-    # 5. Remove rows where aircraft manufacturer is unknown or missing
-    filtered_flights_csv = clean_flights_csv_data(filtered_flights_csv)
+    print(f"Filtered airports to {len(filtered_airports_csv)} airports that appear in flights data")
 
-    finalSchema = transform_to_star_schema(filtered_flights_csv, filtered_airports_csv, carriers_data)
-    save_tables(finalSchema, suffix="_star")
+    finalSchema = run_stage('transform_to_star_schema', transform_to_star_schema,
+                            filtered_flights_csv, filtered_airports_csv, carriers_data,
+                            writer=writer,
+                            station_weather=station_weather,
+                            incremental=args.incremental,
+                            pipelined=args.pipelined,
+                            fact_chunksize=args.fact_chunksize,
+                            key_index=key_index,
+                            key_hashes=key_hashes,
+                            already_selected=state is not None,
+                            cube_grains=cube_grains,
+                            state=state)
+    if 'fact_flights' in finalSchema:
+        report_memory(finalSchema['fact_flights'], "star_schema (fact_flights)")
+    # An incremental load returns the rows it appended (and the whole updated cubes)
+    appended = [] if state is None else [name for name in finalSchema if name not in cube_names]
+    if args.output_format in ('csv', 'both'):
+        if appended:
+            print("Incremental load: the CSV tables are not exported (the appended rows are in the warehouse "
+                  "and the Arrow export)")
+        else:
+            run_stage('save_tables', save_tables, finalSchema, suffix="_star")
+    if args.output_format in ('arrow', 'both'):
+        run_stage('save_tables_arrow', save_tables_arrow, finalSchema, suffix="_star",
+                  compression=None if args.arrow_compression == 'none' else args.arrow_compression,
+                  metadata=sample_metadata, append=appended)
+    write_run_report(args.report)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
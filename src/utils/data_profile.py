@@ -0,0 +1,238 @@
+"""
+Null and distinct-count profile of the flights data, built from chunks.
+
+Every column is read once per chunk: its null mask feeds the per-column null counts and a
+per-row null pattern (one bit per column), and its non-null values feed the distinct count.
+Distinct counts are exact (the distinct values are kept, so memory grows with the
+cardinality, not the row count) or HyperLogLog estimates with a relative standard error of
+1.04 / sqrt(2 ** precision), about 0.8% at the default precision of 14 (16 KB per column).
+
+Profile a CSV source without loading it whole, from the src directory:
+    python -m utils.data_profile ./Data/CompleteData.csv --approx
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+HLL_PRECISION = 14
+
+
+def hll_error(precision=HLL_PRECISION):
+    """Relative standard error of a HyperLogLog estimate with 2 ** precision registers"""
+    return 1.04 / np.sqrt(2 ** precision)
+
+
+def hll_registers(hashes, precision=HLL_PRECISION):
+    """HyperLogLog registers for an array of uint64 hashes"""
+    if not 4 <= precision <= 18:
+        raise ValueError(f"HyperLogLog precision must be between 4 and 18, got {precision}")
+    registers = np.zeros(2 ** precision, dtype=np.uint8)
+    if len(hashes) == 0:
+        return registers
+    # The bits below the bucket bits, at most 52 of them so they convert to float64 exactly
+    rest_bits = min(64 - precision, 52)
+    bucket = (hashes >> np.uint64(64 - precision)).astype(np.intp)
+    rest = (hashes >> np.uint64(64 - precision - rest_bits)) & np.uint64((1 << rest_bits) - 1)
+    # frexp's exponent is the bit length; the rank is the position of the first 1-bit
+    _, bit_length = np.frexp(rest.astype(np.float64))
+    rank = (rest_bits + 1 - bit_length).astype(np.uint8)
+    np.maximum.at(registers, bucket, rank)
+    return registers
+
+
+def hll_estimate(registers):
+    """Distinct count estimate from HyperLogLog registers (with the small-range correction)"""
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.ldexp(1.0, -registers.astype(np.int32)))
+    zeros = np.count_nonzero(registers == 0)
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * np.log(m / zeros)
+    return int(round(estimate))
+
+
+def _mix64(bits):
+    """splitmix64 finalizer: spreads uint64 values over all 64 bits"""
+    with np.errstate(over='ignore'):
+        bits = bits + np.uint64(0x9E3779B97F4A7C15)
+        bits = (bits ^ (bits >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        bits = (bits ^ (bits >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return bits ^ (bits >> np.uint64(31))
+
+
+def _value_hashes(values):
+    """
+    64-bit hashes of non-null values; equal values hash equally in every chunk.
+    Numbers and datetimes are hashed from their bits, other values with hash_pandas_object.
+    """
+    dtype = values.dtype
+    if pd.api.types.is_float_dtype(dtype):
+        # + 0.0 turns -0.0 into 0.0, which counts as the same value
+        bits = (values.to_numpy(dtype=np.float64) + 0.0).view(np.uint64)
+    elif pd.api.types.is_integer_dtype(dtype) or pd.api.types.is_bool_dtype(dtype):
+        bits = values.to_numpy(dtype=np.int64).view(np.uint64)
+    elif pd.api.types.is_datetime64_dtype(dtype):
+        bits = values.to_numpy().view(np.uint64)
+    else:
+        return pd.util.hash_pandas_object(values, index=False).to_numpy()
+    return _mix64(bits)
+
+
+def _distinct_values(column):
+    """Distinct non-null values of a column chunk, as an array"""
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        # Only the categories that occur, without hashing every row
+        codes = column.cat.codes.to_numpy()
+        used = np.bincount(codes[codes >= 0], minlength=len(column.cat.categories)) > 0
+        return column.cat.categories[used].to_numpy()
+    uniques = pd.Series(column.unique())
+    return uniques[uniques.notna()].array
+
+
+def _merge_distinct(existing, values):
+    if existing is None:
+        return values
+    return pd.concat([pd.Series(existing), pd.Series(values)], ignore_index=True).unique()
+
+
+def new_profile(columns, approx_distinct=False, precision=HLL_PRECISION):
+    """Empty profile state for the given columns (at most 64, one pattern bit each)"""
+    if len(columns) > 64:
+        raise ValueError("Null patterns support at most 64 columns")
+    return {
+        'columns': list(columns),
+        'approx_distinct': approx_distinct,
+        'precision': precision,
+        'rows': 0,
+        'dtypes': {},
+        'null_counts': dict.fromkeys(columns, 0),
+        'distinct': {},
+        'sketches': {},
+        'patterns': {}
+    }
+
+
+def update_profile(profile, chunk):
+    """Add one chunk of rows to a profile"""
+    patterns = np.zeros(len(chunk), dtype=np.uint64)
+    for bit, col in enumerate(profile['columns']):
+        column = chunk[col]
+        profile['dtypes'].setdefault(col, str(column.dtype))
+        isna = column.isna().to_numpy()
+        profile['null_counts'][col] += int(isna.sum())
+        patterns |= isna.astype(np.uint64) << np.uint64(bit)
+
+        distinct = _distinct_values(column)
+        # Categoricals are counted exactly in both modes: their categories bound the memory.
+        # Other columns keep only a sketch of each chunk's distinct values in approximate mode.
+        if profile['approx_distinct'] and not isinstance(column.dtype, pd.CategoricalDtype):
+            registers = hll_registers(_value_hashes(pd.Series(distinct)), profile['precision'])
+            profile['sketches'][col] = np.maximum(profile['sketches'].get(col, registers), registers)
+        else:
+            profile['distinct'][col] = _merge_distinct(profile['distinct'].get(col), distinct)
+
+    for value, count in pd.Series(patterns).value_counts(sort=False).items():
+        profile['patterns'][int(value)] = profile['patterns'].get(int(value), 0) + int(count)
+    profile['rows'] += len(chunk)
+    return profile
+
+
+def finish_profile(profile, top_patterns=10):
+    """
+    Turn a profile state into the per-column summary (one row per column, most nulls first)
+    and the row-level summary: all-null and no-null rows and the most common null patterns.
+    """
+    total_rows = profile['rows']
+    columns = profile['columns']
+    null_stats = []
+    for col in columns:
+        null_count = profile['null_counts'][col]
+        if col in profile['sketches']:
+            unique_values = hll_estimate(profile['sketches'][col])
+        else:
+            unique_values = len(profile['distinct'].get(col, []))
+        null_stats.append({
+            'Column': col,
+            'Null_Count': null_count,
+            'Null_Percentage': round(null_count / total_rows * 100, 2) if total_rows else 0.0,
+            'Data_Type': profile['dtypes'].get(col),
+            'Unique_Values': unique_values,
+            'Non_Null_Count': total_rows - null_count
+        })
+    null_df = pd.DataFrame(null_stats).sort_values('Null_Percentage', ascending=False)
+
+    all_null = (1 << len(columns)) - 1
+    patterns = sorted(profile['patterns'].items(), key=lambda item: item[1], reverse=True)
+    summary = {
+        'total_rows': total_rows,
+        'all_null_rows': profile['patterns'].get(all_null, 0) if columns else 0,
+        'no_null_rows': profile['patterns'].get(0, 0),
+        'null_patterns': [
+            {'null_columns': [col for bit, col in enumerate(columns) if value >> bit & 1], 'rows': count}
+            for value, count in patterns[:top_patterns]
+        ],
+        'approx_columns': list(profile['sketches']),
+        'distinct_error': hll_error(profile['precision']) if profile['sketches'] else 0.0
+    }
+    return null_df, summary
+
+
+def profile_chunks(chunks, columns=None, approx_distinct=False, precision=HLL_PRECISION):
+    """Profile an iterable of DataFrame chunks (e.g. from iter_flights_chunks) in one pass"""
+    profile = None
+    for chunk in chunks:
+        if profile is None:
+            profile = new_profile(columns or list(chunk.columns), approx_distinct, precision)
+        update_profile(profile, chunk)
+    if profile is None:
+        profile = new_profile(columns or [], approx_distinct, precision)
+    return finish_profile(profile)
+
+
+def profile_frame(df, approx_distinct=False, precision=HLL_PRECISION):
+    """Profile a whole DataFrame in one pass"""
+    return profile_chunks([df], list(df.columns), approx_distinct, precision)
+
+
+def print_profile(null_df, summary, dataset_name="Dataset"):
+    """Print a profile in the layout of the NULL VALUE ANALYSIS report"""
+    total_rows = summary['total_rows']
+    print(f"\n{'='*60}")
+    print(f"NULL VALUE ANALYSIS - {dataset_name}")
+    print(f"{'='*60}")
+    print(f"Total rows: {total_rows:,}")
+
+    print("\nNULL VALUE SUMMARY BY COLUMN:")
+    print(null_df.to_string(index=False))
+    if summary['distinct_error']:
+        print(f"Unique_Values of {', '.join(summary['approx_columns'])} are HyperLogLog estimates "
+              f"(relative standard error {summary['distinct_error']:.2%})")
+
+    print(f"Rows with ALL null values: {summary['all_null_rows']:,}")
+    no_null_percentage = (summary['no_null_rows'] / total_rows) * 100 if total_rows else 0.0
+    print(f"Rows with NO null values: {summary['no_null_rows']:,} ({no_null_percentage:.1f}%)")
+
+
+def main(argv=None):
+    from etl.extract import DEFAULT_CHUNKSIZE, iter_flights_chunks
+    from etl.schema import FLIGHTS_SCHEMA
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('flights', help="Flights CSV file or a directory of CSV shards")
+    parser.add_argument('--approx', action='store_true', help="HyperLogLog distinct counts")
+    parser.add_argument('--precision', type=int, default=HLL_PRECISION)
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE)
+    args = parser.parse_args(argv)
+
+    columns = list(FLIGHTS_SCHEMA)
+    chunks = iter_flights_chunks(args.flights, columns, chunksize=args.chunksize)
+    null_df, summary = profile_chunks(chunks, columns, args.approx, args.precision)
+    print_profile(null_df, summary, args.flights)
+    print("\nMost common null patterns:")
+    for pattern in summary['null_patterns']:
+        print(f"  {pattern['rows']:>12,}  {', '.join(pattern['null_columns']) or '(no nulls)'}")
+
+
+if __name__ == "__main__":
+    main()
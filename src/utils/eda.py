@@ -0,0 +1,241 @@
+"""
+Headless EDA charts of the flights data from fixed-bin histograms.
+
+Every column is summarized by counts over fixed bins (plus under- and overflow bins and the
+exact minimum, maximum, count, sum and sum of squares), built in one vectorized pass per chunk.
+The histograms of chunks add up, so the data can be streamed, and everything drawn afterwards
+(histograms, a KDE smoothed over the bins, box plots from histogram quantiles, outlier counts)
+costs the same for any number of rows. Quantiles are exact to within one bin width as long as
+they fall inside the binned range. Charts are drawn on Agg figures and saved as PNGs, so no
+display is needed.
+
+Rebuild the charts from a CSV source without loading it whole, from the src directory:
+    python -m utils.eda ./Data/CompleteData.csv
+"""
+import argparse
+import os
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+CHARTS_DIR = "./Data/Charts"
+
+# Binned range and bin width per column. Widths are multiples of the data's resolution
+# (whole minutes, tenths of degrees and knots), so every bin covers the same number of possible values.
+EDA_BINS = {
+    'DEP_DELAY': (-120.0, 1800.0, 1.0),
+    'TEMPERATURE': (-80.0, 80.0, 0.5),
+    'WIND_SPD': (0.0, 100.0, 0.5)
+}
+
+
+def new_histogram(column):
+    low, high, width = EDA_BINS[column]
+    bins = int(round((high - low) / width))
+    return {
+        'low': low, 'width': width,
+        'counts': np.zeros(bins + 2, dtype=np.int64),  # [underflow, bins..., overflow]
+        'n': 0, 'missing': 0, 'sum': 0.0, 'sumsq': 0.0, 'min': np.inf, 'max': -np.inf
+    }
+
+
+def update_histogram(hist, values):
+    """Add an array of values (NaN for missing) to a histogram"""
+    values = np.asarray(values, dtype=np.float64)
+    present = values[~np.isnan(values)]
+    hist['missing'] += len(values) - len(present)
+    if not len(present):
+        return hist
+    bins = len(hist['counts']) - 2
+    positions = np.floor((present - hist['low']) / hist['width'])
+    positions = np.clip(positions, -1, bins).astype(np.intp) + 1
+    hist['counts'] += np.bincount(positions, minlength=bins + 2)
+    hist['n'] += len(present)
+    hist['sum'] += float(present.sum())
+    hist['sumsq'] += float(np.square(present).sum())
+    hist['min'] = min(hist['min'], float(present.min()))
+    hist['max'] = max(hist['max'], float(present.max()))
+    return hist
+
+
+def bin_edges(hist):
+    return hist['low'] + hist['width'] * np.arange(len(hist['counts']) - 1)
+
+
+def histogram_quantiles(hist, quantiles):
+    """
+    Quantiles interpolated inside their bin (error at most one bin width inside the binned
+    range; quantiles in the under- or overflow bin are clamped to the exact min or max)
+    """
+    counts = hist['counts']
+    cumulative = np.cumsum(counts)
+    edges = bin_edges(hist)
+    results = []
+    for q in np.atleast_1d(quantiles):
+        rank = q * hist['n']
+        position = int(np.searchsorted(cumulative, rank, side='left'))
+        if position == 0:
+            results.append(hist['min'])
+        elif position == len(counts) - 1:
+            results.append(hist['max'])
+        else:
+            before = cumulative[position - 1]
+            fraction = (rank - before) / counts[position] if counts[position] else 0.0
+            results.append(float(edges[position - 1] + fraction * hist['width']))
+    return np.clip(results, hist['min'], hist['max'])
+
+
+def count_outside(hist, low, high):
+    """Values below `low` or above `high`, counted at bin resolution"""
+    edges = bin_edges(hist)
+    counts = hist['counts']
+    below = counts[0] + counts[1:-1][edges[1:] <= low].sum()
+    above = counts[-1] + counts[1:-1][edges[:-1] >= high].sum()
+    return int(below + above)
+
+
+def box_stats(hist, label):
+    """Box plot statistics for Axes.bxp: quartiles, 1.5 IQR whiskers and the outlier count"""
+    q1, median, q3 = histogram_quantiles(hist, [0.25, 0.5, 0.75])
+    iqr = q3 - q1
+    low_fence, high_fence = q1 - 1.5 * iqr, q3 + 1.5 * iqr
+    edges = bin_edges(hist)
+    occupied = np.flatnonzero(hist['counts'][1:-1])
+    inside = occupied[(edges[occupied] >= low_fence) & (edges[occupied] + hist['width'] <= high_fence)]
+    whislo = max(edges[inside[0]], hist['min']) if len(inside) else q1
+    whishi = min(edges[inside[-1]] + hist['width'], hist['max']) if len(inside) else q3
+    return {
+        'label': label, 'q1': q1, 'med': median, 'q3': q3,
+        'whislo': min(whislo, q1), 'whishi': max(whishi, q3), 'fliers': [],
+        'outliers': count_outside(hist, low_fence, high_fence), 'min': hist['min'], 'max': hist['max']
+    }
+
+
+def binned_kde(hist):
+    """
+    Gaussian KDE evaluated on the bin centers by smoothing the bin counts (Silverman bandwidth),
+    scaled to counts per bin so it can be drawn over the histogram
+    """
+    n = hist['n']
+    centers = bin_edges(hist)[:-1] + hist['width'] / 2
+    if n < 2:
+        return centers, np.zeros(len(centers))
+    std = np.sqrt(max(hist['sumsq'] / n - (hist['sum'] / n) ** 2, 0.0))
+    q1, q3 = histogram_quantiles(hist, [0.25, 0.75])
+    spread = min(std, (q3 - q1) / 1.34) or std or hist['width']
+    bandwidth = max(0.9 * spread * n ** -0.2, hist['width'])
+    radius = min(int(np.ceil(4 * bandwidth / hist['width'])), (len(centers) - 1) // 2)
+    offsets = np.arange(-radius, radius + 1) * hist['width']
+    kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2)
+    kernel /= kernel.sum()
+    return centers, np.convolve(hist['counts'][1:-1], kernel, mode='same')
+
+
+def new_eda():
+    return {
+        'DEP_DELAY': new_histogram('DEP_DELAY'),
+        'TEMPERATURE': new_histogram('TEMPERATURE'),
+        'WIND_SPD': new_histogram('WIND_SPD'),
+        'DEP_DELAY_BY_CANCELLED': {}
+    }
+
+
+def update_eda(eda, chunk):
+    """Add one chunk of flights to the EDA histograms"""
+    for col in ('DEP_DELAY', 'TEMPERATURE', 'WIND_SPD'):
+        update_histogram(eda[col], chunk[col].to_numpy(dtype=np.float64, na_value=np.nan))
+    delay = chunk['DEP_DELAY'].to_numpy(dtype=np.float64, na_value=np.nan)
+    cancelled = chunk['CANCELLED'].to_numpy(dtype=np.float64, na_value=np.nan)
+    for value in np.unique(cancelled[~np.isnan(cancelled)]):
+        groups = eda['DEP_DELAY_BY_CANCELLED']
+        hist = groups.setdefault(int(value), new_histogram('DEP_DELAY'))
+        update_histogram(hist, delay[cancelled == value])
+    return eda
+
+
+def eda_from_chunks(chunks):
+    eda = new_eda()
+    for chunk in chunks:
+        update_eda(eda, chunk)
+    return eda
+
+
+def _plot_histogram(ax, hist, title, xlabel, color):
+    edges = bin_edges(hist)
+    ax.stairs(hist['counts'][1:-1], edges, fill=True, color=color, alpha=0.5)
+    centers, density = binned_kde(hist)
+    ax.plot(centers, density, color=color)
+    occupied = np.flatnonzero(hist['counts'][1:-1])
+    if len(occupied):
+        ax.set_xlim(edges[occupied[0]], edges[occupied[-1] + 1])
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel('Count')
+
+
+def _save(fig, path):
+    FigureCanvasAgg(fig)
+    fig.tight_layout()
+    fig.savefig(path)
+    print(f"Saved chart to: {path}")
+
+
+def write_eda_charts(eda, output_dir=CHARTS_DIR):
+    """Render the EDA charts to PNG files; returns the box plot statistics per chart"""
+    os.makedirs(output_dir, exist_ok=True)
+
+    fig = Figure(figsize=(12, 5))
+    _plot_histogram(fig.add_subplot(1, 2, 1), eda['DEP_DELAY'], 'Departure Delay Distribution',
+                    'Departure Delay (minutes)', 'tab:blue')
+    _plot_histogram(fig.add_subplot(1, 2, 2), eda['TEMPERATURE'], 'Temperature Distribution (°C)',
+                    'Temperature (°C)', 'orange')
+    _save(fig, os.path.join(output_dir, 'Dep_Delay+Temp.png'))
+
+    groups = eda['DEP_DELAY_BY_CANCELLED']
+    by_cancellation = [box_stats(groups[value], str(value)) for value in sorted(groups) if groups[value]['n']]
+    fig = Figure(figsize=(7, 5))
+    ax = fig.add_subplot()
+    if by_cancellation:
+        ax.bxp(by_cancellation, showfliers=False)
+        for position, stats in enumerate(by_cancellation, start=1):
+            ax.annotate(f"{stats['outliers']:,} outliers", (position, stats['whishi']),
+                        textcoords='offset points', xytext=(0, 5), ha='center', fontsize=8)
+    ax.set_title('Departure Delay by Cancellation Status')
+    ax.set_xlabel('Cancelled')
+    ax.set_ylabel('Departure Delay (minutes)')
+    _save(fig, os.path.join(output_dir, 'Dep_Delay_By_Cancellation.png'))
+
+    wind = box_stats(eda['WIND_SPD'], 'WIND_SPD') if eda['WIND_SPD']['n'] else None
+    fig = Figure(figsize=(7, 5))
+    ax = fig.add_subplot()
+    if wind is not None:
+        ax.bxp([wind], vert=False, showfliers=False)
+        # The extremes stand in for the individual outliers, which are not kept
+        extremes = [value for value in (wind['min'], wind['max']) if not wind['whislo'] <= value <= wind['whishi']]
+        ax.plot(extremes, [1] * len(extremes), 'o', markerfacecolor='none', color='black')
+        ax.set_title(f"Wind Speed Outliers ({wind['outliers']:,} beyond the whiskers, max {wind['max']:g})")
+    else:
+        ax.set_title('Wind Speed Outliers')
+    ax.set_xlabel('Wind Speed (knots)')
+    _save(fig, os.path.join(output_dir, 'Wind_Speed_Outliers.png'))
+
+    return {'Dep_Delay_By_Cancellation': by_cancellation, 'Wind_Speed_Outliers': wind}
+
+
+def main(argv=None):
+    from etl.extract import DEFAULT_CHUNKSIZE, iter_flights_chunks
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('flights', help="Flights CSV file or a directory of CSV shards")
+    parser.add_argument('--output-dir', default=CHARTS_DIR)
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE)
+    args = parser.parse_args(argv)
+
+    columns = ['DEP_DELAY', 'TEMPERATURE', 'WIND_SPD', 'CANCELLED']
+    eda = eda_from_chunks(iter_flights_chunks(args.flights, columns, chunksize=args.chunksize))
+    write_eda_charts(eda, args.output_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import cProfile
+import io
+import json
+import os
+import platform
+import pstats
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import pandas as pd
+
+# The run being recorded, or None when instrumentation is off (stages are then no-ops)
+_active_run = None
+_local = threading.local()
+
+
+def start_run(profile_stage=None, profile_dir="./Data/profiles", trace_allocations=False):
+    """
+    Start recording pipeline stages.
+    profile_stage names one stage to run under cProfile and tracemalloc; its hotspots are
+    written to profile_dir. trace_allocations=True records the peak Python allocations of
+    every stage with tracemalloc (slower, so off by default).
+    """
+    global _active_run
+    _active_run = {
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'argv': sys.argv,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'profile_stage': profile_stage,
+        'profile_dir': profile_dir,
+        'trace_allocations': trace_allocations,
+        'start': time.perf_counter(),
+        'stages': []
+    }
+    if trace_allocations and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return _active_run
+
+
+def _rss_mb():
+    """Current resident set size in MB (Linux), or None where /proc is not available"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        return None
+
+
+def _peak_rss_mb():
+    """Peak resident set size of the process so far in MB (ru_maxrss is KB on Linux, bytes on macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def count_rows(value):
+    """Row count of a DataFrame, or the total over a dict of DataFrames; None for anything else"""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, dict) and value and all(isinstance(v, pd.DataFrame) for v in value.values()):
+        return sum(len(v) for v in value.values())
+    return None
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+@contextmanager
+def stage(name, rows_in=None):
+    """
+    Record one pipeline stage: wall and CPU time, RSS, peak allocations and row counts.
+    Yields the stage record, so the caller can set record['rows_out'] (and other fields).
+    Stages opened inside a stage on the same thread are recorded with it as parent.
+    Does nothing unless start_run() was called.
+    """
+    run = _active_run
+    if run is None:
+        yield {}
+        return
+
+    stack = _stack()
+    record = {
+        'stage': name,
+        'parent': stack[-1]['stage'] if stack else None,
+        'thread': threading.current_thread().name,
+        'rows_in': rows_in,
+        'rows_out': None,
+        'rss_start_mb': _rss_mb()
+    }
+    frame = {'stage': name, 'child_peak': 0}
+    stack.append(frame)
+
+    profiler = None
+    profiling = name == run['profile_stage']
+    if profiling:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(25)
+        profiler = cProfile.Profile()
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+        traced_start = tracemalloc.get_traced_memory()[0]
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        record['wall_seconds'] = round(time.perf_counter() - wall_start, 4)
+        record['cpu_seconds'] = round(time.process_time() - cpu_start, 4)
+        record['rss_end_mb'] = _rss_mb()
+        record['peak_rss_mb'] = _peak_rss_mb()
+        stack.pop()
+        if tracing:
+            # Nested stages reset the peak, so a stage's peak is the larger of its own and its children's.
+            # tracemalloc is process-wide, so for stages running concurrently on threads this is approximate.
+            peak = max(tracemalloc.get_traced_memory()[1], frame['child_peak'])
+            record['peak_alloc_mb'] = round(max(peak - traced_start, 0) / 2 ** 20, 2)
+            if stack:
+                stack[-1]['child_peak'] = max(stack[-1]['child_peak'], peak)
+        if profiling:
+            record['profile'] = _dump_profile(run, name, profiler)
+            if not run['trace_allocations']:
+                tracemalloc.stop()
+        run['stages'].append(record)
+
+
+def run_stage(name, func, *args, **kwargs):
+    """
+    Call func(*args, **kwargs) as a recorded stage. Input rows are counted from the first
+    DataFrame argument and output rows from the result.
+    """
+    rows_in = next((count_rows(arg) for arg in args if count_rows(arg) is not None), None)
+    with stage(name, rows_in=rows_in) as record:
+        result = func(*args, **kwargs)
+        record['rows_out'] = count_rows(result)
+    return result
+
+
+def record_run_info(name, value):
+    """Add a top-level entry (e.g. the sampling parameters) to the run report"""
+    if _active_run is not None:
+        _active_run[name] = value
+
+
+def _dump_profile(run, name, profiler, top=30):
+    """Write the cProfile stats and the top allocation sites of a profiled stage"""
+    os.makedirs(run['profile_dir'], exist_ok=True)
+    base = os.path.join(run['profile_dir'], name.replace('/', '_'))
+
+    profiler.dump_stats(f"{base}.prof")
+    text = io.StringIO()
+    pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(top)
+    with open(f"{base}.cprofile.txt", 'w') as f:
+        f.write(text.getvalue())
+
+    snapshot = tracemalloc.take_snapshot()
+    with open(f"{base}.tracemalloc.txt", 'w') as f:
+        for stat in snapshot.statistics('lineno')[:top]:
+            f.write(f"{stat}\n")
+
+    print(f"[profile] {name}: hotspots written to {base}.cprofile.txt and {base}.tracemalloc.txt")
+    return {
+        'cprofile': f"{base}.prof",
+        'cprofile_text': f"{base}.cprofile.txt",
+        'tracemalloc_text': f"{base}.tracemalloc.txt"
+    }
+
+
+def write_run_report(path="./Data/run_report.json"):
+    """Write the recorded stages of the active run to a JSON report and return the report"""
+    run = _active_run
+    if run is None:
+        return None
+    report = {key: value for key, value in run.items() if key not in ('start', 'profile_dir')}
+    report['total_wall_seconds'] = round(time.perf_counter() - run['start'], 4)
+    report['peak_rss_mb'] = _peak_rss_mb()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"Run report written to {path}")
+    return report
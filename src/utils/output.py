@@ -1,7 +1,19 @@
 import os
+import shutil
+
 import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.ipc as ipc
 import seaborn as sns
 
+# Tables exported in monthly partitions (year=YYYY/month=MM directories), with their date column
+ARROW_PARTITIONED_TABLES = {
+    'fact_flights': 'date'
+}
+
 def print_tables(tables):
     """Print all normalized tables"""
     for table_name, table_data in tables.items():
@@ -26,8 +38,171 @@ def save_tables(tables,suffix, output_dir="./Data/tables"):
 
 
 
-def plot_flight_data_eda(df):
-    """Generate EDA plots to find outliers in flight data"""
+def _arrow_table(df, metadata=None):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if metadata:
+        table = table.replace_schema_metadata({**table.schema.metadata, **metadata})
+    return table
+
+
+def _write_arrow_file(table, path, compression):
+    """Write an Arrow table next to `path` and rename it into place, so readers never see a partial file"""
+    tmp_path = f"{path}.tmp"
+    options = ipc.IpcWriteOptions(compression=compression)
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with ipc.new_file(sink, table.schema, options=options) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def _read_arrow_file(path, columns=None):
+    """Memory-map an Arrow file and read `columns` only (the other columns are not decompressed)"""
+    table = feather.read_table(path, columns=columns, memory_map=True)
+    return table if columns is None else table.select(columns)
+
+
+def _part_files(partition_dir):
+    """The part-N.arrow files of a month partition, in the order they were written"""
+    parts = [name for name in os.listdir(partition_dir) if name.startswith('part-') and name.endswith('.arrow')]
+    return sorted(parts, key=lambda name: int(name[len('part-'):-len('.arrow')]))
+
+
+def _month_partitions(table_data, date_column):
+    """(year, month, rows) of every month in the table, in month order"""
+    dates = pd.to_datetime(table_data[date_column])
+    months = (dates.dt.year * 100 + dates.dt.month).to_numpy()
+    order = np.argsort(months, kind='stable')
+    boundaries = np.flatnonzero(np.diff(months[order])) + 1
+    for positions in np.split(order, boundaries):
+        month = months[positions[0]]
+        yield month // 100, month % 100, table_data.iloc[positions]
+
+
+def _is_set_member(output_dir, name, suffix):
+    """True for the files and partition directories of the tables saved with `suffix`"""
+    if os.path.isdir(os.path.join(output_dir, name)):
+        return name.endswith(suffix)
+    return name.endswith(f"{suffix}.arrow")
+
+
+def _swap_in_tables(output_dir, suffix, staged):
+    """
+    Replace the whole table set `suffix` in output_dir with the `staged` (tmp_path, path) tables, which
+    are all written by then: tables of an older export that the new one does not have are removed.
+    """
+    old_dir = os.path.join(output_dir, f"{suffix}.old")
+    shutil.rmtree(old_dir, ignore_errors=True)
+    os.makedirs(old_dir)
+    for name in os.listdir(output_dir):
+        if _is_set_member(output_dir, name, suffix) and not name.endswith(('.tmp', '.old')):
+            os.rename(os.path.join(output_dir, name), os.path.join(old_dir, name))
+    for tmp_path, path in staged:
+        os.rename(tmp_path, path)
+    new_names = {os.path.basename(path) for _, path in staged}
+    for name in sorted(os.listdir(old_dir)):
+        if name not in new_names:
+            print(f"Removed {name} of the previous export (not in this one)")
+    shutil.rmtree(old_dir)
+
+
+def save_tables_arrow(tables, suffix, output_dir="./Data/tables_arrow", compression='zstd', metadata=None,
+                      append=()):
+    """
+    Save tables as typed Arrow IPC files (dates, nullable integers and categories keep their dtypes).
+    Tables in ARROW_PARTITIONED_TABLES are split into one directory per month under
+    <table><suffix>/year=YYYY/month=MM/. compression=None writes uncompressed buffers,
+    which load_table_arrow then uses straight from the memory map without copying.
+    `metadata` (str keys and values, e.g. the sample rate) is stored in every file's schema.
+    The tables are written next to their targets and the whole set of `suffix` tables is swapped
+    in at the end, so no table or partition of an older export survives (a pipelined run, which
+    does not return the fact table, leaves no old fact table next to its new dimensions).
+    The tables named in `append` (the rows of an incremental load) are added to the export
+    instead, and the others are replaced one by one: partitioned tables get a new part file in
+    each month they touch, the other tables are rewritten with the new rows after the existing ones.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    staged = []
+    for table_name, table_data in tables.items():
+        if table_data.empty:
+            continue
+        appending = table_name in append
+        if table_name not in ARROW_PARTITIONED_TABLES:
+            output_path = os.path.join(output_dir, f"{table_name}{suffix}.arrow")
+            table = _arrow_table(table_data, metadata)
+            if appending and os.path.exists(output_path):
+                table = pa.concat_tables([_read_arrow_file(output_path), table], promote_options='permissive')
+            if append:
+                _write_arrow_file(table, output_path, compression)
+            else:
+                _write_arrow_file(table, f"{output_path}.tmp", compression)
+                staged.append((f"{output_path}.tmp", output_path))
+            print(f"{'Appended to' if appending else 'Saved'} {table_name}{suffix} table: {output_path}")
+            continue
+
+        table_dir = os.path.join(output_dir, f"{table_name}{suffix}")
+        write_dir = table_dir if appending else f"{table_dir}.tmp"
+        if not appending:
+            shutil.rmtree(write_dir, ignore_errors=True)
+        months = 0
+        for year, month, rows in _month_partitions(table_data, ARROW_PARTITIONED_TABLES[table_name]):
+            partition_dir = os.path.join(write_dir, f"year={year:04d}", f"month={month:02d}")
+            os.makedirs(partition_dir, exist_ok=True)
+            parts = _part_files(partition_dir)
+            part = int(parts[-1][len('part-'):-len('.arrow')]) + 1 if parts else 0
+            _write_arrow_file(_arrow_table(rows, metadata), os.path.join(partition_dir, f"part-{part}.arrow"),
+                              compression)
+            months += 1
+        if append and not appending:
+            shutil.rmtree(table_dir, ignore_errors=True)
+            os.rename(write_dir, table_dir)
+        elif not appending:
+            staged.append((write_dir, table_dir))
+        print(f"{'Appended to' if appending else 'Saved'} {table_name}{suffix} table: {table_dir} "
+              f"({months} monthly partitions)")
+    if not append:
+        _swap_in_tables(output_dir, suffix, staged)
+
+
+def _month_label(year_dir, month_dir):
+    return f"{year_dir.split('=')[1]}-{month_dir.split('=')[1]}"
+
+
+def load_table_arrow(table_name, columns=None, months=None, input_dir="./Data/tables_arrow", as_arrow=False):
+    """
+    Load a table written by save_tables_arrow (table_name with its suffix, e.g. 'fact_flights_star').
+    Files are memory-mapped and only the requested `columns` are read; for partitioned
+    tables `months` ('YYYY-MM' strings) selects the partitions. Returns a DataFrame, or the
+    Arrow table (no copy of uncompressed files) with as_arrow=True.
+    """
+    path = os.path.join(input_dir, table_name)
+    if os.path.isdir(path):
+        paths = []
+        for year_dir in sorted(os.listdir(path)):
+            for month_dir in sorted(os.listdir(os.path.join(path, year_dir))):
+                if months is None or _month_label(year_dir, month_dir) in months:
+                    partition_dir = os.path.join(path, year_dir, month_dir)
+                    paths.extend(os.path.join(partition_dir, part) for part in _part_files(partition_dir))
+    else:
+        paths = [f"{path}.arrow"]
+
+    tables = [_read_arrow_file(file_path, columns) for file_path in paths]
+    if not tables:
+        raise ValueError(f"No partitions of {table_name} match months {months}")
+    table = pa.concat_tables(tables, promote_options='permissive') if len(tables) > 1 else tables[0]
+    return table if as_arrow else table.to_pandas()
+
+
+def plot_flight_data_eda(df, headless=False, output_dir="./Data/Charts"):
+    """
+    Generate EDA plots to find outliers in flight data
+    With headless=True the charts are computed from binned aggregates (see utils/eda.py) and
+    saved as PNGs to output_dir instead of being shown.
+    """
+    if headless:
+        from utils.eda import eda_from_chunks, write_eda_charts
+        return write_eda_charts(eda_from_chunks([df]), output_dir)
+
     plt.figure(figsize=(12, 5))
     # 1. Departure Delay Distribution
     plt.subplot(1, 2, 1)
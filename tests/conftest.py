@@ -0,0 +1,69 @@
+import contextlib
+import io
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from benchmarks.synthetic import generate_flights, write_dataset  # noqa: E402
+from etl.extract import extract_airports_data  # noqa: E402
+from etl.transform import (clean_flights_csv_data,  # noqa: E402
+                           interpolate_all_weather_columns, remove_duplicates)
+
+SYNTHETIC_OPTIONS = {'airports': 20, 'tails': 400, 'days': 60}
+DEDUP_SUBSET = ['FL_DATE', 'TAIL_NUM', 'CRS_DEP_TIME']
+
+
+def quietly(func, *args, **kwargs):
+    """Call func without its progress output"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args, **kwargs)
+
+
+def with_output(func, *args, **kwargs):
+    """Call func and return its result and everything it printed"""
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        result = func(*args, **kwargs)
+    return result, output.getvalue()
+
+
+def as_values(df):
+    """Categorical columns as plain values, so frames whose categories differ only in unused ones compare equal"""
+    return df.astype({col: object for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)})
+
+
+@pytest.fixture(scope='session')
+def synthetic_flights():
+    """Small synthetic flights frame in the FLIGHTS_SCHEMA dtypes, duplicates and gaps included"""
+    return generate_flights(20_000, seed=7, **SYNTHETIC_OPTIONS)
+
+
+@pytest.fixture(scope='session')
+def deduplicated_flights(synthetic_flights):
+    return quietly(remove_duplicates, synthetic_flights, subset=DEDUP_SUBSET)
+
+
+@pytest.fixture(scope='session')
+def cleaned_flights(deduplicated_flights):
+    """The synthetic flights after dedup, weather interpolation and cleaning, as the pipeline hands them to the load"""
+    return quietly(lambda: clean_flights_csv_data(interpolate_all_weather_columns(deduplicated_flights)))
+
+
+@pytest.fixture(scope='session')
+def dataset_dir(tmp_path_factory):
+    """Directory with the synthetic CompleteData.csv, Stations.csv and Carriers.csv"""
+    directory = tmp_path_factory.mktemp('synthetic')
+    write_dataset(str(directory), 20_000, seed=7, **SYNTHETIC_OPTIONS)
+    return directory
+
+
+@pytest.fixture(scope='session')
+def airports(dataset_dir):
+    stations = extract_airports_data(str(dataset_dir / 'Stations.csv'),
+                                     ['AIRPORT', 'DISPLAY_AIRPORT_CITY_NAME_FULL', 'AIRPORT_STATE_NAME'])
+    stations['city'] = stations['city'].str.replace(r',\s*[A-Z]{2}$', '', regex=True)
+    return stations
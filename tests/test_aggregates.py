@@ -0,0 +1,45 @@
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import generate_carriers
+from etl.aggregates import build_delay_cubes
+from etl.load import create_fact_table, create_star_schema_dimensions
+from etl.query import StarQuery
+from utils.output import save_tables_arrow
+
+from conftest import quietly
+
+
+@pytest.fixture(scope='module')
+def shared_tail_star_schema(cleaned_flights, airports):
+    """Star tables of flights where a third of the flights are operated by another carrier than the tail's usual one"""
+    flights = cleaned_flights.reset_index(drop=True)
+    carriers = flights['OP_UNIQUE_CARRIER']
+    codes = carriers.cat.categories
+    shifted = codes[(carriers.cat.codes.to_numpy() + 1) % len(codes)]
+    flights['OP_UNIQUE_CARRIER'] = carriers.where(flights.index % 3 != 0, shifted)
+    dimensions = create_star_schema_dimensions(flights, airports, generate_carriers())
+    fact_flights = quietly(create_fact_table, flights, dimensions)
+    cubes = quietly(build_delay_cubes, fact_flights, dimensions, {'by_carrier': ['OP_UNIQUE_CARRIER']})
+    # The fact table has no carrier: flights count for the first carrier dim_aircraft records for their tail
+    first_carrier = flights.drop_duplicates('TAIL_NUM').set_index('TAIL_NUM')['OP_UNIQUE_CARRIER'].astype(object)
+    expected = flights['TAIL_NUM'].map(first_carrier).value_counts().sort_index()
+    assert 'OP_UNIQUE_CARRIER' not in fact_flights.columns
+    return {'fact_flights': fact_flights, **dimensions, **cubes}, expected
+
+
+def test_cube_counts_flights_by_the_first_carrier_of_their_tail(shared_tail_star_schema):
+    star_schema, expected = shared_tail_star_schema
+    cube = star_schema['by_carrier'].set_index('OP_UNIQUE_CARRIER')['flights'].sort_index()
+    pd.testing.assert_series_equal(cube, expected, check_names=False, check_index_type=False)
+
+
+def test_query_groups_flights_like_the_carrier_cube(shared_tail_star_schema, tmp_path):
+    star_schema, expected = shared_tail_star_schema
+    engines = [StarQuery(star_schema)]
+    quietly(save_tables_arrow, star_schema, '_star', output_dir=str(tmp_path))
+    engines.append(StarQuery.from_arrow(str(tmp_path)))
+    for engine in engines:
+        result = engine.query(measures=['flights'], group_by=['carrier']).set_index('carrier')['flights']
+        pd.testing.assert_series_equal(result.sort_index(), expected, check_names=False,
+                                       check_index_type=False, check_dtype=False)
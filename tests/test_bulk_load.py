@@ -0,0 +1,332 @@
+import contextlib
+import datetime
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+from psycopg2 import sql
+
+import etl.bulk_load as bulk_load
+from etl.load import transform_to_star_schema
+from etl.physical_design import (apply_physical_design, drop_foreign_keys,
+                                 month_partitions)
+from main import parse_args
+
+from conftest import quietly
+
+
+class RecordingConnection:
+    """Stands in for a psycopg2 connection: statements are recorded per transaction"""
+
+    def __init__(self, log):
+        self.log = log
+        self.pending = []
+
+    def cursor(self):
+        return RecordingCursor(self)
+
+    def commit(self):
+        self.log.append(('commit', self.pending))
+        self.pending = []
+
+    def rollback(self):
+        self.log.append(('rollback', self.pending))
+        self.pending = []
+
+
+class RecordingCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement, params=None):
+        self.conn.pending.append(repr(statement))
+
+    def fetchone(self):
+        return (None,)
+
+    def fetchall(self):
+        return []
+
+
+def sql_text(statement):
+    """The SQL text of a psycopg2 sql object, rendered without a connection"""
+    if isinstance(statement, sql.Composed):
+        return ''.join(sql_text(part) for part in statement.seq)
+    if isinstance(statement, sql.SQL):
+        return statement.string
+    if isinstance(statement, sql.Identifier):
+        return '.'.join('"{}"'.format(name.replace('"', '""')) for name in statement.strings)
+    if isinstance(statement, sql.Literal):
+        return "'{}'".format(statement.wrapped) if isinstance(statement.wrapped, str) else str(statement.wrapped)
+    return statement
+
+
+class StatementCursor:
+    """
+    A cursor for the helpers that take one: records every statement as SQL text and answers the
+    catalog lookups from `existing` (names of tables and constraints) and `partitions` (by parent)
+    """
+
+    def __init__(self, existing=(), partitions=None):
+        self.existing = set(existing)
+        self.partitions = partitions or {}
+        self.statements = []
+        self.result = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement, params=None):
+        text = sql_text(statement)
+        self.statements.append(text)
+        name = params[0] if params else text.split("'")[1] if "'" in text else None
+        if 'to_regclass' in text:
+            self.result = [(name if name in self.existing else None,)]
+        elif 'pg_constraint' in text:
+            self.result = [(1,)] if name in self.existing else []
+        elif 'pg_inherits' in text:
+            self.result = [(partition,) for partition in self.partitions.get(name, [])]
+        else:
+            self.result = []
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return self.result
+
+
+class StatementConnection:
+    """A connection whose cursor is always the same StatementCursor"""
+
+    def __init__(self, existing=(), partitions=None):
+        self.statement_cursor = StatementCursor(existing, partitions)
+        self.commits = 0
+
+    def cursor(self):
+        return self.statement_cursor
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+class RecordingPool:
+    def __init__(self):
+        self.log = []
+
+    def getconn(self):
+        return RecordingConnection(self.log)
+
+    def putconn(self, conn):
+        pass
+
+
+def _fact_chunks(count):
+    for i in range(count):
+        yield pd.DataFrame({'flight_id': [2 * i + 1, 2 * i + 2],
+                            'date': pd.to_datetime(['2022-01-03', '2022-02-03'])})
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(bulk_load, 'bulk_save_star_schema', lambda *args, **kwargs: [])
+    return RecordingPool()
+
+
+def _committed(pool):
+    return [statement for kind, statements in pool.log if kind == 'commit' for statement in statements]
+
+
+@pytest.mark.parametrize('if_exists', ['replace', 'append'])
+def test_pipelined_facts_only_reach_the_table_in_the_last_transaction(pool, monkeypatch, if_exists):
+    copied = []
+    monkeypatch.setattr(bulk_load, 'copy_dataframe', lambda cursor, table, chunk, chunksize: copied.append(table))
+    quietly(bulk_load.pipelined_save_star_schema, {}, _fact_chunks(3), pool, if_exists=if_exists,
+            physical_design=False)
+
+    assert copied == ['fact_flights_star__load'] * 3
+    last = [statements for kind, statements in pool.log if kind == 'commit'][-1]
+    if if_exists == 'replace':
+        assert any('RENAME TO' in statement for statement in last)
+    else:
+        assert any('INSERT INTO' in statement for statement in last)
+        assert any("Identifier('fact_flights_star__load')" in statement and 'DROP TABLE' in statement
+                   for statement in last)
+
+
+@pytest.mark.parametrize('if_exists', ['replace', 'append'])
+def test_failed_pipelined_load_drops_the_staging_table(pool, monkeypatch, if_exists):
+    def copy_dataframe(cursor, table, chunk, chunksize):
+        if chunk['flight_id'].iloc[0] > 1:
+            raise RuntimeError("connection lost")
+    monkeypatch.setattr(bulk_load, 'copy_dataframe', copy_dataframe)
+
+    with pytest.raises(RuntimeError, match="connection lost"):
+        quietly(bulk_load.pipelined_save_star_schema, {}, _fact_chunks(3), pool, if_exists=if_exists,
+                fact_writers=1, physical_design=False)
+
+    committed = _committed(pool)
+    assert not any('INSERT INTO' in statement or 'RENAME TO' in statement for statement in committed)
+    assert 'DROP TABLE IF EXISTS' in committed[-1] and 'fact_flights_star__load' in committed[-1]
+
+
+def test_pipelined_incremental_is_rejected():
+    with pytest.raises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+        parse_args(['--pipelined', '--incremental'])
+    with pytest.raises(ValueError):
+        transform_to_star_schema(pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), writer=object(),
+                                 incremental=True, pipelined=True)
+
+
+@pytest.mark.parametrize('dtype, expected', [
+    ('int8', 'SMALLINT'), ('Int16', 'SMALLINT'), ('int32', 'INTEGER'), ('Int64', 'BIGINT'),
+    ('float32', 'REAL'), ('float64', 'DOUBLE PRECISION'), ('bool', 'BOOLEAN'),
+    ('datetime64[s]', 'TIMESTAMP'), ('datetime64[ns, UTC]', 'TIMESTAMPTZ'), ('object', 'TEXT'),
+    (pd.CategoricalDtype(['AAA', 'BJP']), 'TEXT'), (pd.CategoricalDtype([1, 2]), 'BIGINT')
+])
+def test_postgres_type(dtype, expected):
+    assert bulk_load.postgres_type(pd.Series([], dtype=dtype).dtype) == expected
+
+
+def test_create_table_sql_has_one_typed_column_per_frame_column():
+    df = pd.DataFrame({'flight_id': np.array([1], dtype='int64'), 'TAIL_NUM': pd.Categorical(['N1']),
+                       'departure_delay': [1.5], 'date': pd.to_datetime(['2022-01-01'])})
+    assert sql_text(bulk_load.create_table_sql('fact_flights_star', df)) == (
+        'CREATE TABLE "fact_flights_star" ("flight_id" BIGINT, "TAIL_NUM" TEXT, '
+        '"departure_delay" DOUBLE PRECISION, "date" TIMESTAMP)'
+    )
+
+
+def test_replace_copies_into_a_staging_table_and_swaps_it_in(monkeypatch):
+    copied = []
+    monkeypatch.setattr(bulk_load, 'copy_dataframe', lambda cursor, table, df, chunksize: copied.append(table))
+    conn = StatementConnection(existing=['dim_date_star'])
+    df = pd.DataFrame({'date': pd.to_datetime(['2022-01-01'])})
+
+    stats = bulk_load.bulk_load_table(conn, 'dim_date_star', df)
+    assert conn.cursor().statements[:4] == [
+        'DROP TABLE IF EXISTS "dim_date_star__load"',
+        'CREATE TABLE "dim_date_star__load" ("date" TIMESTAMP)',
+        'DROP TABLE IF EXISTS "dim_date_star" CASCADE',
+        'ALTER TABLE "dim_date_star__load" RENAME TO "dim_date_star"'
+    ]
+    # The partition lookup finds none, so nothing else is renamed
+    assert 'pg_inherits' in conn.cursor().statements[4] and len(conn.cursor().statements) == 5
+    assert copied == ['dim_date_star__load'] and stats['rows'] == 1 and conn.commits == 1
+
+
+def test_append_copies_into_the_table_and_creates_it_when_missing(monkeypatch):
+    copied = []
+    monkeypatch.setattr(bulk_load, 'copy_dataframe', lambda cursor, table, df, chunksize: copied.append(table))
+    df = pd.DataFrame({'date': pd.to_datetime(['2022-01-01'])})
+
+    existing = StatementConnection(existing=['dim_date_star'])
+    bulk_load.bulk_load_table(existing, 'dim_date_star', df, if_exists='append')
+    assert existing.cursor().statements == ["SELECT to_regclass('dim_date_star')"]
+
+    missing = StatementConnection()
+    bulk_load.bulk_load_table(missing, 'dim_date_star', df, if_exists='append')
+    assert missing.cursor().statements == ["SELECT to_regclass('dim_date_star')",
+                                           'CREATE TABLE "dim_date_star" ("date" TIMESTAMP)']
+    assert copied == ['dim_date_star', 'dim_date_star']
+
+
+def test_month_partitions_cover_every_date_once():
+    dates = pd.to_datetime(['2022-01-31 23:00', '2021-12-01 00:00', None, '2022-03-01 00:00', '2022-01-01 00:00',
+                            '2021-12-31 12:00'])
+    partitions = month_partitions(dates)
+    assert partitions == [
+        ('p202112', datetime.date(2021, 12, 1), datetime.date(2022, 1, 1)),
+        ('p202201', datetime.date(2022, 1, 1), datetime.date(2022, 2, 1)),
+        ('p202203', datetime.date(2022, 3, 1), datetime.date(2022, 4, 1))
+    ]
+    # Each date falls in exactly one [start, end) range
+    for date in dates.dropna():
+        assert sum(pd.Timestamp(start) <= date < pd.Timestamp(end) for _, start, end in partitions) == 1
+    assert month_partitions([]) == []
+
+
+def test_partitioned_replace_creates_and_renames_the_month_partitions(monkeypatch):
+    monkeypatch.setattr(bulk_load, 'copy_dataframe', lambda cursor, table, df, chunksize: None)
+    staged = ['fact_flights_star__load_p202112', 'fact_flights_star__load_p202201']
+    conn = StatementConnection(partitions={'fact_flights_star': staged})
+    df = pd.DataFrame({'flight_id': np.array([1, 2], dtype='int64'),
+                       'date': pd.to_datetime(['2022-01-31', '2021-12-01'])})
+
+    bulk_load.bulk_load_table(conn, 'fact_flights_star', df, partition_column='date')
+    statements = conn.cursor().statements
+    assert statements[1] == ('CREATE TABLE "fact_flights_star__load" ("flight_id" BIGINT, "date" TIMESTAMP) '
+                             'PARTITION BY RANGE ("date")')
+    assert statements[2:4] == [
+        'CREATE TABLE IF NOT EXISTS "fact_flights_star__load_p202112" PARTITION OF "fact_flights_star__load" '
+        "FOR VALUES FROM ('2021-12-01') TO ('2022-01-01')",
+        'CREATE TABLE IF NOT EXISTS "fact_flights_star__load_p202201" PARTITION OF "fact_flights_star__load" '
+        "FOR VALUES FROM ('2022-01-01') TO ('2022-02-01')"
+    ]
+    assert statements[-2:] == [
+        'ALTER TABLE "fact_flights_star__load_p202112" RENAME TO "fact_flights_star_p202112"',
+        'ALTER TABLE "fact_flights_star__load_p202201" RENAME TO "fact_flights_star_p202201"'
+    ]
+
+
+def test_physical_design_statements():
+    tables = ['fact_flights', 'dim_weather', 'dim_airports', 'dim_date']
+    conn = StatementConnection()
+    quietly(apply_physical_design, conn, tables)
+    statements = conn.cursor().statements
+    alters = [statement for statement in statements if statement.startswith('ALTER')]
+    assert alters == [
+        'ALTER TABLE "fact_flights_star" ADD CONSTRAINT "pk_fact_flights_star" PRIMARY KEY ("flight_id", "date")',
+        'ALTER TABLE "dim_weather_star" ADD CONSTRAINT "pk_dim_weather_star" PRIMARY KEY ("weather_id")',
+        'ALTER TABLE "dim_airports_star" ADD CONSTRAINT "pk_dim_airports_star" PRIMARY KEY ("airport_id")',
+        'ALTER TABLE "dim_date_star" ADD CONSTRAINT "pk_dim_date_star" PRIMARY KEY ("date")',
+        'ALTER TABLE "fact_flights_star" ADD CONSTRAINT "fk_fact_flights_star_weather_id" '
+        'FOREIGN KEY ("weather_id") REFERENCES "dim_weather_star" ("weather_id")',
+        'ALTER TABLE "fact_flights_star" ADD CONSTRAINT "fk_fact_flights_star_origin_airport_oid" '
+        'FOREIGN KEY ("origin_airport_oid") REFERENCES "dim_airports_star" ("airport_id")',
+        'ALTER TABLE "fact_flights_star" ADD CONSTRAINT "fk_fact_flights_star_dest_airport_oid" '
+        'FOREIGN KEY ("dest_airport_oid") REFERENCES "dim_airports_star" ("airport_id")',
+        'ALTER TABLE "fact_flights_star" ADD CONSTRAINT "fk_fact_flights_star_date" '
+        'FOREIGN KEY ("date") REFERENCES "dim_date_star" ("date")'
+    ]
+    assert [statement for statement in statements if statement.startswith('CREATE INDEX')] == [
+        f'CREATE INDEX IF NOT EXISTS "idx_fact_flights_star_{column.lower()}" ON "fact_flights_star" ("{column}")'
+        for column in ['date', 'origin_airport_oid', 'dest_airport_oid', 'TAIL_NUM']
+    ]
+    assert [statement for statement in statements if statement.startswith('ANALYZE')] == [
+        f'ANALYZE "{table}_star"' for table in tables
+    ]
+    assert conn.commits == 1
+
+    # Existing constraints are kept, and no key points at a table that was not loaded
+    conn = StatementConnection(existing=['pk_fact_flights_star', 'fk_fact_flights_star_weather_id'])
+    quietly(apply_physical_design, conn, ['fact_flights', 'dim_weather', 'dim_date'])
+    alters = [statement for statement in conn.cursor().statements if statement.startswith('ALTER')]
+    assert [statement.split('"')[3] for statement in alters] == [
+        'pk_dim_weather_star', 'pk_dim_date_star', 'fk_fact_flights_star_date'
+    ]
+
+
+def test_foreign_keys_are_dropped_only_from_an_existing_fact_table():
+    conn = StatementConnection(existing=['fact_flights_star'])
+    drop_foreign_keys(conn)
+    drops = [statement for statement in conn.cursor().statements if statement.startswith('ALTER')]
+    assert drops == [f'ALTER TABLE "fact_flights_star" DROP CONSTRAINT IF EXISTS "fk_fact_flights_star_{column}"'
+                     for column in ['weather_id', 'origin_airport_oid', 'dest_airport_oid', 'date']]
+
+    conn = StatementConnection()
+    drop_foreign_keys(conn)
+    assert conn.cursor().statements == ['SELECT to_regclass(%s)'] and conn.commits == 1
@@ -0,0 +1,60 @@
+import os
+
+import pandas as pd
+import pytest
+
+from etl.checkpoint import CheckpointStore
+from etl.parallel import parallel_clean_flights
+from etl.transform import (clean_flights_csv_data,
+                           interpolate_all_weather_columns, remove_duplicates)
+
+from conftest import DEDUP_SUBSET
+
+
+def run_stages(store, flights, quarantine_path=None, clean=clean_flights_csv_data, **clean_options):
+    source = store.source(flights, name='extract')
+    deduplicated = store.run('remove_duplicates', remove_duplicates, source, subset=DEDUP_SUBSET)
+    interpolated = store.run('interpolate_weather', interpolate_all_weather_columns, deduplicated)
+    return store.run('clean_flights_csv_data', clean, interpolated, quarantine_path=quarantine_path,
+                     **clean_options)
+
+
+def test_checkpoint_hits_return_the_fresh_frames(tmp_path, synthetic_flights):
+    fresh = run_stages(CheckpointStore(enabled=False), synthetic_flights).frame()
+    store = CheckpointStore(str(tmp_path))
+    first = run_stages(store, synthetic_flights)
+    assert first.loaded
+    second = run_stages(store, synthetic_flights)
+    assert not second.loaded
+    # Same rows, order, dtypes and index (cleaning leaves gaps in it) as a run without checkpoints
+    pd.testing.assert_frame_equal(second.frame(), fresh)
+    pd.testing.assert_frame_equal(first.frame(), fresh)
+
+
+@pytest.mark.parametrize('clean, clean_options', [(clean_flights_csv_data, {}),
+                                                   (parallel_clean_flights, {'max_workers': 2})])
+def test_checkpoint_hit_replays_the_log_and_quarantine_file(tmp_path, synthetic_flights, capsys, clean,
+                                                            clean_options):
+    quarantine = tmp_path / 'quarantine.csv'
+    store = CheckpointStore(str(tmp_path / 'checkpoints'))
+    run_stages(store, synthetic_flights, str(quarantine), clean, **clean_options)
+    fresh_log = capsys.readouterr().out
+    fresh_quarantine = quarantine.read_bytes()
+    quarantine.unlink()
+
+    run_stages(store, synthetic_flights, str(quarantine), clean, **clean_options)
+    replayed_log = capsys.readouterr().out
+    assert "Checkpoint hit for clean_flights_csv_data" in replayed_log
+    assert quarantine.read_bytes() == fresh_quarantine
+    rule_lines = [line for line in fresh_log.splitlines() if line.startswith('Flights CSV:')]
+    assert rule_lines
+    for line in rule_lines:
+        assert line in replayed_log
+
+
+def test_eviction_removes_the_stored_logs_and_files(tmp_path, synthetic_flights):
+    store = CheckpointStore(str(tmp_path / 'checkpoints'))
+    run_stages(store, synthetic_flights, str(tmp_path / 'quarantine.csv'))
+    store.max_bytes = 0
+    store.evict()
+    assert os.listdir(tmp_path / 'checkpoints') == []
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.data_profile import (hll_error, hll_estimate, hll_registers,
+                                profile_chunks, profile_frame, _value_hashes)
+
+
+def sample_values(kind, cardinality, rows, rng):
+    """`rows` values drawn from `cardinality` distinct values of a dtype kind"""
+    picks = rng.integers(0, cardinality, rows)
+    picks[:cardinality] = np.arange(cardinality)
+    if kind == 'float':
+        return pd.Series(picks * 0.25 - 1_000.0)
+    if kind == 'int':
+        return pd.Series(picks * 7_919, dtype='Int64')
+    if kind == 'datetime':
+        return pd.Series(np.datetime64('2022-01-01', 's') + picks.astype('timedelta64[m]'))
+    return pd.Series([f"N{pick:07d}" for pick in picks], dtype=object)
+
+
+@pytest.mark.parametrize('kind', ['float', 'int', 'datetime', 'str'])
+@pytest.mark.parametrize('precision', [10, 14])
+@pytest.mark.parametrize('cardinality', [300, 20_000, 300_000])
+def test_estimate_is_within_the_expected_error(kind, precision, cardinality):
+    values = sample_values(kind, cardinality, cardinality + 50_000, np.random.default_rng(cardinality + precision))
+    exact = values.nunique()
+    assert exact == cardinality
+    estimate = hll_estimate(hll_registers(_value_hashes(values), precision))
+    # Four standard errors: a seeded run outside them points at a bias, not at bad luck
+    assert abs(estimate - exact) <= 4 * hll_error(precision) * exact
+
+
+@pytest.mark.parametrize('approx_distinct', [False, True])
+def test_profile_of_chunks_equals_profile_of_their_concatenation(synthetic_flights, approx_distinct):
+    # Chunks of uneven sizes, the last one without any null in some columns
+    bounds = [0, 1, 4_000, 9_999, 19_000, len(synthetic_flights)]
+    chunks = [synthetic_flights.iloc[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    merged_df, merged_summary = profile_chunks(chunks, approx_distinct=approx_distinct)
+    whole_df, whole_summary = profile_frame(synthetic_flights, approx_distinct=approx_distinct)
+    pd.testing.assert_frame_equal(merged_df, whole_df)
+    assert merged_summary == whole_summary
+    if approx_distinct:
+        assert 'DEP_DELAY' in whole_summary['approx_columns'] and 'ORIGIN' not in whole_summary['approx_columns']
+    else:
+        exact = synthetic_flights.nunique()
+        assert whole_df.set_index('Column')['Unique_Values'].to_dict() == exact.to_dict()
+
+
+def test_registers_of_chunks_merge_to_the_registers_of_all_values():
+    values = sample_values('float', 50_000, 120_000, np.random.default_rng(1))
+    hashes = _value_hashes(values)
+    chunks = [hll_registers(part) for part in np.array_split(hashes, 7)]
+    np.testing.assert_array_equal(np.maximum.reduce(chunks), hll_registers(hashes))
@@ -0,0 +1,126 @@
+import numpy as np
+import pytest
+
+from utils.eda import (EDA_BINS, binned_kde, box_stats, count_outside,
+                       eda_from_chunks, histogram_quantiles, new_eda,
+                       new_histogram, update_eda, update_histogram)
+
+QUANTILES = [0.001, 0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99, 0.999]
+COLUMNS = ['DEP_DELAY', 'TEMPERATURE', 'WIND_SPD']
+
+
+def sample_values(column, rows=50_000, seed=0):
+    """Values at the data's resolution, mostly inside the binned range of `column`"""
+    rng = np.random.default_rng(seed)
+    values = {
+        'DEP_DELAY': np.round(rng.gamma(1.2, 25.0, rows) - 20.0),
+        'TEMPERATURE': np.round(rng.normal(12.0, 11.0, rows), 1),
+        'WIND_SPD': np.round(rng.gamma(2.0, 4.0, rows), 1)
+    }[column]
+    values[rng.random(rows) < 0.05] = np.nan
+    return values
+
+
+def histogram(column, values):
+    return update_histogram(new_histogram(column), values)
+
+
+@pytest.mark.parametrize('column', COLUMNS)
+def test_quantiles_are_within_one_bin_width(synthetic_flights, column):
+    width = EDA_BINS[column][2]
+    for values in [sample_values(column), synthetic_flights[column].to_numpy(dtype=np.float64, na_value=np.nan)]:
+        present = values[~np.isnan(values)]
+        actual = histogram_quantiles(histogram(column, values), QUANTILES)
+        # The histogram ranks by q * n, as the inverted CDF does; np.quantile's default interpolates
+        # between neighbouring values, which can be far apart in a sparse tail
+        expected = np.quantile(present, QUANTILES, method='inverted_cdf')
+        np.testing.assert_allclose(actual, expected, rtol=0, atol=width)
+
+
+def test_quantiles_outside_the_binned_range_are_clamped_to_the_extremes():
+    low, high, _ = EDA_BINS['DEP_DELAY']
+    values = np.concatenate([[low - 500.0, low - 10.0], np.arange(0.0, 100.0), [high + 5.0, high + 900.0]])
+    hist = histogram('DEP_DELAY', values)
+    assert histogram_quantiles(hist, [0.0, 0.01, 1.0]).tolist() == [low - 500.0, low - 500.0, high + 900.0]
+    assert histogram('DEP_DELAY', [np.nan])['missing'] == 1
+
+
+@pytest.mark.parametrize('column', COLUMNS)
+def test_histograms_of_chunks_add_up_to_one_pass(column):
+    values = sample_values(column, seed=1)
+    whole = histogram(column, values)
+    parts = [histogram(column, part) for part in np.array_split(values, 7)]
+    np.testing.assert_array_equal(sum(part['counts'] for part in parts), whole['counts'])
+    for key in ['n', 'missing']:
+        assert sum(part[key] for part in parts) == whole[key]
+    for key in ['sum', 'sumsq']:
+        assert sum(part[key] for part in parts) == pytest.approx(whole[key], rel=1e-12)
+    assert min(part['min'] for part in parts) == whole['min'] and max(part['max'] for part in parts) == whole['max']
+
+
+def test_eda_of_chunks_equals_eda_of_all_rows(synthetic_flights):
+    bounds = [0, 1, 3_000, 11_111, len(synthetic_flights)]
+    chunks = [synthetic_flights.iloc[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+    streamed = eda_from_chunks(chunks)
+    whole = update_eda(new_eda(), synthetic_flights)
+
+    groups = whole.pop('DEP_DELAY_BY_CANCELLED')
+    assert sorted(streamed['DEP_DELAY_BY_CANCELLED']) == sorted(groups)
+    pairs = [(streamed[col], whole[col]) for col in whole]
+    pairs += [(streamed['DEP_DELAY_BY_CANCELLED'][value], groups[value]) for value in groups]
+    for streamed_hist, whole_hist in pairs:
+        np.testing.assert_array_equal(streamed_hist['counts'], whole_hist['counts'])
+        assert {key: streamed_hist[key] for key in ['n', 'missing', 'min', 'max']} == \
+            {key: whole_hist[key] for key in ['n', 'missing', 'min', 'max']}
+        assert streamed_hist['sum'] == pytest.approx(whole_hist['sum'], rel=1e-12)
+
+
+def test_count_outside_is_exact_on_bin_edges():
+    values = sample_values('WIND_SPD', seed=2)
+    present = values[~np.isnan(values)]
+    hist = histogram('WIND_SPD', values)
+    for low, high in [(2.0, 15.0), (0.0, 100.0), (-5.0, 120.0), (7.5, 7.5)]:
+        assert count_outside(hist, low, high) == int(((present < low) | (present >= high)).sum())
+
+
+@pytest.mark.parametrize('column', COLUMNS)
+def test_box_stats_follow_the_exact_quartiles(column):
+    width = EDA_BINS[column][2]
+    values = sample_values(column, seed=3)
+    present = values[~np.isnan(values)]
+    stats = box_stats(histogram(column, values), column)
+
+    q1, median, q3 = np.quantile(present, [0.25, 0.5, 0.75], method='inverted_cdf')
+    np.testing.assert_allclose([stats['q1'], stats['med'], stats['q3']], [q1, median, q3], rtol=0, atol=width)
+    low_fence = stats['q1'] - 1.5 * (stats['q3'] - stats['q1'])
+    high_fence = stats['q3'] + 1.5 * (stats['q3'] - stats['q1'])
+    # Whiskers reach the furthest values inside the fences, at bin resolution
+    inside = present[(present >= low_fence) & (present <= high_fence)]
+    assert inside.min() - width <= stats['whislo'] <= inside.min() + width
+    assert inside.max() - width <= stats['whishi'] <= inside.max() + width
+    assert stats['min'] <= stats['whislo'] <= stats['q1'] <= stats['med'] <= stats['q3'] <= stats['whishi']
+    # Outliers are counted in whole bins, so only values in the bins cut by a fence may differ
+    exact = int(((present < low_fence) | (present > high_fence)).sum())
+    near_fence = int(((np.abs(present - low_fence) < width) | (np.abs(present - high_fence) < width)).sum())
+    assert abs(stats['outliers'] - exact) <= near_fence
+    assert stats['min'] == present.min() and stats['max'] == present.max()
+
+
+@pytest.mark.parametrize('column', COLUMNS)
+def test_binned_kde_matches_a_direct_gaussian_kde_of_the_binned_values(column):
+    values = sample_values(column, rows=20_000, seed=4)
+    present = values[~np.isnan(values)]
+    hist = histogram(column, values)
+    centers, density = binned_kde(hist)
+
+    # Every value at the center of its bin, with the same Silverman bandwidth from the exact statistics
+    binned = centers[np.floor((present - hist['low']) / hist['width']).astype(int)]
+    q1, q3 = np.quantile(present, [0.25, 0.75])
+    spread = min(present.std(), (q3 - q1) / 1.34)
+    bandwidth = max(0.9 * spread * len(present) ** -0.2, hist['width'])
+    expected = np.array([np.exp(-0.5 * ((center - binned) / bandwidth) ** 2).sum() for center in centers])
+    expected *= hist['width'] / (bandwidth * np.sqrt(2 * np.pi))
+
+    assert np.abs(density - expected).max() <= 0.01 * expected.max()
+    assert density.sum() == pytest.approx(len(present), rel=0.01)
+    assert binned_kde(histogram(column, [1.0]))[1].sum() == 0
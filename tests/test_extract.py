@@ -0,0 +1,90 @@
+import pandas as pd
+import pytest
+
+from etl.extract import (extract_flights_data, iter_flights_chunks,
+                         read_flights_streaming)
+from etl.sampling import SampleCandidates
+from etl.schema import FLIGHTS_SCHEMA, apply_flights_schema
+
+from conftest import as_values, quietly
+
+COLUMNS = list(FLIGHTS_SCHEMA)
+
+
+def reference_read(flights_csv, engine):
+    """The whole file with a single pd.read_csv, pruned and cast afterwards"""
+    return apply_flights_schema(pd.read_csv(flights_csv, engine=engine)[COLUMNS])
+
+
+@pytest.fixture(scope='module')
+def shard_dir(dataset_dir, tmp_path_factory):
+    """CompleteData.csv split into uneven shards, one of them with a header but no rows"""
+    header, *lines = (dataset_dir / 'CompleteData.csv').read_text().splitlines()
+    directory = tmp_path_factory.mktemp('shards')
+    bounds = [0, 7_000, 7_000, 7_001, len(lines)]
+    for number, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+        (directory / f"2022-{number + 1:02d}.csv").write_text('\n'.join([header] + lines[start:end]) + '\n')
+    return directory
+
+
+@pytest.mark.parametrize('engine', ['c', 'pyarrow'])
+@pytest.mark.parametrize('chunksize', [1_000, 7_777, 1_000_000])
+def test_streaming_read_matches_a_single_read_csv(dataset_dir, engine, chunksize):
+    flights_csv = str(dataset_dir / 'CompleteData.csv')
+    actual = quietly(read_flights_streaming, flights_csv, COLUMNS, chunksize=chunksize, engine=engine)
+    expected = reference_read(flights_csv, engine)
+    pd.testing.assert_frame_equal(as_values(actual), as_values(expected))
+    assert {col: str(dtype) for col, dtype in actual.dtypes.items()} == FLIGHTS_SCHEMA
+
+
+@pytest.mark.parametrize('engine', ['c', 'pyarrow'])
+def test_chunks_are_bounded_and_add_up_to_the_file(dataset_dir, engine):
+    flights_csv = str(dataset_dir / 'CompleteData.csv')
+    chunks = list(iter_flights_chunks(flights_csv, COLUMNS, chunksize=3_000, engine=engine))
+    assert [len(chunk) for chunk in chunks] == [3_000] * 6 + [2_000]
+    combined = pd.concat([as_values(chunk) for chunk in chunks], ignore_index=True)
+    pd.testing.assert_frame_equal(combined, as_values(reference_read(flights_csv, engine)))
+
+
+@pytest.mark.parametrize('engine', ['c', 'pyarrow'])
+@pytest.mark.parametrize('max_workers', [1, 3])
+def test_sharded_read_matches_the_single_file(dataset_dir, shard_dir, engine, max_workers):
+    actual = quietly(read_flights_streaming, str(shard_dir), COLUMNS, chunksize=2_500,
+                     max_workers=max_workers, engine=engine)
+    expected = reference_read(str(dataset_dir / 'CompleteData.csv'), engine)
+    pd.testing.assert_frame_equal(as_values(actual), as_values(expected))
+
+    # The shard without rows contributes one empty chunk and nothing else
+    chunks = list(iter_flights_chunks(str(shard_dir), COLUMNS, chunksize=2_500, engine=engine))
+    assert sum(len(chunk) == 0 for chunk in chunks) == 1 and sum(map(len, chunks)) == len(expected)
+
+
+@pytest.mark.parametrize('engine', ['c', 'pyarrow'])
+def test_header_only_file_reads_as_an_empty_schema_frame(shard_dir, engine):
+    flights_csv = str(shard_dir / '2022-02.csv')
+    chunks = list(iter_flights_chunks(flights_csv, COLUMNS + ['MISSING'], engine=engine))
+    assert len(chunks) == 1 and chunks[0].empty
+    for df in [chunks[0], quietly(read_flights_streaming, flights_csv, COLUMNS, engine=engine),
+               quietly(read_flights_streaming, flights_csv, COLUMNS, engine=engine, chunk_filter=SampleCandidates(0.1))]:
+        assert df.empty
+        assert {col: str(dtype) for col, dtype in df.dtypes.items()} == FLIGHTS_SCHEMA
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_extract_parses_only_the_required_columns(dataset_dir, tmp_path, monkeypatch, streaming):
+    flights_csv = str(dataset_dir / 'CompleteData.csv')
+    columns = ['FL_DATE', 'ORIGIN', 'DEP_DELAY', 'CANCELLED', 'MISSING']
+    expected = reference_read(flights_csv, 'c')[columns[:-1]]
+    parsed_columns = []
+    read_csv = pd.read_csv
+
+    def recording_read_csv(*args, **kwargs):
+        df = read_csv(*args, **kwargs)
+        if kwargs.get('nrows') != 0:
+            parsed_columns.append(kwargs.get('usecols'))
+        return df
+    monkeypatch.setattr(pd, 'read_csv', recording_read_csv)
+
+    actual = quietly(extract_flights_data, flights_csv, str(tmp_path / 'extract.arrow'), columns, streaming=streaming)
+    pd.testing.assert_frame_equal(as_values(actual), as_values(expected))
+    assert parsed_columns == [columns[:-1]]
@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import generate_carriers
+from etl.key_index import KeyIndex, dedup_key_hashes
+from etl.load import (STAR_SCHEMA_INPUT_COLUMNS, select_incremental_flights,
+                      transform_to_star_schema)
+from etl.writers import SQLiteWriter
+
+from conftest import quietly
+
+
+def test_key_index_add_handles_empty_and_fresh_indexes(tmp_path, synthetic_flights):
+    hashes = dedup_key_hashes(synthetic_flights.head(1_000))
+
+    # Nothing to add to an index that has no files yet
+    empty = KeyIndex(str(tmp_path / 'empty'))
+    assert empty.add(np.array([], np.uint64), max_flight_id=0) == 0
+    assert len(empty) == 0 and not empty.contains(hashes).any()
+
+    # A fresh index gets its Bloom filter with the first keys
+    fresh = KeyIndex(str(tmp_path / 'fresh'))
+    added = fresh.add(hashes, max_flight_id=1_000)
+    assert added == len(np.unique(hashes)) == len(fresh)
+    assert KeyIndex(str(tmp_path / 'fresh')).contains(hashes).all()
+
+    # Adding nothing keeps the keys and records the new flight_id
+    assert fresh.add(np.array([], np.uint64), max_flight_id=1_001) == 0
+    reopened = KeyIndex(str(tmp_path / 'fresh'))
+    assert len(reopened) == added and reopened.meta['max_flight_id'] == 1_001
+    assert reopened.contains(hashes).all()
+
+
+def test_partition_fallback_rebuilds_the_key_index(tmp_path, cleaned_flights, airports):
+    writer = SQLiteWriter(str(tmp_path / 'warehouse.db'))
+    carriers = generate_carriers()
+    first_dates = cleaned_flights['FL_DATE'] < pd.Timestamp('2022-02-01')
+    transform_to_star_schema(cleaned_flights[first_dates], airports, carriers, writer=writer, cube_grains={})
+
+    # The index does not exist yet: flights are selected by partition and the index is rebuilt
+    key_index = KeyIndex(str(tmp_path / 'key_index'))
+    appended = transform_to_star_schema(cleaned_flights, airports, carriers, writer=writer, incremental=True,
+                                        key_index=key_index, cube_grains={})
+    assert len(appended['fact_flights']) == (~first_dates).sum()
+    state = writer.read_state()
+    assert state['max_flight_id'] == len(cleaned_flights)
+    assert key_index.meta['max_flight_id'] == state['max_flight_id']
+    assert len(key_index) == len(cleaned_flights)
+
+    # The next load trusts the index, so a re-delivery of loaded flights adds nothing
+    assert transform_to_star_schema(cleaned_flights, airports, carriers, writer=writer, incremental=True,
+                                    key_index=KeyIndex(str(tmp_path / 'key_index')), cube_grains={}) == {}
+
+
+def test_key_index_is_not_rebuilt_from_a_partial_input(tmp_path, cleaned_flights, airports):
+    writer = SQLiteWriter(str(tmp_path / 'warehouse.db'))
+    carriers = generate_carriers()
+    first_dates = cleaned_flights['FL_DATE'] < pd.Timestamp('2022-02-01')
+    transform_to_star_schema(cleaned_flights[first_dates], airports, carriers, writer=writer, cube_grains={})
+
+    key_index = KeyIndex(str(tmp_path / 'key_index'))
+    transform_to_star_schema(cleaned_flights[~first_dates], airports, carriers, writer=writer, incremental=True,
+                             key_index=key_index, cube_grains={})
+    assert key_index.meta['max_flight_id'] is None
+
+
+def test_rebuilt_key_index_holds_the_keys_a_full_load_records(tmp_path, deduplicated_flights, cleaned_flights,
+                                                               airports):
+    carriers = generate_carriers()
+    first_dates = cleaned_flights['FL_DATE'] < pd.Timestamp('2022-02-01')
+    raw_first_dates = deduplicated_flights['FL_DATE'] < pd.Timestamp('2022-02-01')
+
+    # Rebuilt from the extracted flights of the loaded partitions, then the keys of the flights before cleaning
+    writer = SQLiteWriter(str(tmp_path / 'incremental.db'))
+    transform_to_star_schema(cleaned_flights[first_dates], airports, carriers, writer=writer, cube_grains={})
+    rebuilt = KeyIndex(str(tmp_path / 'rebuilt'))
+    state = writer.read_state()
+    new_flights = quietly(select_incremental_flights, deduplicated_flights, state, rebuilt)
+    assert len(new_flights) == (~raw_first_dates).sum()
+    quietly(transform_to_star_schema, cleaned_flights[~first_dates], airports, carriers, writer=writer,
+            incremental=True, key_index=rebuilt, state=state, key_hashes=dedup_key_hashes(new_flights),
+            already_selected=True, cube_grains={})
+
+    full = KeyIndex(str(tmp_path / 'full'))
+    quietly(transform_to_star_schema, cleaned_flights, airports, carriers,
+            writer=SQLiteWriter(str(tmp_path / 'full.db')), key_index=full,
+            key_hashes=dedup_key_hashes(deduplicated_flights), cube_grains={})
+
+    # Flights the cleaning rejected are in both, so neither selects them again
+    assert len(full) == len(deduplicated_flights) > len(cleaned_flights)
+    np.testing.assert_array_equal(rebuilt._keys(), full._keys())
+    assert rebuilt.meta['max_flight_id'] == full.meta['max_flight_id'] == len(cleaned_flights)
+
+
+def test_already_selected_flights_are_loaded_without_a_second_selection(tmp_path, cleaned_flights, airports,
+                                                                        monkeypatch):
+    writer = SQLiteWriter(str(tmp_path / 'warehouse.db'))
+    carriers = generate_carriers()
+    first_dates = cleaned_flights['FL_DATE'] < pd.Timestamp('2022-02-01')
+    key_index = KeyIndex(str(tmp_path / 'key_index'))
+    quietly(transform_to_star_schema, cleaned_flights[first_dates], airports, carriers, writer=writer,
+            key_index=key_index, cube_grains={})
+
+    state = writer.read_state()
+    new_flights = quietly(select_incremental_flights, cleaned_flights, state, key_index)
+    monkeypatch.setattr('etl.load.select_incremental_flights', None)
+    # As the lazy plan hands them over: without CRS_DEP_TIME, whose key was hashed before cleaning
+    appended = quietly(transform_to_star_schema, new_flights[STAR_SCHEMA_INPUT_COLUMNS], airports, carriers,
+                       writer=writer, incremental=True, key_index=key_index, state=state,
+                       key_hashes=dedup_key_hashes(new_flights), already_selected=True, cube_grains={})
+    assert len(appended['fact_flights']) == (~first_dates).sum()
+    assert len(key_index) == len(cleaned_flights) == writer.read_state()['max_flight_id']
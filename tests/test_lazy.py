@@ -0,0 +1,112 @@
+import pandas as pd
+import pytest
+
+from etl.extract import extract_carriers_data, extract_flights_data
+from etl.lazy import LazyFlights
+from etl.load import (STAR_SCHEMA_INPUT_COLUMNS, create_fact_table,
+                      create_star_schema_dimensions)
+from etl.schema import FLIGHTS_SCHEMA, flights_schema
+from etl.sampling import stratified_sample
+from etl.transform import (build_station_weather, clean_flights_csv_data,
+                           interpolate_all_weather_columns,
+                           interpolate_weather_from_stations, remove_duplicates)
+from main import flight_airports_of
+
+from conftest import DEDUP_SUBSET, as_values, quietly
+
+TOLERANCE = pd.Timedelta(hours=3)
+
+
+def eager_flights(flights_csv, cache_path, weather_mode, schema, streaming, engine):
+    """The stages of run_eager_pipeline, without checkpoints"""
+    flights = extract_flights_data(flights_csv, cache_path, list(FLIGHTS_SCHEMA), streaming=streaming,
+                                   chunksize=5_000, engine=engine, schema=schema)
+    flights = remove_duplicates(flights, subset=DEDUP_SUBSET)
+    station_weather = None
+    if weather_mode == 'station':
+        station_weather = build_station_weather(flights)
+        flights = interpolate_weather_from_stations(flights, station_weather, tolerance=TOLERANCE)
+    else:
+        flights = interpolate_all_weather_columns(flights)
+    return clean_flights_csv_data(flights), station_weather
+
+
+def lazy_flights(flights_csv, weather_mode, schema, engine):
+    plan = (LazyFlights.scan(flights_csv, list(FLIGHTS_SCHEMA), schema=schema, chunksize=5_000, engine=engine)
+            .remove_duplicates(subset=DEDUP_SUBSET)
+            .interpolate_weather(weather_mode, tolerance=TOLERANCE)
+            .clean()
+            .select(STAR_SCHEMA_INPUT_COLUMNS))
+    flights, outputs = plan.execute()
+    return flights, outputs.get('station_weather')
+
+
+def star_schema(flights, station_weather, airports, carriers):
+    dimensions = create_star_schema_dimensions(flights, airports, carriers, station_weather)
+    return {'fact_flights': create_fact_table(flights, dimensions), **dimensions}
+
+
+@pytest.mark.parametrize('weather_mode', ['flight', 'station'])
+@pytest.mark.parametrize('compact_weather', [False, True])
+# The C and pyarrow parsers can round a float literal to neighbouring doubles, so both sides use the same parser
+@pytest.mark.parametrize('streaming, engine', [(False, 'c'), (True, 'c'), (True, 'pyarrow')])
+def test_lazy_plan_matches_eager_stages(dataset_dir, airports, tmp_path, weather_mode, compact_weather,
+                                        streaming, engine):
+    flights_csv = str(dataset_dir / 'CompleteData.csv')
+    carriers = extract_carriers_data(str(dataset_dir / 'Carriers.csv'))
+    schema = flights_schema(compact_weather)
+
+    eager, eager_station_weather = eager_flights(flights_csv, str(tmp_path / 'extract.arrow'), weather_mode,
+                                                 schema, streaming, engine)
+    lazy, lazy_station_weather = lazy_flights(flights_csv, weather_mode, schema, engine)
+
+    eager = eager[STAR_SCHEMA_INPUT_COLUMNS].reset_index(drop=True)
+    pd.testing.assert_frame_equal(lazy.reset_index(drop=True), eager, check_categorical=False)
+    assert str(lazy['FL_DATE'].dtype) == schema['FL_DATE']
+    if weather_mode == 'station':
+        pd.testing.assert_frame_equal(lazy_station_weather, eager_station_weather, check_categorical=False)
+
+    expected = star_schema(eager, eager_station_weather, airports, carriers)
+    result = star_schema(lazy, lazy_station_weather, airports, carriers)
+    for table in ['fact_flights', 'dim_weather', 'dim_date']:
+        pd.testing.assert_frame_equal(result[table], expected[table], check_categorical=False)
+
+
+def without_airports(df, airports):
+    """Flights that neither leave from nor arrive at `airports`"""
+    return df[~(df['ORIGIN'].isin(airports) | df['DEST'].isin(airports)).to_numpy()]
+
+
+@pytest.mark.parametrize('weather_mode', ['flight', 'station'])
+def test_filtered_and_sampled_plan_matches_eager_stages(dataset_dir, tmp_path, weather_mode):
+    flights_csv = str(dataset_dir / 'CompleteData.csv')
+    dropped = ['AAA', 'BJP', 'CTE']
+
+    eager = quietly(extract_flights_data, flights_csv, str(tmp_path / 'extract.arrow'), list(FLIGHTS_SCHEMA),
+                    streaming=True, chunksize=5_000)
+    all_airports = flight_airports_of(eager)
+    eager = quietly(stratified_sample, without_airports(eager, dropped), 0.2, seed=3)
+    eager_airports = flight_airports_of(eager)
+    eager = quietly(remove_duplicates, eager, subset=DEDUP_SUBSET)
+    if weather_mode == 'station':
+        eager = quietly(interpolate_weather_from_stations, eager, build_station_weather(eager), tolerance=TOLERANCE)
+    else:
+        eager = quietly(interpolate_all_weather_columns, eager)
+    eager = quietly(clean_flights_csv_data, eager)
+
+    plan = (LazyFlights.scan(flights_csv, list(FLIGHTS_SCHEMA), chunksize=5_000)
+            .filter(without_airports, ['ORIGIN', 'DEST'], "flights away from the dropped airports",
+                    airports=dropped)
+            .sample(0.2, seed=3)
+            .tap('flight_airports', flight_airports_of, ['ORIGIN', 'DEST'])
+            .remove_duplicates(subset=DEDUP_SUBSET)
+            .interpolate_weather(weather_mode, tolerance=TOLERANCE)
+            .clean()
+            .select(STAR_SCHEMA_INPUT_COLUMNS))
+    lazy, outputs = quietly(plan.execute)
+
+    pd.testing.assert_frame_equal(as_values(lazy.reset_index(drop=True)),
+                                  as_values(eager[STAR_SCHEMA_INPUT_COLUMNS].reset_index(drop=True)))
+    # The airports are those of the filtered sample, not of every scanned flight
+    assert outputs['flight_airports'] == eager_airports
+    assert not eager_airports & set(dropped) and set(dropped) <= all_airports
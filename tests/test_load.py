@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import generate_carriers
+from etl.load import (create_fact_table, create_star_schema_dimensions,
+                      iter_fact_chunks)
+from etl.schema import apply_flights_schema, flights_schema
+from etl.transform import (build_station_weather, clean_flights_csv_data,
+                           interpolate_all_weather_columns,
+                           interpolate_weather_from_stations, remove_duplicates)
+
+from conftest import DEDUP_SUBSET, quietly
+
+WEATHER_COLUMNS = ['WIND_SPD', 'TEMPERATURE', 'WEATHER_STATUS_DESCRIPTION', 'VISIBILITY']
+WEATHER_DECIMALS = {'WIND_SPD': 0, 'TEMPERATURE': 0, 'VISIBILITY': 1}
+WEATHER_STATUSES = {0: 'No weather events present', 1: 'Weather event(s) present',
+                    2: 'Significant weather event(s) present'}
+
+
+def rounded_weather(frame):
+    """Weather columns rounded in float64 with Series.round, so float32 and float64 values compare equal"""
+    return pd.DataFrame({col: frame[col].astype('float64').round(decimals).to_numpy()
+                         for col, decimals in WEATHER_DECIMALS.items()})
+
+
+def reference_fact_table(flights, dimensions):
+    """The foreign keys resolved with left merges on the dimension columns, as create_fact_table used to"""
+    weather = rounded_weather(flights).assign(
+        WEATHER_STATUS_DESCRIPTION=flights['ACTIVE_WEATHER'].astype(object).map(WEATHER_STATUSES)
+        .fillna('Unknown').to_numpy()
+    )
+    dim_weather = dimensions['dim_weather']
+    dim_weather = rounded_weather(dim_weather).assign(
+        weather_id=dim_weather['weather_id'].to_numpy(),
+        WEATHER_STATUS_DESCRIPTION=dim_weather['WEATHER_STATUS_DESCRIPTION'].to_numpy()
+    )
+    weather = weather.merge(dim_weather, on=WEATHER_COLUMNS, how='left')
+    airports = dimensions['dim_airports'][['iata_code', 'airport_id']]
+
+    def airport_ids(codes):
+        merged = pd.DataFrame({'iata_code': codes.astype(object).to_numpy()}).merge(airports, on='iata_code',
+                                                                                     how='left')
+        return merged['airport_id'].astype('Int64')
+
+    return pd.DataFrame({
+        'flight_id': np.arange(1, len(flights) + 1),
+        'date': pd.to_datetime(flights['FL_DATE']).to_numpy(),
+        'weather_id': weather['weather_id'].astype('Int64'),
+        'origin_airport_oid': airport_ids(flights['ORIGIN']),
+        'dest_airport_oid': airport_ids(flights['DEST'])
+    })
+
+
+@pytest.fixture(scope='module', params=[('flight', False), ('flight', True), ('station', False), ('station', True)],
+                ids=lambda param: f"{param[0]}-{'float32' if param[1] else 'float64'}")
+def star_input(request, synthetic_flights):
+    """Cleaned flights and station weather of both weather modes, with float64 and float32 weather"""
+    weather_mode, compact_weather = request.param
+    flights = apply_flights_schema(synthetic_flights, flights_schema(compact_weather))
+    flights = quietly(remove_duplicates, flights, subset=DEDUP_SUBSET)
+    station_weather = None
+    if weather_mode == 'station':
+        station_weather = build_station_weather(flights)
+        flights = quietly(interpolate_weather_from_stations, flights, station_weather)
+    else:
+        flights = quietly(interpolate_all_weather_columns, flights)
+    flights = quietly(clean_flights_csv_data, flights)
+    # a flight from an airport the dimension does not have resolves to <NA>
+    flights = flights.reset_index(drop=True)
+    flights['ORIGIN'] = flights['ORIGIN'].cat.add_categories('Q00')
+    flights.loc[0, 'ORIGIN'] = 'Q00'
+    return flights, station_weather
+
+
+def test_fact_keys_match_merge_reference(star_input, airports):
+    flights, station_weather = star_input
+    dimensions = create_star_schema_dimensions(flights, airports, generate_carriers(), station_weather)
+    fact_flights = quietly(create_fact_table, flights, dimensions)
+
+    expected = reference_fact_table(flights, dimensions)
+    actual = fact_flights[list(expected.columns)].astype({'weather_id': 'Int64'})
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+    assert fact_flights['origin_airport_oid'].isna().sum() == 1
+
+
+def test_fact_chunks_match_the_whole_table(star_input, airports):
+    flights, station_weather = star_input
+    dimensions = create_star_schema_dimensions(flights, airports, generate_carriers(), station_weather)
+    whole = quietly(create_fact_table, flights, dimensions)
+    chunks = quietly(lambda: list(iter_fact_chunks(flights, dimensions, chunksize=3_000)))
+    assert len(chunks) == -(-len(flights) // 3_000)
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), whole, check_dtype=False)
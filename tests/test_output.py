@@ -0,0 +1,62 @@
+import pandas as pd
+
+from utils.output import load_table_arrow, save_tables_arrow
+
+
+def fact_rows(dates, first_id=1):
+    dates = pd.to_datetime(dates)
+    return pd.DataFrame({
+        'flight_id': range(first_id, first_id + len(dates)),
+        'date': dates.astype('datetime64[s]'),
+        'TAIL_NUM': pd.Categorical([f"N{i}" for i in range(len(dates))])
+    })
+
+
+def test_replacing_an_export_removes_stale_partitions(tmp_path):
+    save_tables_arrow({'fact_flights': fact_rows(['2022-01-05', '2022-02-05', '2022-03-05'])}, '_star',
+                      output_dir=str(tmp_path))
+    save_tables_arrow({'fact_flights': fact_rows(['2022-01-06'])}, '_star', output_dir=str(tmp_path))
+
+    fact = load_table_arrow('fact_flights_star', input_dir=str(tmp_path))
+    assert fact['date'].tolist() == [pd.Timestamp('2022-01-06')]
+    assert sorted(p.name for p in (tmp_path / 'fact_flights_star' / 'year=2022').iterdir()) == ['month=01']
+    assert not list(tmp_path.glob('*.tmp')) and not list(tmp_path.glob('*.old'))
+
+
+def test_append_adds_parts_within_a_month(tmp_path):
+    dimension = pd.DataFrame({'date_id': [1], 'year': [2022]})
+    save_tables_arrow({'fact_flights': fact_rows(['2022-01-05', '2022-02-05']), 'dim_date': dimension}, '_star',
+                      output_dir=str(tmp_path))
+    save_tables_arrow({'fact_flights': fact_rows(['2022-02-06', '2022-03-01'], first_id=3),
+                       'dim_date': dimension.assign(date_id=2)},
+                      '_star', output_dir=str(tmp_path), append=['fact_flights', 'dim_date'])
+
+    fact = load_table_arrow('fact_flights_star', input_dir=str(tmp_path))
+    assert sorted(fact['flight_id']) == [1, 2, 3, 4]
+    february = tmp_path / 'fact_flights_star' / 'year=2022' / 'month=02'
+    assert sorted(p.name for p in february.iterdir()) == ['part-0.arrow', 'part-1.arrow']
+    assert load_table_arrow('fact_flights_star', months=['2022-02'], input_dir=str(tmp_path))['flight_id'].tolist() == [2, 3]
+    assert load_table_arrow('dim_date_star', input_dir=str(tmp_path))['date_id'].tolist() == [1, 2]
+
+
+def test_columns_are_read_in_the_requested_order_from_compressed_files(tmp_path):
+    fact = fact_rows(['2022-01-05', '2022-01-06', '2022-02-05'])
+    save_tables_arrow({'fact_flights': fact, 'dim_date': pd.DataFrame({'date_id': [1, 2], 'year': [2022, 2023]})},
+                      '_star', output_dir=str(tmp_path), compression='zstd')
+
+    loaded = load_table_arrow('fact_flights_star', columns=['TAIL_NUM', 'flight_id'], input_dir=str(tmp_path))
+    pd.testing.assert_frame_equal(loaded, fact[['TAIL_NUM', 'flight_id']])
+    assert load_table_arrow('dim_date_star', columns=['year'], input_dir=str(tmp_path))['year'].tolist() == [2022, 2023]
+
+
+def test_an_export_without_the_fact_table_removes_the_old_one(tmp_path):
+    dimension = pd.DataFrame({'date_id': [1], 'year': [2022]})
+    save_tables_arrow({'fact_flights': fact_rows(['2022-01-05']), 'dim_date': dimension,
+                       'dim_old': dimension}, '_star', output_dir=str(tmp_path))
+    save_tables_arrow({'dim_date': dimension.assign(year=2023)}, '_other', output_dir=str(tmp_path))
+
+    # A pipelined run exports the dimensions and cubes only
+    save_tables_arrow({'dim_date': dimension.assign(date_id=2)}, '_star', output_dir=str(tmp_path))
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['dim_date_other.arrow', 'dim_date_star.arrow']
+    assert load_table_arrow('dim_date_star', input_dir=str(tmp_path))['date_id'].tolist() == [2]
+    assert load_table_arrow('dim_date_other', input_dir=str(tmp_path))['year'].tolist() == [2023]
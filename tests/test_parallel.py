@@ -0,0 +1,51 @@
+import pandas as pd
+
+from etl.parallel import (parallel_clean_flights, parallel_interpolate_weather,
+                          parallel_remove_duplicates)
+from etl.transform import (clean_flights_csv_data, fill_weather_columns,
+                           finalize_weather_columns,
+                           interpolate_all_weather_columns,
+                           prepare_weather_columns, remove_duplicates,
+                           weather_datetime)
+
+from conftest import DEDUP_SUBSET, with_output
+
+# Real worker processes, and more partitions than workers so every worker runs several
+PARALLEL = {'max_workers': 2, 'n_partitions': 7}
+
+
+def test_parallel_dedup_matches_serial(synthetic_flights):
+    serial, serial_log = with_output(remove_duplicates, synthetic_flights, subset=DEDUP_SUBSET)
+    parallel, parallel_log = with_output(parallel_remove_duplicates, synthetic_flights, subset=DEDUP_SUBSET,
+                                         **PARALLEL)
+    assert len(serial) < len(synthetic_flights)
+    pd.testing.assert_frame_equal(parallel, serial)
+    assert parallel_log == serial_log
+
+
+def test_parallel_interpolation_matches_serial(deduplicated_flights):
+    serial, serial_log = with_output(interpolate_all_weather_columns, deduplicated_flights)
+    parallel, parallel_log = with_output(parallel_interpolate_weather, deduplicated_flights, **PARALLEL)
+    pd.testing.assert_frame_equal(parallel, serial, check_exact=True)
+    assert parallel_log == serial_log
+
+
+def test_parallel_interpolation_with_shared_flight_times_matches_serial(deduplicated_flights):
+    # The lazy plan hands the flight time to the fill as a hidden column
+    df = deduplicated_flights.assign(__flight_time=weather_datetime(deduplicated_flights))
+    prepared = prepare_weather_columns(df)
+    serial = finalize_weather_columns(fill_weather_columns(prepared, times=prepared['__flight_time']))
+    parallel = with_output(parallel_interpolate_weather, df, times_column='__flight_time', **PARALLEL)[0]
+    pd.testing.assert_frame_equal(parallel, serial, check_exact=True)
+
+
+def test_parallel_cleaning_matches_serial(deduplicated_flights, tmp_path):
+    interpolated = with_output(interpolate_all_weather_columns, deduplicated_flights)[0]
+    serial, serial_log = with_output(clean_flights_csv_data, interpolated,
+                                     quarantine_path=str(tmp_path / 'serial.csv'))
+    parallel, parallel_log = with_output(parallel_clean_flights, interpolated,
+                                         quarantine_path=str(tmp_path / 'parallel.csv'), **PARALLEL)
+    assert len(serial) < len(interpolated)
+    pd.testing.assert_frame_equal(parallel, serial)
+    assert parallel_log.replace('parallel.csv', 'serial.csv') == serial_log
+    assert (tmp_path / 'parallel.csv').read_text() == (tmp_path / 'serial.csv').read_text()
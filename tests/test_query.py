@@ -0,0 +1,140 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import generate_carriers
+from etl.load import create_fact_table, create_star_schema_dimensions
+from etl.query import StarQuery
+
+from conftest import quietly
+
+MEASURES = ['flights', 'cancelled_flights', 'cancellation_rate', 'delay_count', 'delay_sum', 'avg_delay']
+
+
+@pytest.fixture(scope='module')
+def star_schema(cleaned_flights, airports):
+    dimensions = create_star_schema_dimensions(cleaned_flights, airports, generate_carriers())
+    return {'fact_flights': quietly(create_fact_table, cleaned_flights, dimensions), **dimensions}
+
+
+@pytest.fixture(scope='module')
+def fact_rows(star_schema):
+    """Every fact row with its query attributes, resolved with plain pandas maps"""
+    fact = star_schema['fact_flights']
+    iata_codes = star_schema['dim_airports'].set_index('airport_id')['iata_code'].astype(object)
+    carriers = (star_schema['dim_aircraft'].drop_duplicates('TAIL_NUM')
+                .set_index('TAIL_NUM')['OP_UNIQUE_CARRIER'].astype(object))
+    statuses = star_schema['dim_weather'].set_index('weather_id')['WEATHER_STATUS_DESCRIPTION']
+    dates = pd.to_datetime(fact['date']).dt.normalize()
+    return pd.DataFrame({
+        'date': dates,
+        'month': dates.dt.strftime('%Y-%m'),
+        'origin': fact['origin_airport_oid'].map(iata_codes),
+        'dest': fact['dest_airport_oid'].map(iata_codes),
+        'carrier': fact['TAIL_NUM'].astype(object).map(carriers),
+        'weather_status': fact['weather_id'].map(statuses),
+        'hour': fact['scheduled_dep_time'].astype(object),
+        'cancelled': fact['is_cancelled'],
+        'delay': fact['departure_delay'].astype('float64')
+    })
+
+
+def reference_query(rows, group_by):
+    """The query measures with a pandas groupby"""
+    grouped = rows.assign(delay_present=rows['delay'].notna()).groupby(group_by, dropna=False)
+    result = pd.DataFrame({
+        'flights': grouped.size(),
+        'cancelled_flights': grouped['cancelled'].sum(),
+        'delay_count': grouped['delay_present'].sum(),
+        'delay_sum': grouped['delay'].sum()
+    })
+    result['cancellation_rate'] = result['cancelled_flights'] / result['flights']
+    result['avg_delay'] = result['delay_sum'] / result['delay_count'].where(result['delay_count'] > 0)
+    return _comparable(result.reset_index(), group_by)
+
+
+def _comparable(result, group_by):
+    result = result.astype({col: object for col in group_by})
+    result[group_by] = result[group_by].where(result[group_by].notna(), '<NA>')
+    result = result.sort_values(group_by, key=lambda col: col.astype(str)).reset_index(drop=True)
+    return result[group_by + MEASURES].astype({col: 'float64' for col in MEASURES})
+
+
+def flights(engine, **kwargs):
+    result = engine.query(measures=['flights'], **kwargs)
+    return int(result['flights'].sum())
+
+
+@pytest.mark.parametrize('group_by', [['origin'], ['carrier', 'month'], ['weather_status', 'hour'], ['dest', 'date']])
+def test_grouped_measures_match_a_pandas_groupby(star_schema, fact_rows, group_by):
+    result = StarQuery(star_schema).query(measures=MEASURES, group_by=group_by)
+    pd.testing.assert_frame_equal(_comparable(result, group_by), reference_query(fact_rows, group_by),
+                                  check_exact=False, rtol=1e-12)
+
+
+def test_date_range_bounds_are_inclusive_days(star_schema, fact_rows):
+    engine = StarQuery(star_schema)
+    dates = np.sort(fact_rows['date'].unique())
+    first, last = pd.Timestamp(dates[9]), pd.Timestamp(dates[19])
+
+    def expected(start, end):
+        return int(fact_rows['date'].between(start, end).sum())
+
+    assert flights(engine, date_from=first, date_to=last) == expected(first, last)
+    # Times of day are ignored: both bounds are whole days
+    assert flights(engine, date_from=first + pd.Timedelta(hours=18), date_to=str(last.date())) == expected(first, last)
+    assert flights(engine, date_from=first, date_to=first) == expected(first, first) > 0
+    assert flights(engine, date_from=first) == expected(first, dates[-1])
+    assert flights(engine, date_to=last) == expected(dates[0], last)
+    assert flights(engine, date_from=last, date_to=first) == 0
+    assert flights(engine, date_from=pd.Timestamp(dates[-1]) + pd.Timedelta(days=1)) == 0
+    assert flights(engine) == len(fact_rows)
+
+
+def test_attribute_filters_match_pandas(star_schema, fact_rows):
+    engine = StarQuery(star_schema)
+    origins = sorted(fact_rows['origin'].dropna().unique())[:3]
+    carrier = sorted(fact_rows['carrier'].dropna().unique())[0]
+    month = sorted(fact_rows['month'].unique())[1]
+    selections = [
+        ({'origin': origins}, fact_rows['origin'].isin(origins)),
+        ({'origin': origins[0], 'carrier': carrier}, (fact_rows['origin'] == origins[0])
+         & (fact_rows['carrier'] == carrier)),
+        ({'month': month, 'weather_status': 'Weather event(s) present'},
+         (fact_rows['month'] == month) & (fact_rows['weather_status'] == 'Weather event(s) present')),
+        ({'hour': [6, 7], 'dest': origins}, fact_rows['hour'].isin([6, 7]) & fact_rows['dest'].isin(origins)),
+        ({'date': [str(fact_rows['date'].iloc[0].date())], 'origin': origins},
+         (fact_rows['date'] == fact_rows['date'].iloc[0]) & fact_rows['origin'].isin(origins)),
+        ({'origin': 'Q00'}, pd.Series(False, index=fact_rows.index))
+    ]
+    for filters, selected in selections:
+        result = engine.query(measures=MEASURES, group_by=['carrier'], **filters)
+        expected = reference_query(fact_rows[selected.to_numpy()], ['carrier'])
+        pd.testing.assert_frame_equal(_comparable(result, ['carrier']), expected, check_exact=False, rtol=1e-12)
+
+
+def test_cache_evicts_the_least_recently_used_query(star_schema):
+    engine = StarQuery(star_schema, cache_size=2)
+    engine.query(group_by=['origin'])
+    engine.query(group_by=['carrier'])
+    engine.query(group_by=['origin'])  # hit, 'carrier' is now the least recently used
+    engine.query(group_by=['month'])
+    assert engine.cache_info() == {'hits': 1, 'misses': 3, 'size': 2, 'max_size': 2}
+    engine.query(group_by=['origin'])
+    assert engine.cache_info()['hits'] == 2
+    engine.query(group_by=['carrier'])
+    assert engine.cache_info()['misses'] == 4
+
+    # Spellings of the same day share one cache entry, and cached results are copies
+    first = engine.query(date_from='2022-01-05', date_to=pd.Timestamp('2022-01-06'))
+    first['flights'] = 0
+    again = engine.query(date_from=pd.Timestamp('2022-01-05 12:00'), date_to='2022-01-06')
+    assert engine.cache_info()['hits'] == 3 and (again['flights'] > 0).all()
+
+
+def test_delay_sums_keep_float64_precision(star_schema):
+    engine = StarQuery(star_schema)
+    assert engine.delay.dtype == np.float64
+    fact = star_schema['fact_flights']
+    expected = fact['departure_delay'].astype('float64').sum()
+    assert engine.query(measures=['delay_sum'])['delay_sum'].sum() == pytest.approx(expected, rel=1e-15)
@@ -0,0 +1,72 @@
+import pandas as pd
+import pytest
+
+from etl.cache import read_cache_metadata
+from etl.extract import extract_flights_data
+from etl.lazy import LazyFlights
+from etl.sampling import (SAMPLE_COVERAGE, SAMPLE_STRATA, SampleCandidates,
+                          sample_cache_path, stratified_sample)
+from etl.schema import FLIGHTS_SCHEMA
+
+from conftest import as_values, quietly
+
+
+def _sample(flights, rate, seed=0, **kwargs):
+    return quietly(stratified_sample, flights, rate, seed=seed, **kwargs)
+
+
+def test_sample_is_reproducible(synthetic_flights):
+    first = _sample(synthetic_flights, 0.1, seed=3)
+    pd.testing.assert_frame_equal(first, _sample(synthetic_flights, 0.1, seed=3))
+    assert not first.index.equals(_sample(synthetic_flights, 0.1, seed=4).index)
+
+
+@pytest.mark.parametrize('rate', [0.02, 0.1, 0.3])
+def test_sample_covers_every_stratum_and_value(synthetic_flights, rate):
+    sample = _sample(synthetic_flights, rate)
+    for col in SAMPLE_COVERAGE:
+        assert set(sample[col].dropna()) == set(synthetic_flights[col].dropna())
+
+    def strata(df):
+        keys = df.assign(month=df['FL_DATE'].dt.to_period('M'))[SAMPLE_STRATA].astype(object)
+        return set(keys.itertuples(index=False, name=None))
+    assert strata(sample) == strata(synthetic_flights)
+
+
+@pytest.mark.parametrize('rate', [0.1, 0.3])
+def test_sample_is_capped_at_the_rate(synthetic_flights, rate):
+    sample = _sample(synthetic_flights, rate)
+    assert round(rate * len(synthetic_flights)) - 5 <= len(sample) <= round(rate * len(synthetic_flights))
+
+
+def test_sample_of_an_empty_frame_is_empty(synthetic_flights):
+    empty = synthetic_flights.iloc[:0]
+    assert _sample(empty, 0.1).empty
+    candidates = SampleCandidates(0.1)
+    assert candidates(empty).empty and candidates.sample(candidates(empty)).empty
+
+
+@pytest.mark.parametrize('engine', ['c', 'pyarrow'])
+def test_sample_taken_while_reading_matches_in_memory_sample(dataset_dir, tmp_path, engine):
+    flights_csv = str(dataset_dir / 'CompleteData.csv')
+    columns = list(FLIGHTS_SCHEMA)
+    flights = quietly(extract_flights_data, flights_csv, str(tmp_path / 'full.arrow'), columns,
+                      streaming=True, chunksize=3_000, engine=engine)
+    expected = _sample(flights, 0.1, seed=5).reset_index(drop=True)
+
+    cache_path = sample_cache_path(str(tmp_path / 'full.arrow'), 0.1, 5)
+    for streaming in (True, False):
+        sample = quietly(extract_flights_data, flights_csv, cache_path, columns, streaming=streaming,
+                         chunksize=3_000, engine=engine, sample_rate=0.1, sample_seed=5)
+        if engine == 'c' or streaming:
+            pd.testing.assert_frame_equal(as_values(sample), as_values(expected))
+        assert read_cache_metadata(cache_path) == {'rows_total': str(len(flights))}
+        cache_path = str(tmp_path / 'in_memory.arrow')
+
+    # The lazy plan picks the candidates in its scan and samples them the same way
+    plan = LazyFlights.scan(flights_csv, columns, chunksize=3_000, engine=engine).sample(0.1, seed=5)
+    lazy, outputs = quietly(plan.execute)
+    assert "keep sample candidates of every chunk" in plan.explain()
+    assert outputs['rows_scanned'] == len(flights)
+    assert outputs['rows_sampled'] == len(expected)
+    pd.testing.assert_frame_equal(as_values(lazy.reset_index(drop=True)), as_values(expected))
@@ -0,0 +1,59 @@
+import pandas as pd
+import pytest
+
+from etl.extract import read_flights_streaming
+from etl.schema import FLIGHTS_SCHEMA, apply_flights_schema, concat_frames
+
+from conftest import quietly
+
+COLUMNS = ['FL_DATE', 'DEP_HOUR', 'DEP_DELAY', 'CANCELLED', 'ORIGIN']
+
+
+def write_flights(path, cancelled):
+    pd.DataFrame({
+        'FL_DATE': ['2022-01-01', '2022-01-01', '2022-01-02', '2022-01-02'],
+        'DEP_HOUR': [5, None, 7, 23],
+        'DEP_DELAY': [1.25, -3.0, None, 12.5],
+        'CANCELLED': cancelled,
+        'ORIGIN': ['AAA', 'BBB', 'AAA', 'CCC']
+    }).to_csv(path, index=False)
+    return str(path)
+
+
+def test_delay_keeps_float64_precision():
+    assert FLIGHTS_SCHEMA['DEP_DELAY'] == 'float64'
+
+
+@pytest.mark.parametrize('engine', ['c', 'pyarrow'])
+def test_integral_values_are_downcast_while_reading(tmp_path, engine):
+    flights_csv = write_flights(tmp_path / 'flights.csv', [0, 1, None, 0])
+    df = quietly(read_flights_streaming, flights_csv, COLUMNS, chunksize=2, engine=engine)
+    assert str(df['DEP_HOUR'].dtype) == 'Int8' and str(df['CANCELLED'].dtype) == 'Int8'
+    assert df['CANCELLED'].tolist() == [0, 1, pd.NA, 0]
+
+
+@pytest.mark.parametrize('engine', ['c', 'pyarrow'])
+def test_fractional_values_in_integer_columns_stay_float(tmp_path, engine):
+    # Only the second chunk has the fractional value
+    flights_csv = write_flights(tmp_path / 'flights.csv', [0, 1, 5.5, 0])
+    df = quietly(read_flights_streaming, flights_csv, COLUMNS, chunksize=2, engine=engine)
+    expected = pd.read_csv(flights_csv)
+    assert df['CANCELLED'].dtype == 'float64'
+    pd.testing.assert_series_equal(df['CANCELLED'], expected['CANCELLED'])
+    assert str(df['DEP_HOUR'].dtype) == 'Int8'
+
+
+def test_apply_schema_keeps_out_of_range_and_fractional_values():
+    df = pd.DataFrame({'CANCELLED': ['1', '5.5', None], 'DEP_HOUR': [3.0, 300.0, None],
+                       'YEAR OF MANUFACTURE': [1999.0, None, 2011.0]})
+    result = quietly(apply_flights_schema, df)
+    assert result['CANCELLED'].tolist()[:2] == [1.0, 5.5] and result['CANCELLED'].dtype == 'float64'
+    assert result['DEP_HOUR'].tolist()[:2] == [3.0, 300.0] and result['DEP_HOUR'].dtype == 'float64'
+    assert str(result['YEAR OF MANUFACTURE'].dtype) == 'Int16'
+
+
+def test_concat_of_no_frames_is_an_empty_schema_frame():
+    empty = concat_frames([])
+    assert empty.empty and list(empty.columns) == list(FLIGHTS_SCHEMA)
+    assert {col: str(dtype) for col, dtype in empty.dtypes.items()} == FLIGHTS_SCHEMA
+    assert list(concat_frames([None], schema={'ORIGIN': 'category'}).columns) == ['ORIGIN']
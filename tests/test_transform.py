@@ -0,0 +1,184 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.bench_interpolation import (make_weather_frame,
+                                            reference_interpolate_all_weather_columns)
+from etl.schema import apply_flights_schema, flights_schema
+from etl.transform import (CLEANING_RULES, WEATHER_NUMERIC_COLUMNS,
+                           attach_station_weather, build_station_weather,
+                           clean_flights_csv_data,
+                           interpolate_all_weather_columns,
+                           interpolate_weather_from_stations, weather_datetime)
+
+from conftest import quietly, with_output
+
+
+@pytest.mark.parametrize('missing_rate', [0.05, 0.2, 0.6])
+def test_interpolation_matches_groupby_reference_on_raw_frames(missing_rate):
+    # Object strings and float columns, as pd.read_csv returns them without the schema
+    df = make_weather_frame(20_000, airports=30, days=60, missing_rate=missing_rate, seed=1)
+    pd.testing.assert_frame_equal(quietly(interpolate_all_weather_columns, df),
+                                  quietly(reference_interpolate_all_weather_columns, df), check_exact=True)
+
+
+@pytest.mark.parametrize('compact_weather', [False, True])
+def test_interpolation_matches_groupby_reference_in_the_schema_dtypes(synthetic_flights, compact_weather):
+    df = apply_flights_schema(synthetic_flights, flights_schema(compact_weather))
+    pd.testing.assert_frame_equal(quietly(interpolate_all_weather_columns, df),
+                                  quietly(reference_interpolate_all_weather_columns, df), check_exact=True)
+
+
+def test_interpolation_fills_airports_without_any_observation_of_a_column():
+    df = make_weather_frame(2_000, airports=5, days=10, seed=2)
+    df.loc[df['ORIGIN'] == 'A001', 'ACTIVE_WEATHER'] = None
+    df.loc[df['ORIGIN'] == 'A002', 'TEMPERATURE'] = None
+    actual = quietly(interpolate_all_weather_columns, df)
+    pd.testing.assert_frame_equal(actual, quietly(reference_interpolate_all_weather_columns, df), check_exact=True)
+    assert not actual['ORIGIN'].isin(['A001', 'A002']).any()
+
+
+def reference_station_weather(df):
+    """One station at a time: first observation per hour, reindexed to every hour and filled"""
+    weather_cols = WEATHER_NUMERIC_COLUMNS + ['ACTIVE_WEATHER']
+    df = df.assign(hour=weather_datetime(df).dt.floor('h')).dropna(subset=weather_cols, how='all')
+    stations = []
+    for origin, group in df.groupby('ORIGIN', sort=True):
+        observed = group.groupby('hour')[weather_cols].first()
+        hours = pd.date_range(observed.index.min(), observed.index.max(), freq='h', name='hour')
+        station = observed.reindex(hours)
+        station['ACTIVE_WEATHER'] = station['ACTIVE_WEATHER'].ffill().bfill()
+        for col in WEATHER_NUMERIC_COLUMNS:
+            station[col] = station[col].interpolate(method='time')
+        stations.append(station.reset_index().assign(ORIGIN=origin))
+    return pd.concat(stations, ignore_index=True)[['ORIGIN', 'hour'] + weather_cols]
+
+
+def reference_attach_station_weather(df, station_weather, tolerance, times):
+    """
+    Every (flight, observation) pair of the same ORIGIN within tolerance, keeping the closest one.
+    On a tie the earlier observation wins, as in merge_asof's nearest direction.
+    """
+    weather_cols = [col for col in station_weather.columns if col not in ('ORIGIN', 'hour')]
+    flights = df.drop(columns=weather_cols).assign(_row=np.arange(len(df)))
+    pairs = flights[['_row', 'ORIGIN']].assign(_time=times.to_numpy()).merge(station_weather, on='ORIGIN')
+    pairs = pairs.assign(_distance=(pairs['_time'] - pairs['hour']).abs())
+    pairs = pairs[pairs['_distance'] <= tolerance]
+    nearest = pairs.sort_values(['_row', '_distance', 'hour']).drop_duplicates('_row')
+    result = flights.merge(nearest[['_row'] + weather_cols], on='_row', how='left')
+    result.index = df.index
+    return result[list(df.columns)]
+
+
+@pytest.fixture(scope='module')
+def station_flights():
+    df = make_weather_frame(6_000, airports=8, days=20, missing_rate=0.3, seed=3)
+    # An airport with flights but no observation at all
+    df.loc[df['ORIGIN'] == 'A005', WEATHER_NUMERIC_COLUMNS + ['ACTIVE_WEATHER']] = np.nan
+    return df
+
+
+def test_station_weather_matches_a_per_station_reindex(station_flights):
+    actual = quietly(build_station_weather, station_flights)
+    expected = reference_station_weather(station_flights)
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+    assert 'A005' not in set(actual['ORIGIN'])
+
+
+@pytest.mark.parametrize('tolerance', [pd.Timedelta(0), pd.Timedelta(minutes=30), pd.Timedelta(hours=3)])
+def test_station_join_matches_the_nearest_observation_within_tolerance(station_flights, tolerance):
+    station_weather = quietly(build_station_weather, station_flights)
+    # Gaps of several hours in the series, so some flights have no observation in range
+    station_weather = station_weather.sample(frac=0.4, random_state=0).sort_index()
+    # Departures on the hour, on the half hour (equally close to two observations) and in between
+    rng = np.random.default_rng(4)
+    minutes = rng.choice([0, 30, 17, 45, 90, 180, 181], len(station_flights))
+    times = weather_datetime(station_flights) + pd.to_timedelta(minutes, unit='min')
+    flights = station_flights.set_axis(np.arange(len(station_flights))[::-1] * 2)
+
+    actual = attach_station_weather(flights, station_weather, tolerance=tolerance, times=times.set_axis(flights.index))
+    expected = reference_attach_station_weather(flights, station_weather, tolerance, times)
+    pd.testing.assert_frame_equal(actual, expected)
+    unmatched = actual['ACTIVE_WEATHER'].isna()
+    assert unmatched.any() and not unmatched.all()
+    assert unmatched[flights['ORIGIN'] == 'A005'].all()
+
+
+def test_station_weather_leaves_flights_out_of_range_without_weather(station_flights):
+    station_weather = quietly(build_station_weather, station_flights)
+    actual = quietly(interpolate_weather_from_stations, station_flights, station_weather,
+                     tolerance=pd.Timedelta(hours=1))
+    times = weather_datetime(station_flights)
+    expected = reference_attach_station_weather(station_flights, station_weather, pd.Timedelta(hours=1), times)
+    expected = expected.reset_index(drop=True).dropna(subset=WEATHER_NUMERIC_COLUMNS + ['ACTIVE_WEATHER'])
+    pd.testing.assert_frame_equal(actual, expected)
+    assert not actual['ORIGIN'].eq('A005').any()
+
+
+def reference_clean_flights(df):
+    """The rules as the original one-filter-per-rule implementation applied them"""
+    initial_count = len(df)
+    df = df[(df['DEP_DELAY'] >= -60)]
+    new_count = len(df)
+    print(f"Flights CSV: Removed {initial_count - len(df)} invalid rows after delay cleaning")
+    df = df[~((df['DEP_HOUR'] > 0) & (df['CANCELLED'] > 0)).fillna(False)]
+    print(f"Flights CSV: Removed {new_count - len(df)} invalid rows after cancellation cleaning")
+    new_count = len(df)
+    df = df[(df['TEMPERATURE'] <= 60) & (df['TEMPERATURE'] >= -40)]
+    print(f"Flights CSV: Removed {new_count - len(df)} invalid rows after temperature cleaning")
+    new_count = len(df)
+    df = df[(df['WIND_SPD'] <= 35) & (df['WIND_SPD'] >= 0)]
+    print(f"Flights CSV: Removed {new_count - len(df)} invalid rows after wind speed cleaning")
+    new_count = len(df)
+    df = df[(df['MANUFACTURER'].notna()) & (df['MANUFACTURER'].str.lower() != 'unknown')]
+    print(f"Flights CSV: Removed {new_count - len(df)} invalid rows after manufacturer cleaning")
+    return df
+
+
+@pytest.fixture(scope='module')
+def dirty_flights(synthetic_flights):
+    """Interpolated flights with rows at, beyond and around every rule's limits"""
+    df = quietly(interpolate_all_weather_columns, synthetic_flights).reset_index(drop=True)
+    missing = [value for value in ['Unknown', 'UNKNOWN'] if value not in df['MANUFACTURER'].cat.categories]
+    df['MANUFACTURER'] = df['MANUFACTURER'].cat.add_categories(missing)
+    edits = [
+        ('DEP_DELAY', [-60, -60.5, None]),
+        ('TEMPERATURE', [60, 60.1, -40, -40.1, None]),
+        ('WIND_SPD', [0, -0.1, 35, 35.1, None]),
+        ('MANUFACTURER', ['Unknown', 'UNKNOWN', None])
+    ]
+    row = 0
+    for col, values in edits:
+        for value in values:
+            df.loc[row, col] = value
+            row += 1
+    df.loc[row:row + 3, ['DEP_HOUR', 'CANCELLED']] = [[0, 1], [3, 1], [None, 1], [3, None]]
+    return df
+
+
+@pytest.mark.parametrize('dtypes', ['schema', 'raw'])
+def test_cleaning_rules_match_sequential_filters(dirty_flights, dtypes):
+    df = dirty_flights
+    if dtypes == 'raw':
+        # object strings and float64 columns, as pd.read_csv returns them
+        df = df.astype({col: object if isinstance(dtype, pd.CategoricalDtype) else 'float64'
+                        for col, dtype in df.dtypes.items() if col != 'FL_DATE'})
+    expected, expected_log = with_output(reference_clean_flights, df)
+    actual, actual_log = with_output(clean_flights_csv_data, df)
+    pd.testing.assert_frame_equal(actual, expected)
+    assert actual_log == expected_log
+
+
+def test_quarantine_records_the_first_rule_that_rejected_each_row(dirty_flights, tmp_path):
+    path = tmp_path / 'quarantine.csv'
+    kept = quietly(clean_flights_csv_data, dirty_flights, quarantine_path=str(path))
+    quarantined = pd.read_csv(path)
+    assert len(kept) + len(quarantined) == len(dirty_flights)
+
+    # Each row is rejected by the first rule that removes it when the rules are applied one at a time
+    remaining, reasons = dirty_flights, {}
+    for rule in CLEANING_RULES:
+        passed = quietly(clean_flights_csv_data, remaining, rules=[rule])
+        reasons.update(dict.fromkeys(remaining.index.difference(passed.index), rule['name']))
+        remaining = passed
+    assert quarantined['REJECT_REASON'].tolist() == [reasons[i] for i in sorted(reasons)]
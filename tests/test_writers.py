@@ -0,0 +1,118 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import generate_carriers
+from etl.aggregates import build_delay_cubes
+from etl.load import create_fact_table, create_star_schema_dimensions
+from etl.physical_design import FOREIGN_KEYS, INDEXES, PRIMARY_KEYS
+from etl.writers import SQLITE_LOAD_PRAGMAS, SQLiteWriter
+
+from conftest import as_values, quietly
+
+BATCH_SIZE = 300
+
+
+class RecordingConnection:
+    """A sqlite3 connection that records the statements it runs and the size of every executemany batch"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.calls = []
+        self.pragmas = {pragma: conn.execute(f"PRAGMA {pragma}").fetchone()[0] for pragma in SQLITE_LOAD_PRAGMAS}
+
+    def execute(self, statement, *args):
+        self.calls.append(('execute', statement))
+        return self.conn.execute(statement, *args)
+
+    def executemany(self, statement, rows):
+        rows = list(rows)
+        self.calls.append(('executemany', statement, len(rows)))
+        return self.conn.executemany(statement, rows)
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+@pytest.fixture(scope='module')
+def small_star_schema(cleaned_flights, airports):
+    flights = cleaned_flights.head(2_000)
+    dimensions = create_star_schema_dimensions(flights, airports, generate_carriers())
+    fact_flights = quietly(create_fact_table, flights, dimensions)
+    cubes = quietly(build_delay_cubes, fact_flights, dimensions)
+    return {'fact_flights': fact_flights, **dimensions, **cubes}
+
+
+@pytest.fixture
+def recorded_writer(tmp_path, monkeypatch):
+    writer = SQLiteWriter(str(tmp_path / 'warehouse.db'), batch_size=BATCH_SIZE)
+    connections = []
+    connect = SQLiteWriter._connect
+
+    def recording_connect(self, pragmas=None):
+        connections.append(RecordingConnection(connect(self, pragmas)))
+        return connections[-1]
+    monkeypatch.setattr(SQLiteWriter, '_connect', recording_connect)
+    return writer, connections
+
+
+def test_star_schema_round_trip(small_star_schema, recorded_writer):
+    writer, connections = recorded_writer
+    quietly(writer.write, small_star_schema)
+    calls = connections[0].calls
+
+    # The load pragmas, then one transaction of batched inserts followed by the indexes
+    assert connections[0].pragmas == {'journal_mode': 'wal', 'synchronous': 0, 'cache_size': -512 * 1024,
+                                      'temp_store': 2}
+    assert calls[0][1] == "BEGIN" and calls[-1][1] == "COMMIT"
+    last_insert = max(i for i, call in enumerate(calls) if call[0] == 'executemany')
+    first_index = min(i for i, call in enumerate(calls) if call[1].startswith('CREATE') and 'INDEX' in call[1])
+    assert last_insert < first_index
+    for table, df in small_star_schema.items():
+        batches = [call[2] for call in calls if call[0] == 'executemany' and f'"{table}_star"' in call[1]]
+        assert batches == [min(BATCH_SIZE, len(df) - start) for start in range(0, len(df), BATCH_SIZE)]
+
+    conn = sqlite3.connect(writer.path)
+    try:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+        for table, df in small_star_schema.items():
+            assert conn.execute(f'SELECT COUNT(*) FROM "{table}_star"').fetchone()[0] == len(df)
+            result = writer.read_table(conn, table)
+            assert list(result.columns) == list(df.columns)
+            pd.testing.assert_frame_equal(as_values(result), as_values(df), check_dtype=False)
+
+        declared = {column: declared_type
+                    for _, column, declared_type, *_ in conn.execute('PRAGMA table_info("fact_flights_star")')}
+        assert declared['date'] == 'TIMESTAMP' and declared['flight_id'] == 'INTEGER'
+        assert declared['departure_delay'] == 'REAL' and declared['TAIL_NUM'] == 'TEXT'
+        assert pd.api.types.is_datetime64_any_dtype(writer.read_table(conn, 'fact_flights')['date'])
+
+        indexes = {name: (table, unique) for name, table, unique in conn.execute(
+            "SELECT name, tbl_name, sql LIKE 'CREATE UNIQUE%' FROM sqlite_master WHERE type = 'index'")}
+        for table in PRIMARY_KEYS:
+            assert indexes[f'pk_{table}_star'] == (f'{table}_star', 1)
+        fact_columns = [column for column, _, _ in FOREIGN_KEYS['fact_flights']] + INDEXES['fact_flights']
+        for column in fact_columns:
+            assert indexes[f'idx_fact_flights_star_{column.lower()}'] == ('fact_flights_star', 0)
+        assert conn.execute("SELECT COUNT(*) FROM sqlite_stat1 WHERE tbl = 'fact_flights_star'").fetchone()[0] > 0
+    finally:
+        conn.close()
+
+
+def test_failed_append_rolls_back_the_whole_write(small_star_schema, recorded_writer):
+    writer, _ = recorded_writer
+    quietly(writer.write, small_star_schema)
+    new_dates = small_star_schema['dim_date'].assign(date=lambda df: df['date'] + pd.Timedelta(days=365))
+    # The dim_date rows are new, but the fact rows repeat their primary keys
+    with pytest.raises(sqlite3.IntegrityError):
+        quietly(writer.write, {'dim_date': new_dates, 'fact_flights': small_star_schema['fact_flights']},
+                if_exists='append')
+
+    conn = sqlite3.connect(writer.path)
+    try:
+        for table in ['dim_date', 'fact_flights']:
+            count = conn.execute(f'SELECT COUNT(*) FROM "{table}_star"').fetchone()[0]
+            assert count == len(small_star_schema[table])
+    finally:
+        conn.close()